@@ -35,44 +35,133 @@ Current status
         > View/Record buttons
         > Oscillo toggle button
     - runs dummy/NI-DAQmx acquisition from the new GUI.
++ 'NumPy Binary (native)' storage writes from a native thread (mosca.lib.nativeio),
+  fed directly from the NI-DAQmx callback.
++ DeviceManager freezes the channels in use into a read-only AcquisitionPlan upon every start
+  (mosca.plans): the storage, the view and the other consumers share its channel order and scales.
++ the oscillo draws the chunks once per frame, and sheds load when it cannot keep up
+  (mosca.views.PendingChunks/DisplayGovernor), without affecting the storage.
++ the settings of the drivers and the channels are declared as class-level `param.Parameter`s,
+  which generate both the GUI forms and the attribute access.
 
 + (TODO) reflect display settings to the acquisition.
 + (TODO) do __NOT__ call global instances directly! add get_instance() methods to ensure existence everywhere.
-+ (TODO) add "DataBuffer" class so that Oscillo view do not block data update for the plots.
 + (TODO) make plot width dynamically configurable.
 + (TODO) make directory view.
 + (TODO) add color control UI (QColorDialog) for channels.
-+ (TODO) cythonize numpy IO.
 + (TODO) add Notebook functionality (reST-like syntax)
 
+Usage
+-----
+
+Importing `mosca` does not build the GUI by itself: call `mosca.launch()`
+(as `python -m mosca` does) to set up the managers, their threads and the control window.
+
+The 'Layout' selector switches the oscillo between one plot per channel, a single plot
+of stacked traces (using the 'Display gain'/'Display offset' of each channel), and a
+digital-phosphor persistence image of the stacked channels (see `mosca.views`).
+The oscillo is redrawn at most 30 times per second with all the chunks that have arrived since
+the last frame; when the GUI cannot keep up, it draws fewer frames and fewer points per channel,
+and shows 'Display degraded' until it catches up again. The recording is never affected.
+
+The 'Spectrum' button opens a live PSD/spectrogram window of the displayed channels (see `mosca.spectra`).
+
+The 'Events' button turns on the online threshold detection (see `mosca.events`):
+the events are marked in the oscillo, and saved in a `_events.npy` sidecar file
+that is referenced from the `.cfg` file.
+
+The 'Average' button turns on the online sweep averaging (see `mosca.averaging`):
+the sweeps aligned to a trigger channel (or to a fixed period) are averaged in a live window,
+and the mean/variance are saved in a `_average.npz` sidecar file. Choose the
+'Sidecars only (no samples)' storage to save the average without the continuous samples.
+
+The digital input ports of a device (e.g. 'port0' of NI6321) can be turned on in its settings:
+they are acquired with the analog channels, and saved as packed words (one bit per line per sample)
+in a `_digital.npy` sidecar file, with a table of their edges in `_edges.npy` (see `mosca.digital`).
+
+Several boards can be acquired as one device, on the sample clock and the start trigger
+of the first one, with their chunks merged by sample index (see `mosca.composite`).
+
+The 'Playback' device replays a recording (`.npy` or `.zdat`, with its `.cfg`) at N times
+real time, or as fast as possible, in place of a board (see `mosca.recordings`).
+
+A closed-loop function can be run on every chunk from within the acquisition thread
+with `mosca.hooks.register()`; its latency histogram is reported upon every stop (see `mosca.hooks`).
+
+Setting `"stimulus": {"enabled": true, "channels": [...]}` in `config.json` plays a stimulus
+(pulses, ramps, sines or waveform files) on the analog outputs, sample-locked to the acquisition;
+the 'Dummy' device loops it back to its inputs (see `mosca.stimuli`).
+
+The 'Tune' button runs two short acquisitions (without saving), measures how long the consumer
+threads take per chunk, and sets the smallest update interval that leaves them the configured
+headroom. With `"tuning": {"adaptive": true}` in `config.json`, the chunks are delivered in larger
+batches while a consumer lags behind (see `mosca.tuning`).
+
+`python -m mosca convert -o OUTDIR PATH...` converts recordings into other layouts (.npy, .zdat,
+one file per channel; float32 or int16), optionally selecting, filtering and decimating the channels,
+on a pool of processes (see `mosca.convert`).
+
+`mosca.mapreduce.map_chunks()` runs an analysis function over the chunks of a recording (with
+the overlap it declares) on a pool of processes that read the memory-mapped file, and combines
+the results (`python -m mosca.bench mapreduce` compares it with loading the whole file).
+
+Setting `"catalog": {"enabled": true}` in `config.json` registers every saved acquisition
+(its rate, duration, channels, size, checksum and event counts) in a SQLite database, and makes
+the acquisition number skip the numbers registered earlier. `python -m mosca catalog search`
+finds acquisitions by rate, channel and date, and `python -m mosca catalog scan DIR` registers
+existing recordings (see `mosca.catalog`).
+
+Setting `"tap": {"enabled": true}` in `config.json` publishes the live samples to other local
+processes through shared memory and a Unix-domain socket (see `mosca.tap` and `mosca.tapclient`).
+
+Setting `"isolation": {"process": true}` in `config.json` runs DeviceManager and StorageManager
+in a separate worker process (see `mosca.workers`).
+
 """
 import os
+import time
 import json
 import traceback
+from collections import OrderedDict
 import numpy as np
 from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph as pg
 
-app = QtGui.QApplication([])
-pg.setConfigOption('background', 'w')
-pg.setConfigOption('foreground', 'k')
+from . import states, storages, devices, param, messages, channels, workers, scheduling, views, spectra
+from . import events, averaging, tap, stimuli, digital, tuning, catalog
 
-from . import states, storages, devices, param, messages, channels
+app = None
+StateManager = None
+StorageManager = None
+DeviceManager = None
+MessageManager = messages.MessageManager
 
-def setup():
+def load_config():
     modulepath = os.path.split(__file__)[0]
     configfile = os.path.join(modulepath, "config.json")
     with open(configfile, 'r') as f:
-        cfg = json.load(f)
-        states.setup(cfg)
-        storages.setup(cfg)
-        devices.setup(cfg)
-
-setup()
-StateManager = states.StateManager
-StorageManager = storages.StorageManager
-DeviceManager = devices.DeviceManager
-MessageManager = messages.MessageManager
+        return json.load(f)
+
+def setup(cfg=None):
+    """sets up the managers (but not the GUI) from the configuration."""
+    global StateManager, StorageManager, DeviceManager
+    if cfg is None:
+        cfg = load_config()
+    scheduling.setup(cfg)
+    states.setup(cfg)
+    storages.setup(cfg)
+    devices.setup(cfg)
+    events.setup(cfg)
+    averaging.setup(cfg)
+    digital.setup(cfg)
+    tap.setup(cfg)
+    stimuli.setup(cfg)
+    tuning.setup(cfg)
+    catalog.setup(cfg)
+    StateManager = states.StateManager
+    StorageManager = storages.StorageManager
+    DeviceManager = devices.DeviceManager
+    return cfg
 
 ##
 ## GUI components
@@ -82,9 +171,23 @@ TOGGLE_ACQ_VIEW = "View"
 TOGGLE_ACQ_REC  = "Record"
 TOGGLE_ACQ_ABO  = "Stop"
 TOGGLE_OSCILLO  = "Oscillo"
+TOGGLE_SPECTRUM = "Spectrum"
+TOGGLE_EVENTS   = "Events"
+TOGGLE_AVERAGE  = "Average"
+TUNE_INTERVAL   = "Tune"
+
+MARK_DTYPE = np.dtype([('time', 'f8'), ('lane', 'i4'), ('amplitude', 'f8')])
 
 def quitSequence():
     print("quit sequence...")
+    if acquisition().running == True:
+        # the storage is finalized before the devices are released
+        try:
+            acquisition().stop()
+        except:
+            traceback.print_exc()
+    workers.shutdown()
+    DeviceManager.release()
     for th in threads:
         th.quit()
 
@@ -283,7 +386,7 @@ class ChannelPanel(QtGui.QGroupBox):
 
 class ViewManager(models.SingletonManager):
     DEFAULT_PLOT_WIDTH = 5 # in sec
-    DEFAULT_CHUNK_LENGTH = 1
+    RENDERER_POOL_SIZE = 4
 
     @models.ensure_singleton
     def widget(cls):
@@ -296,14 +399,20 @@ class ViewManager(models.SingletonManager):
     @models.ensure_singleton
     def prepare(cls, save=True):
         cls._singleton._prepare()
-        with StateManager.donePlotting as evt:
-            evt.reset()
+        StateManager.donePlotting.clear()
 
     @models.ensure_singleton
     def finalize(cls):
         cls._singleton._finalize()
-        with StateManager.donePlotting as evt:
-            evt.set()
+        StateManager.donePlotting.set()
+
+    @models.ensure_singleton
+    def mark_events(cls, detected):
+        cls._singleton._mark_events(detected)
+
+    @models.ensure_singleton
+    def show_average(cls, time, mean, var, count):
+        cls._singleton.average.update_average(time, mean, var, count)
 
     @models.ensure_singleton
     def update_with_acquisition(cls, typ, val):
@@ -318,6 +427,16 @@ class ViewManager(models.SingletonManager):
         self._viewchanging = False
         self._populate_control()
         self.oscillo = None
+        self.renderer = None
+        self._renderers = OrderedDict() # the pool of renderers, by (class, channels, samples)
+        self._plotted = None # the settings that the current oscillo has been built for
+        self._viewing = False
+        self._analyzing = False
+        self.marks = np.zeros((0,), dtype=MARK_DTYPE) # the event markers in the current view
+        self.pending = None # the chunks to be drawn in the next frame
+        self.governor = views.DisplayGovernor()
+        self.frametimer = QtCore.QTimer(self)
+        self.frametimer.timeout.connect(self._draw_frame)
         self.device.load_drivers(DeviceManager.get_drivers())
         self.storage.load_drivers(StorageManager.get_drivers())
         self.AI.load_channels(DeviceManager.get_driver().channels)
@@ -332,14 +451,41 @@ class ViewManager(models.SingletonManager):
         self.viewbutton     = QtGui.QPushButton(TOGGLE_ACQ_VIEW)
         self.recordbutton   = QtGui.QPushButton(TOGGLE_ACQ_REC)
         self.oscillobutton  = QtGui.QPushButton(TOGGLE_OSCILLO)
+        self.tunebutton     = QtGui.QPushButton(TUNE_INTERVAL)
         self.viewbutton.clicked.connect(self.toggle_viewing)
         self.recordbutton.clicked.connect(self.toggle_recording)
+        self.tunebutton.clicked.connect(self.tune_interval)
         self.oscillobutton.setCheckable(True)
         self.oscillobutton.setEnabled(False)
         self.oscillobutton.toggled.connect(self.toggle_oscillo)
+        self.layoutselector = QtGui.QComboBox()
+        self.layoutselector.addItems(list(views.LAYOUTS.keys()))
+        self.spectrumbutton = QtGui.QPushButton(TOGGLE_SPECTRUM)
+        self.spectrumbutton.setCheckable(True)
+        self.spectrumbutton.toggled.connect(self.toggle_spectrum)
+        self.spectrum = spectra.SpectrumView()
+        self.eventsbutton = QtGui.QPushButton(TOGGLE_EVENTS)
+        self.eventsbutton.setCheckable(True)
+        self.eventsbutton.setChecked(events.EventManager.enabled)
+        self.eventsbutton.toggled.connect(self.toggle_events)
+        self.averagebutton = QtGui.QPushButton(TOGGLE_AVERAGE)
+        self.averagebutton.setCheckable(True)
+        self.averagebutton.setChecked(averaging.AverageManager.enabled)
+        self.averagebutton.toggled.connect(self.toggle_average)
+        self.average = averaging.AverageView()
+        self.degradedlabel = QtGui.QLabel()
+        self.degradedlabel.setStyleSheet("color: red")
+        self.degradedlabel.hide()
 
         self.tools.addWidget(self.oscillobutton)
+        self.tools.addWidget(self.spectrumbutton)
+        self.tools.addWidget(self.eventsbutton)
+        self.tools.addWidget(self.averagebutton)
+        self.tools.addWidget(QtGui.QLabel("Layout:"))
+        self.tools.addWidget(self.layoutselector)
         self.tools.addStretch(1)
+        self.tools.addWidget(self.degradedlabel)
+        self.tools.addWidget(self.tunebutton)
         self.tools.addWidget(self.viewbutton)
         self.tools.addWidget(self.recordbutton)
 
@@ -366,6 +512,7 @@ class ViewManager(models.SingletonManager):
         enable = len([ch for ch in DeviceManager.current.channels.values() if ch.inuse == True]) > 0
         self.recordbutton.setEnabled(enable)
         self.viewbutton.setEnabled(enable)
+        self.tunebutton.setEnabled(enable)
 
     def _update_with_acquisition(self, typ, val):
         if typ == TOGGLE_ACQ_VIEW:
@@ -385,72 +532,166 @@ class ViewManager(models.SingletonManager):
 
     def _prepare(self):
         """prepares for the next acquisition."""
-        channels = DeviceManager.current.channels
-        self.dt = DeviceManager.current.dt
-        DeviceManager.current.dataAvailable.connect(self._update)
-
-        if self.oscillo is not None:
-            self.oscillo.hide()
-            del self.oscillo
-        if len([ch for ch in channels.values() if ch.inuse == True]) == 0:
+        plan = DeviceManager.plan
+        self.dt = 1/plan.rate
+        self.set_setting_enabled(False)
+
+        # only the channels with the 'Oscillo' flag are buffered and drawn
+        inuse  = list(plan.channels)
+        viewed = [i for i, ch in enumerate(inuse) if ch.view == True]
+        layout = self.layoutselector.currentText()
+        signature = (plan.sources, plan.titles, plan.units, tuple(plan.scales.ravel()),
+                     tuple(plan.gains.ravel()), tuple(plan.offsets.ravel()),
+                     tuple(viewed), plan.rate, layout)
+        self._viewing = (len(viewed) > 0)
+        self._analyzing = (self._viewing == True) and (self.spectrumbutton.isChecked() == True)
+        if self._analyzing == True:
+            shown = [inuse[i] for i in viewed]
+            self._spectrumview = np.array(viewed, dtype=int)
+            self.spectrum.prepare(shown, plan.rate, plan.scales[:, self._spectrumview])
+        if self.averagebutton.isChecked() == True:
+            self.average.prepare(inuse)
+            self.average.show()
+        if self._viewing == False:
+            if self.oscillo is not None:
+                self.oscillo.hide()
+            self.oscillobutton.setEnabled(False)
+            return
+        if (self.renderer is not None) and (signature == self._plotted):
+            self._reset_plots()
+            self._start_frames()
             return
 
-        self.oscillo = pg.GraphicsLayoutWidget(border=(255,255,255))
-        self.oscillo.setWindowTitle("Mosca oscillo")
-        self.oscillo.resize(1100,600)
-        self.oscillo.move(40,300)
-        self.scales = []
-        self.curves = []
-        self.plots = []
-        self.ydata = []
-        self.data = []
+        if self.oscillo is None:
+            self.oscillo = pg.GraphicsLayoutWidget(border=(255,255,255))
+            self.oscillo.setWindowTitle("Mosca oscillo")
+            self.oscillo.resize(1100,600)
+            self.oscillo.move(40,300)
 
         # initialize time points
         width = self.DEFAULT_PLOT_WIDTH
-        samplesize = width*(DeviceManager.current.rate)
-        self.time = np.arange(samplesize)*(self.dt) - width
+        samplesize = int(width*(plan.rate))
 
         # load channels
-        # TODO: display it only when 'display' attribute is set True
-        for i, entry in enumerate(channels.items()):
-            ch = entry[1]
-            if ch.inuse == True:
-                plot = pg.PlotItem()
-                plot.setLabel('left', text=ch.label, units=ch.unit)
-                plot.setLabel('bottom', units='s')
-                y = np.zeros(samplesize, dtype=float)
-                curve = plot.plot(self.time, y, pen=pg.mkPen('b'))
-                self.oscillo.addItem(plot, row=i, col=0)
-                self.plots.append(plot)
-                self.curves.append(curve)
-                self.ydata.append(y)
-                self.scales.append(ch.scale)
-        self.ydata = np.stack(self.ydata, axis=-1)
-        self.scales = np.array(self.scales).reshape((1,-1))
+        shown       = [inuse[i] for i in viewed]
+        self.viewed = slice(None) if len(viewed) == len(inuse) else np.array(viewed, dtype=int)
+        self._lanes = np.full((len(inuse),), -1, dtype=int) # from the in-use index to the displayed index
+        self._lanes[viewed] = np.arange(len(viewed))
+        self.ydata  = np.zeros((samplesize, len(shown)), dtype=float)
+        self.scales = plan.scales[:, viewed]
+        self._use_renderer(views.renderer_for(layout, len(shown)), shown, samplesize)
+        self._plotted = signature
+        self._reset_plots()
+        self._start_frames()
+
+    def _use_renderer(self, cls, shown, samplesize):
+        """takes the renderer for the channel set from the pool (or creates it),
+        and puts it in the oscillo window."""
+        key      = (cls, tuple(ch.name for ch in shown), samplesize)
+        renderer = self._renderers.pop(key, None)
+        if renderer is None:
+            renderer = cls(shown, samplesize)
+        self._renderers[key] = renderer # the most recently used comes last
+        while len(self._renderers) > self.RENDERER_POOL_SIZE:
+            self._renderers.popitem(last=False)
+        renderer.configure(shown)
+        if renderer is not self.renderer:
+            self.oscillo.clear()
+            renderer.attach(self.oscillo)
+            self.renderer = renderer
+
+    def _reset_plots(self):
+        """reuses the plots of the last acquisition."""
+        width = self.DEFAULT_PLOT_WIDTH
+        self.time = np.arange(self.ydata.shape[0])*(self.dt) - width
+        self.ydata[:] = 0
+        self.marks = np.zeros((0,), dtype=MARK_DTYPE)
+        self.renderer.set_data(self.time, self.ydata)
+        self.renderer.mark(self.marks)
+        self._show_plots()
+
+    def _show_plots(self):
         self.oscillobutton.setEnabled(True)
         self.oscillobutton.setChecked(True)
-        self.set_setting_enabled(False)
         self.oscillo.show()
 
-    def _update(self, data):
-        """called during acquisition."""
-        self.data.append(data)
-        if len(self.data) >= self.DEFAULT_CHUNK_LENGTH:
-            data = np.concatenate(self.data, axis=0)
-            self.data = []
-            size, nchan = data.shape
-            self.time += size*(self.dt)
-            trng = (self.time.min(), self.time.max())
-            self.ydata = np.roll(self.ydata, (-size), axis=0)
-            self.ydata[-size:,:] = data*(self.scales)
-            for i in range(nchan):
-                self.curves[i].setData(self.time, self.ydata[:,i])
-                self.plots[i].setXRange(*trng, padding=0)
-            # app.processEvents()
+    def _start_frames(self):
+        """the chunks are collected in the acquisition thread, and drawn once per frame."""
+        self.pending = views.PendingChunks(self.ydata.shape[0])
+        self.governor.reset()
+        self._apply_display_level()
+        DeviceManager.current.dataAvailable.connect(self.pending.push, QtCore.Qt.DirectConnection)
+        self._lastframe = time.perf_counter()
+        self.frametimer.start()
+
+    def _draw_frame(self):
+        """draws all the chunks that have arrived since the last frame at once."""
+        started = time.perf_counter()
+        delay   = max(started - self._lastframe - self.frametimer.interval()/1000, 0.0)
+        self._lastframe = started
+        data, dropped = self.pending.take()
+        if data is not None:
+            if self._analyzing == True:
+                self._update_spectrum(data)
+            self._update(data, dropped)
+        if self.governor.account(time.perf_counter() - started + delay) == True:
+            self._apply_display_level()
+
+    def _apply_display_level(self):
+        self.frametimer.setInterval(self.governor.interval)
+        self.renderer.set_decimation(self.governor.decimation)
+        if self.governor.level == 0:
+            self.degradedlabel.hide()
+        else:
+            self.degradedlabel.setText("Display degraded ({0} fps, 1/{1} points)".format(
+                                            self.governor.fps, self.governor.decimation))
+            self.degradedlabel.show()
+
+    def _update(self, data, dropped=0):
+        """called once per frame during acquisition, with the samples since the last frame
+        (after `dropped` samples that were too old to be displayed)."""
+        data = data[:, self.viewed]
+        size, nchan = data.shape
+        self.time += (dropped + size)*(self.dt)
+        if size >= self.ydata.shape[0]:
+            self.ydata[:] = data[-self.ydata.shape[0]:]*(self.scales)
+        else:
+            self.ydata[:-size] = self.ydata[size:]
+            self.ydata[-size:] = data*(self.scales)
+        self.renderer.set_data(self.time, self.ydata, size, dropped)
+        if self.marks.shape[0] > 0:
+            self.marks = self.marks[self.marks['time'] >= self.time[0]]
+            self.renderer.mark(self.marks)
+
+    def _mark_events(self, detected):
+        """adds markers for the events detected by events.EventManager."""
+        if (self._viewing == False) or (self.renderer is None):
+            return
+        lanes = self._lanes[detected['channel']]
+        shown = lanes >= 0
+        marks = np.empty((int(shown.sum()),), dtype=MARK_DTYPE)
+        marks['time']      = detected['sample'][shown]*self.dt
+        marks['lane']      = lanes[shown]
+        marks['amplitude'] = detected['amplitude'][shown]
+        self.marks = np.concatenate([self.marks, marks])
+
+    def _update_spectrum(self, data):
+        """called once per frame during acquisition, if the spectrum is being analyzed."""
+        self.spectrum.feed(data[:, self._spectrumview])
 
     def _finalize(self):
         """finalizes the current acquisition"""
-        DeviceManager.current.dataAvailable.disconnect(self._update)
+        if self._viewing == True:
+            DeviceManager.current.dataAvailable.disconnect(self.pending.push)
+            self.frametimer.stop()
+            self._draw_frame() # the last samples
+            if self.governor.highest > 0:
+                print(f"[View] the display was degraded on {self.governor.degraded} frames "+
+                      f"(down to {views.DISPLAY_LEVELS[self.governor.highest][0]} fps)")
+            self.governor.reset()
+            self._apply_display_level()
+        if self._analyzing == True:
+            self.spectrum.finalize()
         self.set_setting_enabled(True)
 
     def toggle_viewing(self):
@@ -465,6 +706,21 @@ class ViewManager(models.SingletonManager):
             except:
                 traceback.print_exc()
 
+    def tune_interval(self):
+        if workers.Isolation is not None:
+            self.show_warning("Tuning not available",
+                              "the update interval cannot be tuned while the acquisition runs in a worker process.")
+            return
+        self.tunebutton.setEnabled(False)
+        self.viewbutton.setEnabled(False)
+        self.recordbutton.setEnabled(False)
+        try:
+            tuning.Tuner.calibrate(acquisition())
+        except:
+            traceback.print_exc()
+        finally:
+            self._update_with_channels()
+
     def toggle_recording(self):
         if self.recordbutton.text() == TOGGLE_ACQ_REC:
             try:
@@ -483,55 +739,154 @@ class ViewManager(models.SingletonManager):
         else:
             self.oscillo.setVisible(toggled)
 
+    def toggle_events(self, toggled):
+        """events are detected (and recorded) from the next acquisition on."""
+        events.EventManager.enabled = toggled
+
+    def toggle_average(self, toggled):
+        """sweeps are averaged (and recorded) from the next acquisition on."""
+        averaging.AverageManager.enabled = toggled
+        self.average.setVisible(toggled)
+
+    def toggle_spectrum(self, toggled):
+        """the spectrum is analyzed from the next acquisition on."""
+        self.spectrum.setVisible(toggled)
+
     def set_setting_enabled(self, val):
         self.device.setEnabled(val)
         self.storage.setEnabled(val)
         self.AI.setEnabled(val)
+        self.layoutselector.setEnabled(val)
+        self.spectrumbutton.setEnabled(val)
+        self.eventsbutton.setEnabled(val)
+        self.averagebutton.setEnabled(val)
 
 class IndependentWorker(QtCore.QThread):
-    def __init__(self, worker, parent=None):
+    def __init__(self, worker, stage=None, parent=None):
         super().__init__(parent)
         self.worker = worker
+        self.stage  = stage
         self.worker.moveToThread(self)
 
     def run(self):
+        if self.stage is not None:
+            scheduling.apply(self.stage)
         ret = self.exec()
 
 threads = []
-
-StorageThread = IndependentWorker(StorageManager)
-# StorageManager.moveToThread(StorageThread)
-
-DeviceThread = IndependentWorker(DeviceManager)
-# DeviceManager.moveToThread(DeviceThread)
-DeviceManager.starting.connect(ViewManager.prepare)
-DeviceManager.starting.connect(StorageManager.prepare)
-DeviceManager.finishing.connect(ViewManager.finalize)
-DeviceManager.finishing.connect(StorageManager.finalize)
-
-ViewManager.widget().closed.connect(app.quit)
-app.aboutToQuit.connect(quitSequence)
-
-StorageThread.start(QtCore.QThread.TimeCriticalPriority)
-threads.append(StorageThread)
-DeviceThread.start(QtCore.QThread.TimeCriticalPriority)
-threads.append(DeviceThread)
-
+StorageThread = None
+DeviceThread = None
+EventThread = None
+AverageThread = None
+DigitalThread = None
+TapThread = None
+
+def start_threads():
+    """moves the device/storage managers to their own threads and starts them."""
+    global StorageThread, DeviceThread, EventThread, AverageThread, DigitalThread
+    StorageThread = IndependentWorker(StorageManager, stage='storage')
+    DeviceThread = IndependentWorker(DeviceManager, stage='device')
+    EventThread = IndependentWorker(events.EventManager, stage='events')
+    AverageThread = IndependentWorker(averaging.AverageManager, stage='averaging')
+    DigitalThread = IndependentWorker(digital.DigitalManager, stage='digital')
+    # the storage (e.g. a native writer attached to the driver) is ready before the driver starts
+    DeviceManager.starting.connect(StorageManager.prepare, QtCore.Qt.BlockingQueuedConnection)
+    DeviceManager.finishing.connect(StorageManager.finalize)
+    DeviceManager.starting.connect(events.EventManager.prepare, QtCore.Qt.BlockingQueuedConnection)
+    # the detector finishes the queued chunks and writes its sidecar before the .cfg is generated
+    StorageManager.closing.connect(events.EventManager.finalize, QtCore.Qt.BlockingQueuedConnection)
+    DeviceManager.starting.connect(averaging.AverageManager.prepare, QtCore.Qt.BlockingQueuedConnection)
+    StorageManager.closing.connect(averaging.AverageManager.finalize, QtCore.Qt.BlockingQueuedConnection)
+    DeviceManager.starting.connect(digital.DigitalManager.prepare, QtCore.Qt.BlockingQueuedConnection)
+    StorageManager.closing.connect(digital.DigitalManager.finalize, QtCore.Qt.BlockingQueuedConnection)
+
+    StorageThread.start(QtCore.QThread.TimeCriticalPriority)
+    threads.append(StorageThread)
+    DeviceThread.start(QtCore.QThread.TimeCriticalPriority)
+    threads.append(DeviceThread)
+    EventThread.start()
+    threads.append(EventThread)
+    AverageThread.start()
+    threads.append(AverageThread)
+    DigitalThread.start()
+    threads.append(DigitalThread)
+
+def start_tap(controller):
+    """starts publishing the samples that `controller` delivers in this process (if enabled)."""
+    global TapThread
+    if tap.TapManager.enabled == False:
+        return
+    TapThread = IndependentWorker(tap.TapManager, stage='tap')
+    TapThread.started.connect(tap.TapManager.listen)
+    TapThread.finished.connect(tap.TapManager.shutdown)
+    # the ring is ready before the first chunk arrives
+    controller.starting.connect(tap.TapManager.prepare, QtCore.Qt.BlockingQueuedConnection)
+    controller.finishing.connect(tap.TapManager.finalize)
+    TapThread.start()
+    threads.append(TapThread)
+
+def start_tuning(manager, withview=True):
+    """measures the consumer threads (and the GUI thread if `withview` is true)
+    on every start of `manager` (the DeviceManager of this process)."""
+    measured = OrderedDict((th.stage, th) for th in threads if th is not DeviceThread)
+    if withview == True:
+        measured['gui'] = QtCore.QThread.currentThread()
+    tuning.Tuner.set_threads(measured)
+    # stamps before the consumers are connected, and follows after them
+    manager.preparing.connect(tuning.Tuner.attach)
+    manager.starting.connect(tuning.Tuner.follow)
+    manager.finishing.connect(tuning.Tuner.detach)
+
+def stop_threads():
+    for th in threads:
+        th.quit()
+        th.wait()
+
+def launch():
+    """builds the GUI application: managers, worker threads and the control window."""
+    global app
+    app = QtGui.QApplication([])
+    pg.setConfigOption('background', 'w')
+    pg.setConfigOption('foreground', 'k')
+
+    cfg = setup()
+    start_threads()
+    workers.setup(cfg, DeviceManager, StorageManager)
+    controller = acquisition()
+    controller.starting.connect(ViewManager.prepare)
+    controller.finishing.connect(ViewManager.finalize)
+    start_tap(controller)
+    if workers.Isolation is None:
+        # otherwise, the worker process measures its own threads
+        start_tuning(controller)
+    events.EventManager.detected.connect(ViewManager.mark_events)
+    averaging.AverageManager.updated.connect(ViewManager.show_average)
+    # after the worker threads have been started (they would inherit the settings)
+    scheduling.apply('gui')
+
+    ViewManager.widget().closed.connect(app.quit)
+    app.aboutToQuit.connect(quitSequence)
+    return app
+
+def acquisition():
+    """returns the object that controls the acquisition:
+    DeviceManager, or its proxy in case the acquisition runs in a worker process."""
+    return DeviceManager if workers.Isolation is None else workers.Isolation
 
 def start_viewing():
     # may be a try block here...
-    DeviceManager.start(save=False)
+    acquisition().start(save=False)
     ViewManager.update_with_acquisition(TOGGLE_ACQ_VIEW, True)
 
 def stop_viewing():
-    DeviceManager.stop()
+    acquisition().stop()
     ViewManager.update_with_acquisition(TOGGLE_ACQ_VIEW, False)
 
 def start_recording():
     # may be a try block here...
-    DeviceManager.start(save=True)
+    acquisition().start(save=True)
     ViewManager.update_with_acquisition(TOGGLE_ACQ_REC, True)
 
 def stop_recording():
-    DeviceManager.stop()
+    acquisition().stop()
     ViewManager.update_with_acquisition(TOGGLE_ACQ_REC, False)
@@ -1,10 +1,18 @@
 import sys
 from traceback import print_exc
 
+if (len(sys.argv) > 1) and (sys.argv[1] == 'convert'):
+    from mosca import convert
+    sys.exit(convert.main(sys.argv[2:]))
+elif (len(sys.argv) > 1) and (sys.argv[1] == 'catalog'):
+    from mosca import catalog
+    sys.exit(catalog.main(sys.argv[2:]))
+
 try:
     from pyqtgraph.Qt import QtGui, QtCore
-    from . import ViewManager
-    ViewManager.show()
+    import mosca
+    mosca.launch()
+    mosca.ViewManager.show()
     if (sys.flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
         QtGui.QApplication.instance().exec_()
 except:
@@ -0,0 +1,211 @@
+
+import os
+from collections import OrderedDict
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+from . import devices
+
+##
+## Online sweep averaging
+##
+## AverageManager runs in its own thread, cuts the incoming chunks into sweeps aligned
+## to a trigger channel (or to a fixed period), and keeps the running mean and variance
+## of the sweeps. upon StorageManager.closing, it saves them as a sidecar file:
+##
+##   <basename>_<acqno>_average.npz  -- 'time', 'mean', 'var', 'count' (and 'sweeps', optionally)
+##
+## the averaging settings are added to the .cfg file under "average".
+##
+
+DEFAULT_MODE    = 'trigger' # 'trigger' or 'period'
+DEFAULT_TRIGGER = 0         # the index of the trigger channel (among the channels in use)
+DEFAULT_LEVEL   = 1.0       # the (rising) trigger level, in the unit of the trigger channel
+DEFAULT_SWEEP   = 100.0     # in msec
+DEFAULT_PRE     = 10.0      # in msec
+DEFAULT_PERIOD  = 1000.0    # in msec
+
+AverageManager = None
+
+class SweepAverager:
+    """the running mean and variance of aligned sweeps of all the channels.
+
+    the sweeps of a chunk are cut out as one (sweeps x samples x channels) array,
+    and merged into the running statistics at once (with the parallel form of
+    Welford's algorithm). a sweep starts `pre` samples before its trigger, and
+    the triggers that come within a sweep after the previous one are ignored."""
+
+    def __init__(self, nchan, rate, mode=DEFAULT_MODE, trigger=DEFAULT_TRIGGER, level=DEFAULT_LEVEL,
+                    sweep=DEFAULT_SWEEP, pre=DEFAULT_PRE, period=DEFAULT_PERIOD, keep=False):
+        if mode not in ('trigger', 'period'):
+            raise ValueError(f"unknown averaging mode: '{mode}'")
+        if (mode == 'trigger') and ((trigger < 0) or (trigger >= nchan)):
+            raise ValueError(f"the trigger channel must be in 0-{nchan-1}")
+        self.mode     = mode
+        self.trigger  = trigger
+        self.level    = level
+        self.length   = max(int(round(sweep*rate/1000)), 2)
+        self.pre      = min(max(int(round(pre*rate/1000)), 0), self.length - 1)
+        self.period   = max(int(round(period*rate/1000)), 1)
+        self.time     = (np.arange(self.length) - self.pre)/rate
+        self.keep     = keep
+        self.sweeps   = [] # the individual sweeps, if `keep` is True
+
+        self.count    = 0
+        self.mean     = np.zeros((self.length, nchan), dtype=float)
+        self._m2      = np.zeros((self.length, nchan), dtype=float)
+        self._window  = np.arange(-self.pre, self.length - self.pre).reshape((1,-1))
+        self._carry   = np.zeros((0, nchan), dtype=float)
+        self._offset  = 0 # the sample index of the first row of _carry
+        self._next    = max(self.pre, 1) # the sample index from which the triggers are examined
+
+    def __getattr__(self, name):
+        if name == 'var':
+            return self._m2/(self.count - 1) if self.count > 1 else np.zeros_like(self._m2)
+        else:
+            raise AttributeError(name)
+
+    def _triggers(self, buf, first, stop):
+        """returns the triggers (relative to buf) in [first, stop)."""
+        if self.mode == 'period':
+            start = self._offset + first
+            phase = (self.pre - start) % self.period
+            return np.arange(first + phase, stop, self.period)
+        x = buf[:, self.trigger]
+        rows = np.nonzero((x[first:stop] >= self.level) & (x[first-1:stop-1] < self.level))[0] + first
+        keep = []
+        last = self._next - self.length
+        for row in rows: # the triggers are sparse
+            if self._offset + row - last >= self.length:
+                keep.append(row)
+                last = self._offset + row
+        return np.array(keep, dtype=np.intp)
+
+    def process(self, data):
+        """adds the sweeps that have become complete with `data`. returns the number of sweeps added."""
+        buf   = np.concatenate([self._carry, data], axis=0)
+        first = max(self._next - self._offset, 1)
+        stop  = buf.shape[0] - (self.length - self.pre) + 1
+        added = 0
+        if stop > first:
+            rows = self._triggers(buf, first, stop)
+            if rows.shape[0] > 0:
+                sweeps = buf[rows.reshape((-1,1)) + self._window] # (sweeps x samples x channels)
+                added  = sweeps.shape[0]
+                bmean  = sweeps.mean(axis=0)
+                delta  = bmean - self.mean
+                total  = self.count + added
+                self.mean += delta*(added/total)
+                self._m2  += ((sweeps - bmean)**2).sum(axis=0) + (delta**2)*(self.count*added/total)
+                self.count = total
+                if self.keep == True:
+                    self.sweeps.append(sweeps.astype(np.float32))
+                if self.mode == 'trigger':
+                    self._next = self._offset + rows[-1] + self.length # the hold-off
+            # the periodic sweeps may overlap; the triggered ones may not
+            self._next = max(self._next, self._offset + stop)
+
+        keep = self.length + 1
+        self._offset += max(buf.shape[0] - keep, 0)
+        self._carry   = buf[-keep:].copy()
+        return added
+
+class AverageManagerObject(QtCore.QObject):
+    """runs a SweepAverager on the acquired chunks (in its own thread),
+    and saves the average in a sidecar file when the recording is finalized."""
+
+    updated = QtCore.pyqtSignal(np.ndarray, np.ndarray, np.ndarray, int) # time, mean, var, count
+
+    def __init__(self, enabled=False, mode=DEFAULT_MODE, trigger=DEFAULT_TRIGGER, level=DEFAULT_LEVEL,
+                    sweep=DEFAULT_SWEEP, pre=DEFAULT_PRE, period=DEFAULT_PERIOD, sweeps=False, parent=None):
+        super().__init__(parent)
+        self.name       = "Average"
+        self.enabled    = enabled
+        self.settings   = OrderedDict(mode=mode, trigger=trigger, level=level,
+                                      sweep=sweep, pre=pre, period=period)
+        self.savesweeps = sweeps
+        self.averager   = None
+
+    def prepare(self, save=True):
+        self.averager = None
+        if self.enabled == False:
+            return
+        driver  = devices.DeviceManager.current
+        plan    = devices.DeviceManager.plan
+        if plan.nchan == 0:
+            return
+        self.scales   = plan.scales
+        self.averager = SweepAverager(plan.nchan, plan.rate, keep=(save and self.savesweeps),
+                                      **self.settings)
+        driver.dataAvailable.connect(self.update)
+
+    def update(self, data):
+        if self.averager.process(data*self.scales) > 0:
+            averager = self.averager
+            self.updated.emit(averager.time, averager.mean.copy(), averager.var, averager.count)
+
+    def finalize(self, prefix, sidecars):
+        """saves the average as `prefix`_average.npz (unless `prefix` is empty),
+        and adds its "average" entry to `sidecars`."""
+        if self.averager is None:
+            return
+        devices.DeviceManager.current.dataAvailable.disconnect(self.update)
+        averager, self.averager = self.averager, None
+        print(f"[{self.name}] averaged {averager.count} sweeps")
+        if len(prefix) == 0:
+            return
+        path   = prefix + "_average.npz"
+        arrays = dict(time=averager.time, mean=averager.mean, var=averager.var, count=averager.count)
+        if averager.keep == True:
+            arrays['sweeps'] = np.concatenate(averager.sweeps, axis=0) if len(averager.sweeps) > 0 \
+                                else np.zeros((0,) + averager.mean.shape, dtype=np.float32)
+        np.savez(path, **arrays)
+        entry = OrderedDict(file=os.path.basename(path), count=averager.count, sweeps=averager.keep)
+        entry.update(self.settings)
+        sidecars['average'] = entry
+        print(f"[{self.name}] saved: {path}")
+
+class AverageView(QtGui.QWidget):
+    """a window with the running average (± s.e.m.) of every channel."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Mosca average")
+        self.resize(600,600)
+        self._layout = QtGui.QVBoxLayout(self)
+        self.status  = QtGui.QLabel("no sweeps")
+        self._layout.addWidget(self.status)
+        self.plots   = pg.GraphicsLayoutWidget(border=(255,255,255))
+        self._layout.addWidget(self.plots)
+        self.curves  = []
+        self._names  = None
+
+    def prepare(self, channels):
+        names = tuple((ch.name, ch.label, ch.unit) for ch in channels)
+        if names != self._names:
+            self.plots.clear()
+            self.curves = []
+            for i, ch in enumerate(channels):
+                plot = self.plots.addPlot(row=i, col=0)
+                plot.setLabel('left', text=ch.label, units=ch.unit)
+                plot.setLabel('bottom', text='Time from trigger', units='s')
+                self.curves.append((plot.plot(pen=pg.mkPen('b', width=2)),
+                                    plot.plot(pen=pg.mkPen((150,150,255))),
+                                    plot.plot(pen=pg.mkPen((150,150,255)))))
+            self._names = names
+        for curves in self.curves:
+            for curve in curves:
+                curve.setData([], [])
+        self.status.setText("no sweeps")
+
+    def update_average(self, time, mean, var, count):
+        sem = np.sqrt(var/count)
+        for i, (curve, upper, lower) in enumerate(self.curves):
+            curve.setData(time, mean[:,i])
+            upper.setData(time, mean[:,i] + sem[:,i])
+            lower.setData(time, mean[:,i] - sem[:,i])
+        self.status.setText(f"{count} sweeps")
+
+def setup(cfg):
+    global AverageManager
+    AverageManager = AverageManagerObject(**cfg.get('averaging', {}))
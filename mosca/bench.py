@@ -0,0 +1,146 @@
+
+import os, sys, json, time, threading, argparse, tempfile, tracemalloc
+import numpy as np
+
+##
+## Micro-benchmarks
+##
+## run e.g. `python -m mosca.bench wait` to print the results.
+## `python -m mosca.bench mapreduce` compares mosca.mapreduce with loading a whole recording.
+##
+
+def _summary(label, values, unit='us'):
+    values = np.asarray(values)
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    return "{0:<28s} median {1:9.1f} {5}, p90 {2:9.1f} {5}, p99 {3:9.1f} {5}, max {4:9.1f} {5}".format(
+                label, p50, p90, p99, values.max(), unit)
+
+def bench_wakeup(event, repeat=1000, interval=0.001):
+    """measures the time from set() in one thread until wait() returns in another.
+    returns the latencies in microseconds."""
+    latencies = np.empty((repeat,), dtype=float)
+    stamp     = [0.0]
+    ready     = threading.Event()
+
+    def _waiter():
+        for i in range(repeat):
+            ready.set()
+            event.wait(None)
+            latencies[i] = (time.perf_counter() - stamp[0]) * 1e6
+            event.clear()
+
+    waiter = threading.Thread(target=_waiter)
+    waiter.start()
+    for i in range(repeat):
+        ready.wait()
+        ready.clear()
+        time.sleep(interval) # let the waiter block in wait()
+        stamp[0] = time.perf_counter()
+        event.set()
+    waiter.join()
+    return latencies
+
+def bench_timeout(event, repeat=200, timeout_msec=5):
+    """measures how late a timed wait on an unset event returns.
+    returns the overshoots (beyond `timeout_msec`) in microseconds."""
+    overshoot = np.empty((repeat,), dtype=float)
+    event.clear()
+    for i in range(repeat):
+        start = time.perf_counter()
+        event.wait(timeout_msec)
+        overshoot[i] = (time.perf_counter() - start) * 1e6 - timeout_msec * 1000
+    return overshoot
+
+class _ThreadingEvent(threading.Event):
+    """threading.Event with a timeout in msec, for comparison."""
+    def wait(self, timeout_msec=None):
+        return super().wait(None if timeout_msec is None else timeout_msec/1000)
+
+def run_wait(repeat=1000):
+    from .lib import corelib
+    for label, factory in (('corelib.Event', corelib.Event), ('threading.Event', _ThreadingEvent)):
+        event = factory()
+        print(_summary(f"{label}: wake-up", bench_wakeup(event, repeat=repeat)))
+        print(_summary(f"{label}: timeout overshoot", bench_timeout(event, repeat=max(repeat//5, 1))))
+        if isinstance(event, corelib.Event):
+            print(f"{label}: {event.wakeups} wake-ups, {event.spurious} spurious, {event.timeouts} timeouts")
+
+BENCH_ROWS      = 1 << 22
+BENCH_CHANNELS  = 8
+BENCH_THRESHOLD = 2.0
+
+def _write_recording(prefix, rows, nchan, rate=30000, blockrows=1 << 18):
+    """writes a recording of gaussian noise (block by block) with its .cfg file."""
+    data = np.lib.format.open_memmap(prefix + ".npy", mode='w+', dtype='float64', shape=(rows, nchan))
+    rng  = np.random.default_rng(0)
+    for start in range(0, rows, blockrows):
+        data[start:start+blockrows] = rng.standard_normal((min(blockrows, rows - start), nchan))
+    data.flush()
+    del data
+    info = dict(channels=[dict(id=i, name="AI{0}".format(i), unit="V", range="", source="") for i in range(nchan)],
+                data=dict(datatype="float64", byteorder="little", shape=(rows, nchan), rate=rate))
+    with open(prefix + ".cfg", 'w') as f:
+        json.dump(info, f)
+
+def _crossings(x, offset=0):
+    """the upward threshold crossings of every channel, as (row, channel) pairs."""
+    rows, chans = np.nonzero((x[:-1] < BENCH_THRESHOLD) & (x[1:] >= BENCH_THRESHOLD))
+    return np.column_stack([rows + 1 + offset, chans])
+
+def _chunk_crossings(chunk):
+    found = _crossings(chunk.data, chunk.offset)
+    return found[(found[:,0] >= chunk.start) & (found[:,0] < chunk.stop)]
+
+def _naive_crossings(prefix):
+    return _crossings(np.load(prefix + ".npy"))
+
+def _measure(func, repeat):
+    """returns the result, the elapsed times (in sec) and the peak of the memory allocated by
+    this process (in MB; the memory maps and the other processes are not counted)."""
+    elapsed = []
+    tracemalloc.start()
+    for i in range(repeat):
+        start  = time.perf_counter()
+        result = func()
+        elapsed.append(time.perf_counter() - start)
+    peak = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    return result, np.asarray(elapsed), peak
+
+def run_mapreduce(repeat=3, rows=BENCH_ROWS, nchan=BENCH_CHANNELS):
+    """compares np.load() of a whole recording with mapreduce.map_chunks()
+    (threshold crossings of every channel)."""
+    from . import mapreduce
+    with tempfile.TemporaryDirectory() as directory:
+        prefix = os.path.join(directory, "bench_001")
+        _write_recording(prefix, rows, nchan)
+        size   = rows*nchan*8/1e6
+        cases  = [('np.load (whole)', lambda: _naive_crossings(prefix)),
+                  ('map_chunks (in process)', lambda: mapreduce.map_chunks(prefix, _chunk_crossings, halo=1, jobs=0))]
+        for jobs in sorted(set((1, os.cpu_count()))):
+            cases.append((f"map_chunks (jobs={jobs})",
+                          lambda jobs=jobs: mapreduce.map_chunks(prefix, _chunk_crossings, halo=1, jobs=jobs)))
+        expected = None
+        for label, func in cases:
+            result, elapsed, peak = _measure(func, repeat)
+            if expected is None:
+                expected = result
+            same = (result.shape == expected.shape) and bool(np.all(result == expected))
+            print("{0:<28s} median {1:7.3f} s ({2:7.1f} MB/s), peak allocation {3:7.1f} MB{4}".format(
+                    label, np.median(elapsed), size/np.median(elapsed), peak, "" if same else " (DIFFERENT RESULT)"))
+        print(f"({size:.0f} MB recording, {expected.shape[0]} crossings, {os.cpu_count()} cores)")
+
+BENCHMARKS = {
+    'wait': run_wait,
+    'mapreduce': run_mapreduce,
+}
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m mosca.bench", description="runs mosca micro-benchmarks.")
+    parser.add_argument('name', choices=sorted(BENCHMARKS.keys()))
+    parser.add_argument('-n', '--repeat', type=int, default=None, help="(default: as of each benchmark)")
+    opts = parser.parse_args(args)
+    BENCHMARKS[opts.name](**({} if opts.repeat is None else dict(repeat=opts.repeat)))
+
+if __name__ == '__main__':
+    main()
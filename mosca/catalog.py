@@ -0,0 +1,369 @@
+
+import os, re, sys, json, time, sqlite3, hashlib, threading, argparse
+from contextlib import closing, contextmanager
+from collections import OrderedDict
+from datetime import datetime
+
+##
+## Catalog of the acquisitions
+##
+## with "catalog": {"enabled": true} in config.json, every saved acquisition is registered
+## in a SQLite database ('~/.mosca/catalog.sqlite' by default) right after its storage has been
+## finalized (see IODriverManager.finalize()): the path prefix, the time of the .cfg file
+## (i.e. the end of the acquisition), the sampling rate, the number of samples and the duration,
+## the channels, the size and the checksum of the data files, and the counts of the sidecars
+## (e.g. the number of events). the checksum is computed on a background thread, so that the
+## next acquisition does not wait for it.
+##
+## the auto-incremented acquisition number skips the numbers that are registered for the same
+## directory and basename (see next_acqno()), so that a new session does not overwrite
+## the acquisitions of the earlier sessions.
+##
+## `python -m mosca catalog search [--rate 30000] [--channel AI0] [--since 30d] ...` searches the catalog,
+## and `python -m mosca catalog scan DIR...` registers the recordings that were saved without it.
+##
+
+DEFAULT_CHECKSUM = 'sha256'
+HASH_BLOCK       = 1 << 22
+
+Catalog = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS acquisitions (
+    id        INTEGER PRIMARY KEY,
+    prefix    TEXT UNIQUE NOT NULL,
+    directory TEXT NOT NULL,
+    basename  TEXT NOT NULL,
+    acqno     INTEGER,
+    recorded  REAL NOT NULL,
+    rate      REAL,
+    samples   INTEGER,
+    nchan     INTEGER,
+    duration  REAL,
+    files     TEXT,
+    size      INTEGER,
+    checksum  TEXT,
+    events    INTEGER,
+    sidecars  TEXT
+);
+CREATE TABLE IF NOT EXISTS channels (
+    acquisition INTEGER NOT NULL REFERENCES acquisitions(id) ON DELETE CASCADE,
+    position    INTEGER NOT NULL,
+    name        TEXT,
+    source      TEXT,
+    unit        TEXT
+);
+CREATE INDEX IF NOT EXISTS acquisitions_rate     ON acquisitions(rate);
+CREATE INDEX IF NOT EXISTS acquisitions_recorded ON acquisitions(recorded);
+CREATE INDEX IF NOT EXISTS acquisitions_acqno    ON acquisitions(directory, basename, acqno);
+CREATE INDEX IF NOT EXISTS channels_acquisition  ON channels(acquisition);
+CREATE INDEX IF NOT EXISTS channels_name         ON channels(name);
+CREATE INDEX IF NOT EXISTS channels_source       ON channels(source);
+"""
+
+COLUMNS = ('prefix', 'directory', 'basename', 'acqno', 'recorded', 'rate', 'samples', 'nchan',
+           'duration', 'files', 'size', 'checksum', 'events', 'sidecars')
+
+def default_path():
+    return os.path.join(os.path.expanduser("~"), ".mosca", "catalog.sqlite")
+
+def describe(prefix):
+    """reads the entry of the acquisition at `prefix` from its .cfg file.
+    returns (entry, channels, paths of the data files)."""
+    prefix = os.path.abspath(prefix)
+    with open(prefix + ".cfg", 'r') as f:
+        info = json.load(f, object_pairs_hook=OrderedDict)
+    directory, base = os.path.split(prefix)
+    matched  = re.match(r"^(.*)_(\d+)$", base)
+    data     = info.get('data', None)
+    entry    = OrderedDict((column, None) for column in COLUMNS)
+    entry['prefix']    = prefix
+    entry['directory'] = directory
+    entry['basename']  = matched.group(1) if matched is not None else base
+    entry['acqno']     = int(matched.group(2)) if matched is not None else None
+    entry['recorded']  = os.path.getmtime(prefix + ".cfg")
+    paths = []
+    if data is not None:
+        entry['rate']    = data.get('rate', None)
+        entry['samples'] = int(data['shape'][0])
+        entry['nchan']   = int(data['shape'][1])
+        if entry['rate'] is not None:
+            entry['duration'] = entry['samples']/entry['rate']
+        if data.get('layout', 'rows') == 'columns':
+            paths = [os.path.join(directory, name) for name in data['files']]
+        else:
+            paths = [prefix + ext for ext in ('.npy', '.zdat') if os.path.exists(prefix + ext)]
+    entry['files'] = json.dumps([os.path.basename(path) for path in paths])
+    entry['size']  = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+    sidecars = OrderedDict((key, value.get('count', None)) for key, value in info.items()
+                           if isinstance(value, dict) and ('file' in value.keys()))
+    entry['sidecars'] = json.dumps(sidecars)
+    if 'events' in sidecars.keys():
+        entry['events'] = sidecars['events']
+    channels = [(i, chinfo.get('name', None), chinfo.get('source', None), chinfo.get('unit', None))
+                for i, chinfo in enumerate(info.get('channels', []))]
+    return entry, channels, paths
+
+def checksum(paths, algorithm=DEFAULT_CHECKSUM):
+    """the digest of the contents of the files (in the order of `paths`)."""
+    digest = hashlib.new(algorithm)
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                digest.update(block)
+    return "{0}:{1}".format(algorithm, digest.hexdigest())
+
+def parse_time(val):
+    """a unix time from an ISO date (e.g. '2026-09-01', '2026-09-01T12:00')
+    or from an age (e.g. '30d', '12h', '15m')."""
+    if isinstance(val, (int, float)):
+        return float(val)
+    matched = re.match(r"^(\d+(?:\.\d+)?)([dhm])$", val.strip())
+    if matched is not None:
+        unit = dict(d=86400, h=3600, m=60)[matched.group(2)]
+        return time.time() - float(matched.group(1))*unit
+    try:
+        return datetime.fromisoformat(val.strip()).timestamp()
+    except ValueError as e:
+        raise ValueError(f"failed to parse the time: '{val}'") from e
+
+class AcquisitionCatalog:
+    """a SQLite database of the acquisitions.
+    every operation opens its own connection, so that the catalog can be used from any thread."""
+
+    def __init__(self, enabled=False, path='', checksum=DEFAULT_CHECKSUM):
+        self.name      = "Catalog"
+        self.enabled   = enabled
+        self.path      = os.path.expanduser(path) if len(path) > 0 else default_path()
+        self.algorithm = checksum # the name of the hashlib algorithm, or None
+        self._hashing  = []
+        if self.enabled == True:
+            self.create()
+
+    def create(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._open() as conn:
+            conn.execute("PRAGMA journal_mode = WAL") # the searches do not wait for the registrations
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _open(self):
+        """a connection within a transaction."""
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA foreign_keys = ON")
+            with conn:
+                yield conn
+
+    def register(self, prefix, wait=False):
+        """registers (or re-registers) the acquisition at `prefix` from its .cfg file,
+        and computes the checksum of its data files (on a background thread, unless `wait`).
+        returns the id of the acquisition."""
+        entry, channels, paths = describe(prefix)
+        with self._open() as conn:
+            conn.execute("DELETE FROM acquisitions WHERE prefix = ?", (entry['prefix'],))
+            cursor = conn.execute("INSERT INTO acquisitions ({0}) VALUES ({1})".format(
+                                  ", ".join(COLUMNS), ", ".join("?" for column in COLUMNS)),
+                                  tuple(entry.values()))
+            rowid  = cursor.lastrowid
+            conn.executemany("INSERT INTO channels (acquisition, position, name, source, unit) VALUES (?, ?, ?, ?, ?)",
+                             [(rowid,) + channel for channel in channels])
+        if (self.algorithm is not None) and (len(paths) > 0):
+            if wait == True:
+                self._update_checksum(rowid, paths, entry['size'])
+            else:
+                self._hashing = [thread for thread in self._hashing if thread.is_alive()]
+                thread = threading.Thread(target=self._update_checksum, args=(rowid, paths, entry['size']),
+                                          name="catalog-checksum", daemon=True)
+                thread.start()
+                self._hashing.append(thread)
+        return rowid
+
+    def _update_checksum(self, rowid, paths, size):
+        try:
+            digest = checksum(paths, self.algorithm)
+            with self._open() as conn:
+                # (unless the acquisition has been re-registered in the meantime)
+                conn.execute("UPDATE acquisitions SET checksum = ? WHERE id = ? AND size = ?", (digest, rowid, size))
+        except (OSError, sqlite3.Error, ValueError) as e:
+            print(f"***{self.name}: failed to compute the checksum of {paths[0]}: {e}")
+
+    def wait(self):
+        """waits for the checksums that are being computed."""
+        for thread in self._hashing:
+            thread.join()
+        self._hashing = []
+
+    def lookup(self, prefix):
+        """returns the entry of the acquisition at `prefix`, or None."""
+        found = self.search(prefix=prefix)
+        return found[0] if len(found) > 0 else None
+
+    def next_acqno(self, directory, basename, acqno):
+        """returns `acqno`, or the number next to the last registered acquisition of `basename`
+        in `directory` if `acqno` has already been used."""
+        with self._open() as conn:
+            last = conn.execute("SELECT MAX(acqno) FROM acquisitions WHERE directory = ? AND basename = ?",
+                                (os.path.abspath(directory), basename)).fetchone()[0]
+        return acqno if (last is None) or (last < acqno) else last + 1
+
+    def search(self, rate=None, channel=None, since=None, until=None, directory=None, basename=None,
+               minduration=None, prefix=None, limit=None):
+        """returns the acquisitions that match all the given criteria (as dicts, in the order of recording).
+
+        `channel` matches the name or the source of any channel of an acquisition;
+        `since`/`until` are unix times, ISO dates or ages (see parse_time())."""
+        clauses, args = [], []
+        if rate is not None:
+            clauses.append("rate = ?")
+            args.append(float(rate))
+        if channel is not None:
+            clauses.append("id IN (SELECT acquisition FROM channels WHERE name = ? OR source = ?)")
+            args.extend((channel, channel))
+        if since is not None:
+            clauses.append("recorded >= ?")
+            args.append(parse_time(since))
+        if until is not None:
+            clauses.append("recorded < ?")
+            args.append(parse_time(until))
+        if directory is not None:
+            clauses.append("directory = ?")
+            args.append(os.path.abspath(directory))
+        if basename is not None:
+            clauses.append("basename = ?")
+            args.append(basename)
+        if minduration is not None:
+            clauses.append("duration >= ?")
+            args.append(float(minduration))
+        if prefix is not None:
+            clauses.append("prefix = ?")
+            args.append(os.path.abspath(prefix))
+        where = (" WHERE " + " AND ".join(clauses)) if len(clauses) > 0 else ""
+        query = "SELECT * FROM acquisitions" + where + " ORDER BY recorded, prefix"
+        if limit is not None:
+            query += " LIMIT {0:d}".format(int(limit))
+        with self._open() as conn:
+            found = OrderedDict((row['id'], OrderedDict((key, row[key]) for key in row.keys()))
+                                for row in conn.execute(query, args))
+            for entry in found.values():
+                entry['files']    = json.loads(entry['files'])
+                entry['sidecars'] = json.loads(entry['sidecars'])
+                entry['channels'] = []
+            if len(found) > 0:
+                rows = conn.execute("SELECT acquisition, name FROM channels WHERE acquisition IN "+
+                                    "(SELECT id FROM ({0})) ORDER BY acquisition, position".format(query), args)
+                for row in rows:
+                    found[row['acquisition']]['channels'].append(row['name'])
+        return list(found.values())
+
+def next_acqno(directory, basename, acqno):
+    """the acquisition number to be used next (`acqno` as it is, unless the catalog is enabled)."""
+    if (Catalog is None) or (Catalog.enabled == False):
+        return acqno
+    try:
+        return Catalog.next_acqno(directory, basename, acqno)
+    except sqlite3.Error as e:
+        print(f"***{Catalog.name}: failed to look up the acquisition numbers: {e}")
+        return acqno
+
+def register(prefix):
+    """registers a saved acquisition (if the catalog is enabled)."""
+    if (Catalog is None) or (Catalog.enabled == False):
+        return
+    try:
+        Catalog.register(prefix)
+        print(f"[{Catalog.name}] registered: {prefix}")
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        print(f"***{Catalog.name}: failed to register {prefix}: {e}")
+
+def find_configs(paths):
+    """the path prefixes of the .cfg files in `paths` (searched recursively in the directories)."""
+    prefixes = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirs, files in os.walk(path):
+                subdirs.sort()
+                prefixes.extend(os.path.join(directory, name[:-4]) for name in sorted(files) if name.endswith(".cfg"))
+        else:
+            prefixes.append(os.path.splitext(path)[0])
+    return prefixes
+
+def scan(catalog, paths, force=False):
+    """registers the recordings in `paths` that are not registered yet (or whose data files have
+    changed, or whose checksum is missing). returns the number of registered recordings."""
+    count   = 0
+    started = time.perf_counter()
+    for prefix in find_configs(paths):
+        try:
+            if force == False:
+                known = catalog.lookup(prefix)
+                if (known is not None) and (known['checksum'] is not None or catalog.algorithm is None):
+                    entry, channels, files = describe(prefix)
+                    if (entry['size'] == known['size']) and (entry['samples'] == known['samples']):
+                        continue
+            catalog.register(prefix, wait=True)
+            count += 1
+        except (OSError, ValueError, KeyError, IndexError, sqlite3.Error) as e:
+            print(f"***{catalog.name}: skipped {prefix}: {e}")
+    print(f"[{catalog.name}] registered {count} recordings in {time.perf_counter() - started:.2f} s")
+    return count
+
+def _format(entry):
+    recorded = datetime.fromtimestamp(entry['recorded']).strftime("%Y-%m-%d %H:%M:%S")
+    rate     = "{0:g} Hz".format(entry['rate']) if entry['rate'] is not None else "- Hz"
+    duration = "{0:.1f} s".format(entry['duration']) if entry['duration'] is not None else "- s"
+    events   = "" if entry['events'] is None else ", {0} events".format(entry['events'])
+    return "{0}  {1}  ({2}, {3}, {4:.1f} MB, channels: {5}{6})".format(recorded, entry['prefix'], rate, duration,
+                                                                      entry['size']/1e6, ", ".join(str(name) for name in entry['channels']), events)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m mosca catalog", description="searches and updates the catalog of acquisitions.")
+    parser.add_argument('--catalog', default=None, help="the path of the catalog (default: as in config.json)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    search = commands.add_parser('search', help="lists the acquisitions that match all the criteria")
+    search.add_argument('--rate', type=float, default=None, help="the sampling rate (Hz)")
+    search.add_argument('--channel', default=None, help="the name or the source of a channel")
+    search.add_argument('--since', default=None, help="an ISO date (e.g. 2026-09-01) or an age (e.g. 30d, 12h)")
+    search.add_argument('--until', default=None, help="(as --since)")
+    search.add_argument('--dir', dest='directory', default=None)
+    search.add_argument('--basename', default=None)
+    search.add_argument('--min-duration', dest='minduration', type=float, default=None, help="in seconds")
+    search.add_argument('--limit', type=int, default=None)
+    search.add_argument('--json', action='store_true', help="prints the entries as JSON")
+    scanner = commands.add_parser('scan', help="registers the recordings in the directories (recursively)")
+    scanner.add_argument('paths', nargs='+')
+    scanner.add_argument('--force', action='store_true', help="registers the recordings that have been registered, too")
+    opts = parser.parse_args(args)
+
+    path, algorithm = opts.catalog, DEFAULT_CHECKSUM
+    if path is None:
+        from . import load_config
+        cfg       = load_config().get('catalog', {})
+        path      = cfg.get('path', '')
+        algorithm = cfg.get('checksum', DEFAULT_CHECKSUM)
+    catalog = AcquisitionCatalog(enabled=True, path=path, checksum=algorithm)
+    if opts.command == 'scan':
+        scan(catalog, opts.paths, force=opts.force)
+        return 0
+    try:
+        started = time.perf_counter()
+        found   = catalog.search(rate=opts.rate, channel=opts.channel, since=opts.since, until=opts.until,
+                                 directory=opts.directory, basename=opts.basename,
+                                 minduration=opts.minduration, limit=opts.limit)
+    except ValueError as e:
+        parser.error(str(e))
+    if opts.json == True:
+        json.dump(found, sys.stdout, indent=2)
+        print()
+    else:
+        for entry in found:
+            print(_format(entry))
+        print(f"[{catalog.name}] {len(found)} acquisitions ({(time.perf_counter() - started)*1000:.1f} ms)")
+    return 0
+
+def setup(cfg):
+    global Catalog
+    Catalog = AcquisitionCatalog(**cfg.get('catalog', {}))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -147,6 +147,16 @@ class ChannelView(QtGui.QGroupBox):
 
 
 class BaseChannelModel(QtCore.QObject):
+    """the settings of a channel. the consumers read them once per acquisition,
+    through the AcquisitionPlan (see mosca.plans)."""
+
+    range  = param.Parameter('Input range', mode='str', readonly=True)
+    unit   = param.Parameter('Unit', mode='str')
+    scale  = param.Parameter('Scale (Unit/Vin)', mode='float', convert=param.as_float)
+    view   = param.Parameter('Oscillo', mode='bool', convert=param.as_bool)
+    gain   = param.Parameter('Display gain', mode='float', convert=param.as_float)
+    offset = param.Parameter('Display offset (Unit)', mode='float', convert=param.as_float)
+
     def __init__(self, name, parent=None):
         super().__init__(parent)
         self.name  = name
@@ -156,78 +166,27 @@ class BaseChannelModel(QtCore.QObject):
         self._unit  = "V"
         self._scale = 1.0
         self._view  = True
-
-        self._configs = []
-        self._configs.append(param.ParameterController(label='Input range',
-                                                        mode='str',
-                                                        getter=self.get_range,
-                                                        setter=None))
-
-        self._configs.append(param.ParameterController(label='Unit',
-                                                        mode='str',
-                                                        getter=self.get_unit,
-                                                        setter=self.set_unit))
-
-        self._configs.append(param.ParameterController(label='Scale (Unit/Vin)',
-                                                        mode='float',
-                                                        getter=self.get_scale,
-                                                        setter=self.set_scale))
-
-        self._configs.append(param.ParameterController(label='Oscillo',
-                                                        mode='bool',
-                                                        getter=self.get_view,
-                                                        setter=self.set_view))
-
-    def __getattr__(self, name):
-        if name == "range":
-            return self.get_range()
-        elif name == "unit":
-            return self.get_unit()
-        elif name == "scale":
-            return self.get_scale()
-        elif name == 'view':
-            return self.get_view()
-        else:
-            return super().__getattr__(name)
-
-    def __setattr__(self, name, value):
-        if name == "range":
-            self.set_range(value)
-        elif name == "unit":
-            self.set_unit(value)
-        elif name == "scale":
-            self.set_scale(value)
-        elif name == 'view':
-            self.set_view(value)
-        else:
-            super().__setattr__(name, value)
+        self._gain   = 1.0
+        self._offset = 0.0
+        self._controllers = None
 
     def configs(self):
-        return self._configs
-
-    def get_range(self):
-        return self._range
+        if self._controllers is None:
+            self._controllers = param.controllers(self)
+        return self._controllers
 
-    def get_unit(self):
-        return self._unit
+class DigitalPortModel(QtCore.QObject):
+    """a port of digital input lines, acquired as one packed word per scan
+    (bit i holds line i)."""
 
-    def get_scale(self):
-        return self._scale
-
-    def get_view(self):
-        return self._view
-
-    def set_range(self, value):
-        self._range = value
-
-    def set_unit(self, value):
-        self._unit = value
+    def __init__(self, name, lines=8, parent=None):
+        super().__init__(parent)
+        self.name  = name
+        self.lines = lines
+        self.inuse = False
 
-    def set_scale(self, value):
-        try:
-            self._scale = float(value)
-        except ValueError as e:
-            raise ValueError("failed to parse: '{0}'".format(value)) from e
+    def get_inuse(self):
+        return self.inuse
 
-    def set_view(self, value):
-        self._view = bool(value)
+    def set_inuse(self, value):
+        self.inuse = bool(value)
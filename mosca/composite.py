@@ -0,0 +1,205 @@
+
+import threading, importlib
+import numpy as np
+from pyqtgraph.Qt import QtCore
+from . import devices
+from . import plans
+from . import param
+from . import utils
+
+##
+## Composite device: several boards acquired as one
+##
+## the members are given as the device entries of config.json, e.g.
+##
+##   {"module":"mosca.composite", "class":"CompositeDeviceDriver",
+##    "args":"[{'module':'mosca.lib.NI', 'class':'Board', 'args':\"'Dev1', boardtype='NI6321'\"},
+##             {'module':'mosca.lib.NI', 'class':'Board', 'args':\"'Dev2', boardtype='NI6321'\"}]"}
+##
+## the first member with channels in use leads: the other members in use take its sample clock
+## and start trigger (see BaseDeviceDriver.sync_terminals()), and are started before it.
+## the members without channels in use are neither prepared nor started.
+## the chunks of the members are counted by sample index, and merged into one stream
+## as soon as every member has delivered the same samples. a member that runs ahead
+## of another by more than `maxskew` samples is reported (e.g. a board that is not
+## wired to the shared clock, or that has dropped chunks).
+##
+
+DEFAULT_MAX_SKEW = 0 # in samples; 0 means 'two update intervals'
+
+def load_member(cfg):
+    """instantiates a driver from its config.json entry."""
+    module = importlib.import_module(cfg['module'])
+    return eval("_cls({0})".format(cfg.get('args', '')), {'_cls': getattr(module, cfg['class'])})
+
+class CompositeDeviceDriver(devices.BaseDeviceDriver):
+    """merges the channels of its member drivers, in the order of the members.
+
+    the channels are keyed 'B<i>.<key>' after the i-th member, and their models are
+    renamed 'B<i>.<name>' (e.g. 'B1.Dev2/ai0'), so that the plan, the views and the .cfg
+    file tell them apart. the settings of the members (other than the sampling rate
+    and the update interval) appear with the same prefix. the digital ports and the native writers of the members
+    are not used."""
+
+    maxskew = param.Parameter('Max skew (samples, 0: 2 intervals)', mode='int',
+                    convert=lambda self, val: utils.validate_integer(val, (0, 10000000), 'max skew'))
+
+    def __init__(self, members, name='Composite', maxskew=DEFAULT_MAX_SKEW, parent=None, raterange=None, intervalrange=None):
+        super().__init__(name, parent=parent, raterange=raterange, intervalrange=intervalrange)
+        if len(members) == 0:
+            raise ValueError("a composite device needs at least one member")
+        self.members  = [load_member(cfg) if isinstance(cfg, dict) else cfg for cfg in members]
+        self._maxskew = maxskew
+        self._lock    = threading.Lock()
+        self._receivers = {}
+        self._owners  = {} # the index of the member of each channel
+        self._active  = [] # the members with channels in use (the leader first)
+        self._stimulated = None # the member that plays the stimulus
+        for i, member in enumerate(self.members):
+            member.setParent(self) # follows the composite to the acquisition thread
+            prefix = "B{0:d}".format(i)
+            for name, ch in member.channels.items():
+                ch.name = "{0}.{1}".format(prefix, ch.name)
+                self._channels["{0}.{1}".format(prefix, name)] = ch
+                self._owners["{0}.{1}".format(prefix, name)] = i
+            # the digital ports of the members are not merged (yet)
+            shared = [member.get_rate, member.get_interval, member.get_prearmed] + \
+                     [port.get_inuse for port in member.ports.values()]
+            for c in member.configs():
+                if c.get_value not in shared:
+                    self._configs.append(param.ParameterController(label="{0}: {1}".format(prefix, c.label),
+                                                                    mode=c.mode,
+                                                                    getter=c.get_value,
+                                                                    setter=None if c.readonly else c.set_value))
+
+    def arm_signature(self):
+        return super().arm_signature() + tuple(member.arm_signature() for member in self.members)
+
+    def _members_in_use(self):
+        """the indices of the members with channels in the plan (in the order of the members)."""
+        return sorted(set(self._owners[name] for name in self.plan.names))
+
+    def prepare(self):
+        self._active = self._members_in_use()
+        for i, member in enumerate(self.members):
+            member.rate     = self.rate
+            member.interval = self.interval
+            member.prearmed = self.prearmed
+            if i not in self._active:
+                member.disarm() # may have been kept armed from an earlier run
+        if len(self._active) > 0:
+            leader    = self.members[self._active[0]]
+            terminals = leader.sync_terminals()
+            leader.set_sync("", "") # may have followed another member in an earlier run
+            for i in self._active[1:]:
+                if terminals is not None:
+                    self.members[i].set_sync(*terminals)
+        for i in self._active:
+            self.members[i].plan = plans.AcquisitionPlan(self.members[i])
+            self.members[i].prepare()
+        self._pending = dict((i, []) for i in self._active)
+        self._counts  = dict((i, 0) for i in self._active)
+        for i in self._active:
+            # merged in the delivery thread of each member
+            self._receivers[i] = self._make_receiver(i)
+            self.members[i].dataAvailable.connect(self._receivers[i], QtCore.Qt.DirectConnection)
+
+    def _make_receiver(self, index):
+        def _receive(data):
+            self._receive(index, data)
+        return _receive
+
+    def _take(self, index, rows):
+        """takes `rows` rows from the pending chunks of the member `index`.
+        returns them, and the arrival of the oldest of them (None if not timed)."""
+        pending = self._pending[index]
+        arrival = pending[0][1]
+        parts   = []
+        while rows > 0:
+            data, when = pending[0]
+            if data.shape[0] > rows:
+                parts.append(data[:rows])
+                pending[0] = (data[rows:], when)
+                break
+            parts.append(data)
+            rows -= data.shape[0]
+            pending.pop(0)
+        return (np.concatenate(parts, axis=0) if len(parts) > 1 else parts[0]), arrival
+
+    def _receive(self, index, data):
+        with self._lock:
+            self._pending[index].append((data, self.members[index]._arrival))
+            self._counts[index] += data.shape[0]
+            counts  = [self._counts[i] for i in self._active]
+            skew    = max(counts) - min(counts)
+            if skew > self._maxskew_samples:
+                self._skewed += 1
+                if self._skewed == 1:
+                    lagging = self._active[int(np.argmin(counts))]
+                    print(f"***{self.name}: B{lagging} ({self.members[lagging].name}) lags behind by {skew} samples")
+            self._maxseen = max(self._maxseen, skew)
+            rows = min(counts) - self._merged
+            if rows <= 0:
+                return
+            parts, arrivals = [], []
+            for i in self._active:
+                data, arrival = self._take(i, rows)
+                parts.append(data)
+                arrivals.append(arrival)
+            self._merged += rows
+            self._arrival = None if None in arrivals else min(arrivals)
+            # emitted under the lock, so that the merged chunks keep their order
+            self.dataAvailable.emit(np.concatenate(parts, axis=1))
+
+    def start(self):
+        self._merged   = 0
+        self._skewed   = 0
+        self._maxseen  = 0
+        self._maxskew_samples = self._maxskew if self._maxskew > 0 else 2*self.interval
+        for i in self._active:
+            self._pending[i] = []
+            self._counts[i]  = 0
+        # the followers wait for the start trigger of the leader
+        for i in self._active[1:]:
+            self.members[i].start()
+        if len(self._active) > 0:
+            self.members[self._active[0]].start()
+
+    def stop(self):
+        for i in self._active:
+            self.members[i].stop()
+        if len(self._active) > 1:
+            counts = ", ".join("B{0}: {1}".format(i, self._counts[i]) for i in self._active)
+            print(f"[{self.name}] merged {self._merged} samples (max skew {self._maxseen} samples; received {counts})")
+            if self._skewed > 0:
+                print(f"***{self.name}: the skew exceeded {self._maxskew_samples} samples on {self._skewed} chunks")
+        for i in self._active:
+            self.members[i].dataAvailable.disconnect(self._receivers[i])
+        self._receivers = {}
+
+    def disarm(self):
+        for member in self.members:
+            member.disarm()
+
+    def get_delivery_batch(self):
+        members = self._active if len(self._active) > 0 else range(len(self.members))
+        return min(self.members[i].get_delivery_batch() for i in members)
+
+    def set_delivery_batch(self, batch):
+        members = self._active if len(self._active) > 0 else range(len(self.members))
+        return min(self.members[i].set_delivery_batch(batch) for i in members)
+
+    def attach_stimulus(self, stimulus):
+        """the stimulus is played by the leader (called after the plan has been built)."""
+        active = self._members_in_use()
+        if len(active) == 0:
+            return False
+        self._stimulus   = stimulus
+        self._stimulated = active[0]
+        return self.members[self._stimulated].attach_stimulus(stimulus)
+
+    def detach_stimulus(self):
+        super().detach_stimulus()
+        if self._stimulated is not None:
+            self.members[self._stimulated].detach_stimulus()
+            self._stimulated = None
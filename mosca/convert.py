@@ -0,0 +1,429 @@
+
+import os, sys, time, glob, json, zlib, argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from . import recordings
+
+##
+## Batch conversion of recordings
+##
+## `python -m mosca convert -o OUTDIR [options] PATH...` converts the recordings (given by any
+## of their files, or by their directories) into another layout, reading them through their
+## .cfg files (see mosca.recordings):
+##
+##   --to npy       a .npy file of (samples x channels), as NumpyIODriver writes it
+##   --to zdat      a single zlib stream, as BareZLibDriver writes it (--level sets the compression)
+##   --to columns   one 1-D .npy file per channel ('<prefix>_c00.npy', ...)
+##
+## the channels can be selected (--channels), filtered with zero-phase FIR filters
+## (--lowpass/--highpass), decimated (--decimate; with an anti-aliasing filter), and stored
+## as float32 or int16 (--dtype). int16 samples are scaled to the peak of each channel
+## (or to --full-scale), and the scales are recorded as the "quantization" of the .cfg file.
+##
+## the recordings are cut into segments of --segment-rows samples, which are converted on
+## a pool of --jobs processes, --chunk-rows samples at a time: the memory of a process is
+## bounded by the chunk, not by the recording. the .npy targets are preallocated, and every
+## segment writes its own rows. a .zdat source or target is converted as one segment
+## (a zlib stream can only be read and written from its beginning).
+## the .cfg file of a target is written after all of its segments have been converted,
+## so that an interrupted conversion does not leave a recording behind.
+## the sidecar files (events, averages, digital ports) are not converted.
+##
+
+FORMATS              = ('npy', 'zdat', 'columns')
+DTYPES               = ('float64', 'float32', 'int16')
+DEFAULT_CHUNK_ROWS   = 1 << 16
+DEFAULT_SEGMENT_ROWS = 1 << 22
+DEFAULT_TAPS         = 101
+DEFAULT_ZLIB_LEVEL   = 1   # as BareZLibDriver
+ANTIALIAS            = 0.8 # the cutoff of the anti-aliasing filter, relative to the Nyquist frequency after decimation
+INT16_FULL_SCALE     = 32767
+PROGRESS_SECONDS     = 1.0
+
+def lowpass_kernel(cutoff, rate, taps=DEFAULT_TAPS):
+    """a windowed-sinc (Hamming) low-pass FIR kernel, with the unity gain at DC."""
+    n      = np.arange(taps) - (taps - 1)/2
+    kernel = np.sinc(2*cutoff/rate*n)*np.hamming(taps)
+    return kernel/kernel.sum()
+
+def highpass_kernel(cutoff, rate, taps=DEFAULT_TAPS):
+    """the spectral inversion of lowpass_kernel()."""
+    kernel = -lowpass_kernel(cutoff, rate, taps)
+    kernel[(taps - 1)//2] += 1
+    return kernel
+
+class Pipeline:
+    """the conversion of the samples of a recording (shared by all of its segments)."""
+
+    def __init__(self, columns, kernel=None, factor=1, dtype='float64', quantization=None, sourcequantization=None):
+        self.columns      = np.asarray(columns, dtype=int)
+        self.kernel       = kernel
+        self.halo         = 0 if kernel is None else (kernel.shape[0] - 1)//2
+        self.factor       = factor
+        self.dtype        = np.dtype(dtype)
+        self.quantization = quantization # units per count of the target (int16 only)
+        self.sourcequantization = sourcequantization # ... of the selected columns of the source
+
+    def blocks(self, reader, start, stop, chunkrows, stats):
+        """yields the filtered and decimated samples [start, stop) of the source (as float64).
+        `start` must be a multiple of the decimation factor.
+        the number of the rows that were read is counted in `stats['rows']`."""
+        taps    = 1 if self.kernel is None else self.kernel.shape[0]
+        history = None
+        index   = start # the source index of the next filtered row
+        for block in self._padded(reader, start, stop, chunkrows, stats):
+            if self.kernel is not None:
+                buf = block if history is None else np.concatenate([history, block], axis=0)
+                if buf.shape[0] < taps:
+                    history = buf
+                    continue
+                history = buf[-(taps - 1):]
+                block   = np.column_stack([np.convolve(buf[:,j], self.kernel, mode='valid')
+                                           for j in range(buf.shape[1])])
+            first  = (-index) % self.factor
+            index += block.shape[0]
+            yield block[first::self.factor]
+
+    def _padded(self, reader, start, stop, chunkrows, stats):
+        """yields the selected columns of the samples [start - halo, stop + halo),
+        repeating the first and the last samples beyond the ends of the recording."""
+        lo, hi = max(start - self.halo, 0), min(stop + self.halo, reader.rows)
+        reader.seek(lo)
+        pos, last = lo, None
+        while pos < hi:
+            block = reader.read(min(chunkrows, hi - pos))
+            if block.shape[0] == 0:
+                break # the recording is shorter than its .cfg file says
+            selected = np.array(block[:, self.columns], dtype=float)
+            if self.sourcequantization is not None:
+                selected *= self.sourcequantization
+            if (pos == lo) and (lo > start - self.halo):
+                selected = np.concatenate([np.repeat(selected[:1], lo - (start - self.halo), axis=0), selected], axis=0)
+            pos  += block.shape[0]
+            last  = selected[-1:]
+            stats['rows'] += block.shape[0]
+            yield selected
+        if (last is not None) and (stop + self.halo > pos):
+            yield np.repeat(last, stop + self.halo - pos, axis=0)
+
+    def cast(self, block):
+        if self.quantization is not None:
+            counts = np.rint(block/self.quantization)
+            return np.clip(counts, -INT16_FULL_SCALE - 1, INT16_FULL_SCALE).astype(self.dtype)
+        return block.astype(self.dtype, copy=False)
+
+class Target:
+    """the data files of a converted recording."""
+
+    def __init__(self, prefix, fmt, rows, nchan, dtype, level=DEFAULT_ZLIB_LEVEL):
+        self.prefix = prefix
+        self.format = fmt
+        self.rows   = rows
+        self.nchan  = nchan
+        self.dtype  = np.dtype(dtype)
+        self.level  = level
+
+    def files(self):
+        """the names of the data files (relative to the directory of the target)."""
+        base = os.path.basename(self.prefix)
+        if self.format == 'columns':
+            return ["{0}_c{1:02d}.npy".format(base, i) for i in range(self.nchan)]
+        return [base + "." + self.format]
+
+    def paths(self):
+        directory = os.path.dirname(self.prefix)
+        return [os.path.join(directory, name) for name in self.files()]
+
+    def create(self):
+        """preallocates the .npy files (to be written by segments)."""
+        if self.format == 'zdat':
+            return
+        shape = (self.rows,) if self.format == 'columns' else (self.rows, self.nchan)
+        for path in self.paths():
+            np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=shape).flush()
+
+    def open(self):
+        if self.format == 'zdat':
+            return ZlibWriter(self.paths()[0], self.level)
+        return MemmapWriter(self.paths())
+
+class MemmapWriter:
+    """writes rows into preallocated .npy files (one file, or one file per column)."""
+
+    def __init__(self, paths):
+        self.maps = [np.lib.format.open_memmap(path, mode='r+') for path in paths]
+
+    def write(self, offset, block):
+        rows = block.shape[0]
+        if self.maps[0].ndim == 2:
+            self.maps[0][offset:offset+rows] = block
+        else:
+            for j, column in enumerate(self.maps):
+                column[offset:offset+rows] = block[:, j]
+
+    def close(self):
+        for target in self.maps:
+            target.flush()
+        self.maps = []
+
+class ZlibWriter:
+    """writes rows as a single zlib stream (the rows must come in order)."""
+
+    def __init__(self, path, level):
+        self._file = open(path, 'wb')
+        self._zlib = zlib.compressobj(level=level)
+
+    def write(self, offset, block):
+        self._file.write(self._zlib.compress(np.ascontiguousarray(block).tobytes()))
+
+    def close(self):
+        self._file.write(self._zlib.flush())
+        self._file.close()
+
+def convert_segment(source, target, pipeline, start, stop, chunkrows, measure=False):
+    """converts the samples [start, stop) of the recording `source` into `target`
+    (or only measures the peaks of the converted samples, if `measure` is True).
+    runs in a worker process. returns (rows read, bytes read, peaks or None)."""
+    recording = recordings.Recording(source)
+    reader    = recording.reader()
+    writer    = None if measure == True else target.open()
+    stats     = dict(rows=0)
+    peaks     = np.zeros((pipeline.columns.shape[0],), dtype=float) if measure == True else None
+    offset    = start//pipeline.factor
+    try:
+        for block in pipeline.blocks(reader, start, stop, chunkrows, stats):
+            if block.shape[0] == 0:
+                continue
+            if measure == True:
+                peaks = np.maximum(peaks, np.abs(block).max(axis=0))
+            else:
+                writer.write(offset, pipeline.cast(block))
+            offset += block.shape[0]
+    finally:
+        reader.close()
+        if writer is not None:
+            writer.close()
+    return stats['rows'], stats['rows']*recording.shape[1]*recording.dtype.itemsize, peaks
+
+class Conversion:
+    """the conversion of a recording, as planned in the main process."""
+
+    def __init__(self, source, outdir, opts):
+        self.recording = recordings.Recording(source)
+        self.source    = self.recording.prefix
+        prefix         = os.path.join(outdir, os.path.basename(self.source))
+        if os.path.abspath(prefix) == os.path.abspath(self.source):
+            raise ValueError(f"the conversion would overwrite the source: '{self.source}'")
+        reader         = self.recording.reader()
+        self.rows      = reader.rows
+        self.random_access = reader.random_access and (opts.format != 'zdat')
+        reader.close()
+
+        self.columns   = list(range(self.recording.shape[1])) if opts.channels is None else \
+                         self.recording.column_indices(opts.channels)
+        self.factor    = opts.decimate
+        rate           = self.recording.rate
+        kernel, self.filters = None, OrderedDict()
+        lowpass        = opts.lowpass
+        if self.factor > 1:
+            antialias  = None if rate is None else ANTIALIAS*rate/(2*self.factor)
+            if (lowpass is None) or ((antialias is not None) and (lowpass > antialias)):
+                lowpass = antialias
+        for name, cutoff, design in (('lowpass', lowpass, lowpass_kernel), ('highpass', opts.highpass, highpass_kernel)):
+            if cutoff is None:
+                continue
+            if rate is None:
+                raise ValueError(f"the sampling rate is not recorded in '{self.source}.cfg': cannot filter")
+            if not (0 < cutoff < rate/2):
+                raise ValueError(f"the {name} cutoff must be between 0 and {rate/2} Hz: {cutoff}")
+            taps   = design(cutoff, rate, opts.taps)
+            kernel = taps if kernel is None else np.convolve(kernel, taps)
+            self.filters[name] = cutoff
+        sourceq        = self.recording.quantization
+        self.pipeline  = Pipeline(self.columns, kernel=kernel, factor=self.factor, dtype=opts.dtype,
+                                  sourcequantization=None if sourceq is None else sourceq[self.columns])
+        self.peaks     = None
+        self.measure   = (opts.dtype == 'int16') and (opts.full_scale is None) # the peaks, before converting
+        if (opts.dtype == 'int16') and (opts.full_scale is not None):
+            self.set_peaks(np.full((len(self.columns),), opts.full_scale))
+        self.rate      = None if rate is None else rate/self.factor
+        self.target    = Target(prefix, opts.format, -(-self.rows//self.factor), len(self.columns), opts.dtype, level=opts.level)
+        self.pending   = 0
+        self.failed    = None
+
+    def set_peaks(self, peaks):
+        peaks = np.asarray(peaks, dtype=float)
+        self.pipeline.quantization = np.where(peaks > 0, peaks, 1.0)/INT16_FULL_SCALE
+
+    def segments(self, segmentrows):
+        """the (start, stop) of the segments (at multiples of the decimation factor)."""
+        if self.random_access == False:
+            return [(0, self.rows)]
+        step = max(-(-segmentrows//self.factor), 1)*self.factor
+        return [(start, min(start + step, self.rows)) for start in range(0, self.rows, step)] or [(0, 0)]
+
+    def config(self):
+        """the contents of the .cfg file of the target."""
+        info = OrderedDict()
+        info['channels'] = []
+        for i, column in enumerate(self.columns):
+            chinfo = OrderedDict(self.recording.channels[column])
+            chinfo['id'] = i
+            info['channels'].append(chinfo)
+        data = OrderedDict()
+        data['datatype']  = self.target.dtype.name
+        data['byteorder'] = sys.byteorder
+        data['shape']     = (self.target.rows, self.target.nchan)
+        data['rate']      = None if self.rate is None else (int(self.rate) if float(self.rate).is_integer() else self.rate)
+        if self.target.format == 'columns':
+            data['layout'] = 'columns'
+            data['files']  = self.target.files()
+        if self.pipeline.quantization is not None:
+            data['quantization'] = [float(q) for q in self.pipeline.quantization]
+        info['data'] = data
+        conversion = OrderedDict(source=self.source)
+        conversion.update(self.filters)
+        conversion['decimate'] = self.factor
+        info['conversion'] = conversion
+        return info
+
+    def finish(self):
+        with open(self.target.prefix + ".cfg", 'w') as f:
+            json.dump(self.config(), f, indent=4)
+        print(f"[Convert] {self.source} -> {self.target.prefix} "+
+              f"({self.target.rows} samples x {self.target.nchan} channels, {self.target.format}, {self.target.dtype.name})")
+
+def find_recordings(paths):
+    """the path prefixes of the recordings given by their files, or by their directories."""
+    prefixes = []
+    for path in paths:
+        candidates = sorted(glob.glob(os.path.join(path, "*.cfg"))) if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            prefix = recordings.path_prefix(candidate)
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+    return prefixes
+
+class Progress:
+    """reports the progress and the throughput of a pass (at most once per PROGRESS_SECONDS)."""
+
+    def __init__(self, label, segments):
+        self.label    = label
+        self.segments = segments
+        self.done     = 0
+        self.rows     = 0
+        self.nbytes   = 0
+        self.started  = time.perf_counter()
+        self._shown   = self.started
+
+    def update(self, rows, nbytes):
+        self.done   += 1
+        self.rows   += rows
+        self.nbytes += nbytes
+        now = time.perf_counter()
+        if (now - self._shown >= PROGRESS_SECONDS) and (self.done < self.segments):
+            self._shown = now
+            print(f"[Convert] {self.label}: {self.done}/{self.segments} segments, {self._throughput(now)}")
+
+    def _throughput(self, now):
+        elapsed = max(now - self.started, 1e-9)
+        return f"{self.nbytes/1e6:.1f} MB in {elapsed:.1f} s ({self.nbytes/1e6/elapsed:.1f} MB/s, {self.rows/elapsed:.0f} samples/s)"
+
+    def summary(self):
+        print(f"[Convert] {self.label}: done {self.done} segments, {self._throughput(time.perf_counter())}")
+
+def run(conversions, jobs, segmentrows=DEFAULT_SEGMENT_ROWS, chunkrows=DEFAULT_CHUNK_ROWS):
+    """converts the recordings on a pool of `jobs` processes. returns the number of failed conversions."""
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        measured = [c for c in conversions if c.measure == True]
+        if len(measured) > 0:
+            _run_pass(pool, "measuring the peaks", measured, segmentrows, chunkrows, measure=True)
+        converted = [c for c in conversions if c.failed is None]
+        for conversion in converted:
+            conversion.target.create()
+        _run_pass(pool, "converting", converted, segmentrows, chunkrows, measure=False)
+    return len([c for c in conversions if c.failed is not None])
+
+def _run_pass(pool, label, conversions, segmentrows, chunkrows, measure=False):
+    futures = {}
+    for conversion in conversions:
+        segments = conversion.segments(segmentrows)
+        conversion.pending = len(segments)
+        conversion.peaks   = np.zeros((len(conversion.columns),), dtype=float)
+        for start, stop in segments:
+            future = pool.submit(convert_segment, conversion.source, conversion.target, conversion.pipeline,
+                                 start, stop, chunkrows, measure)
+            futures[future] = conversion
+    progress = Progress(label, len(futures))
+    for future in as_completed(futures):
+        conversion = futures[future]
+        conversion.pending -= 1
+        try:
+            rows, nbytes, peaks = future.result()
+        except Exception as e:
+            if conversion.failed is None:
+                print(f"***Convert: failed to convert '{conversion.source}': {e}")
+            conversion.failed = e
+            continue
+        progress.update(rows, nbytes)
+        if measure == True:
+            conversion.peaks = np.maximum(conversion.peaks, peaks)
+        if (conversion.pending == 0) and (conversion.failed is None):
+            if measure == True:
+                conversion.set_peaks(conversion.peaks)
+            else:
+                conversion.finish()
+    progress.summary()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m mosca convert",
+                                     description="converts recordings (through their .cfg files) into another layout.")
+    parser.add_argument('paths', nargs='+', help="the recordings (any of their files), or the directories of recordings")
+    parser.add_argument('-o', '--output', required=True, help="the directory of the converted recordings")
+    parser.add_argument('--to', dest='format', choices=FORMATS, default='npy', help="the layout (default: npy)")
+    parser.add_argument('--dtype', choices=DTYPES, default='float64', help="the data type (default: float64)")
+    parser.add_argument('--full-scale', type=float, default=None,
+                        help="the full scale of int16 samples, in the units of the channels (default: the peak of each channel)")
+    parser.add_argument('--level', type=int, choices=range(10), default=DEFAULT_ZLIB_LEVEL, metavar='0-9',
+                        help=f"the zlib compression level (default: {DEFAULT_ZLIB_LEVEL})")
+    parser.add_argument('--channels', type=lambda val: [name.strip() for name in val.split(',')], default=None,
+                        help="the comma-separated names of the channels (default: all)")
+    parser.add_argument('--lowpass', type=float, default=None, help="the cutoff of the low-pass filter (Hz)")
+    parser.add_argument('--highpass', type=float, default=None, help="the cutoff of the high-pass filter (Hz)")
+    parser.add_argument('--taps', type=int, default=DEFAULT_TAPS, help=f"the length of the filters (default: {DEFAULT_TAPS})")
+    parser.add_argument('--decimate', type=int, default=1, help="keeps every N-th sample (after an anti-aliasing filter)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="the number of processes (default: all cores)")
+    parser.add_argument('--segment-rows', type=int, default=DEFAULT_SEGMENT_ROWS,
+                        help=f"the number of samples per segment (default: {DEFAULT_SEGMENT_ROWS})")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"the number of samples per chunk within a segment (default: {DEFAULT_CHUNK_ROWS})")
+    opts = parser.parse_args(args)
+    if opts.taps < 3:
+        parser.error("--taps must be >= 3")
+    opts.taps |= 1 # odd, for a zero-phase filter
+    for name in ('decimate', 'jobs', 'segment_rows', 'chunk_rows'):
+        if getattr(opts, name) < 1:
+            parser.error("--{0} must be >= 1".format(name.replace('_', '-')))
+
+    os.makedirs(opts.output, exist_ok=True)
+    conversions, names = [], set()
+    for prefix in find_recordings(opts.paths):
+        try:
+            conversion = Conversion(prefix, opts.output, opts)
+        except (OSError, ValueError, KeyError, json.JSONDecodeError) as e:
+            print(f"***Convert: skipped '{prefix}': {e}")
+            continue
+        if conversion.target.prefix in names:
+            print(f"***Convert: skipped '{prefix}': another recording is converted into '{conversion.target.prefix}'")
+            continue
+        names.add(conversion.target.prefix)
+        conversions.append(conversion)
+    if len(conversions) == 0:
+        print("***Convert: no recordings to convert")
+        return 1
+    failed = run(conversions, opts.jobs, segmentrows=opts.segment_rows, chunkrows=opts.chunk_rows)
+    return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
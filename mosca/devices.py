@@ -1,4 +1,4 @@
-import sys, math
+import sys, math, time, threading
 from collections import OrderedDict
 import numpy as np
 from pyqtgraph.Qt import QtGui, QtCore
@@ -7,6 +7,9 @@ from . import utils
 from . import channels
 from . import states
 from . import param
+from . import hooks
+from . import stimuli
+from . import plans
 
 ##
 ## Device-related classes
@@ -17,19 +20,99 @@ DEFAULT_SAMPLING_INTERVALS  = 1000
 
 DeviceManager = None
 
+def _blocking_if_threaded(receiver):
+    """returns the connection type to call `receiver` synchronously from the current thread."""
+    if receiver.thread() is QtCore.QThread.currentThread():
+        return QtCore.Qt.DirectConnection
+    return QtCore.Qt.BlockingQueuedConnection
+
 class DeviceDriverManager(models.BaseDriverManager):
     preparing       = QtCore.pyqtSignal()
     starting        = QtCore.pyqtSignal(bool)
     aboutToStart    = QtCore.pyqtSignal()
     aboutToFinish   = QtCore.pyqtSignal()
     finishing       = QtCore.pyqtSignal()
-    DEFAULT_TIMEOUT = 5000000
+    releasing       = QtCore.pyqtSignal()
+    DEFAULT_TIMEOUT = 10000 # in msec
+
+    def __init__(self, name, parent=None):
+        super().__init__(name, parent=parent)
+        self._bound     = None # the driver that the signals are currently connected to
+        self._startedat = None
+        self._firstlock = threading.Lock() # guards _startedat against the acquisition thread
+        self._hook      = None # the hook attached to the current acquisition
+        self._stimulus  = None # the stimulus played during the current acquisition
+        self.latency    = None # start-to-first-sample latency of the last acquisition, in msec
+        self.plan       = None # the plans.AcquisitionPlan of the current (or last) acquisition
+        self.running    = False
+
+    def _bind(self):
+        """connects the signals to the current driver.
+        the connections are kept as long as the driver stays armed."""
+        if self._bound is self.current:
+            return
+        self._unbind()
+        self.preparing.connect(self.current.prepare)
+        self.aboutToStart.connect(self.current.start)
+        # the storage is finalized only after the driver has delivered the last chunk
+        self.aboutToFinish.connect(self.current.stop, _blocking_if_threaded(self.current))
+        self._bound = self.current
+
+    def _unbind(self):
+        if self._bound is None:
+            return
+        self.preparing.disconnect(self._bound.prepare)
+        self.aboutToStart.disconnect(self._bound.start)
+        self.aboutToFinish.disconnect(self._bound.stop)
+        self._bound = None
+
+    def build_plan(self):
+        """freezes the channels in use of the current driver for the next acquisition,
+        and hands the plan to the driver."""
+        self.plan = plans.AcquisitionPlan(self.current)
+        self.current.plan = self.plan
+        return self.plan
+
+    def disarm(self):
+        """releases the resources that the (pre-armed) driver keeps between acquisitions."""
+        driver = self._bound
+        self._unbind()
+        if driver is not None:
+            driver.disarm()
+
+    def release(self):
+        """disarms the driver in the thread of this manager (e.g. when quitting from the GUI thread)."""
+        self.releasing.connect(self.disarm, _blocking_if_threaded(self))
+        try:
+            self.releasing.emit()
+        finally:
+            self.releasing.disconnect(self.disarm)
+
+    def set_driver(self, name):
+        if (self._bound is not None) and (self.driverchanging == False):
+            self.disarm()
+        super().set_driver(name)
 
     def start(self, save=True):
         if self.current is not None:
-            self.preparing.connect(self.current.prepare)
-            self.aboutToStart.connect(self.current.start)
-            self.aboutToFinish.connect(self.current.stop)
+            self._bind()
+            self.build_plan()
+            # the hook sees every chunk before any other consumer
+            if hooks.Current is not None:
+                if self.current.attach_hook(hooks.Current) == True:
+                    self._hook = hooks.Current
+                else:
+                    print(f"***{self.name}: '{self.current.name}' cannot call the native hook '{hooks.Current.name}'; it is not called")
+            # the stimulus is rendered by the driver upon prepare()
+            if stimuli.Current is not None:
+                if self.current.attach_stimulus(stimuli.Current) == True:
+                    self._stimulus = stimuli.Current
+                else:
+                    print(f"***{self.name}: '{self.current.name}' has no analog output; the stimulus is not played")
+            with self._firstlock:
+                self._startedat = time.perf_counter()
+                self.current.dataAvailable.connect(self._report_first_sample, QtCore.Qt.DirectConnection)
+            self.running = True
             self.preparing.emit()
             if save == True:
                 self.starting.emit(True)
@@ -39,19 +122,56 @@ class DeviceDriverManager(models.BaseDriverManager):
 
     def stop(self):
         self.aboutToFinish.emit()
+        self.running = False
+        if self._hook is not None:
+            self.current.detach_hook()
+            self._hook.report()
+            self._hook = None
+        if self._stimulus is not None:
+            self.current.detach_stimulus()
+            self._stimulus = None
         self.finishing.emit()
-        with states.StateManager.doneStorage as evt:
-            evt.wait(self.DEFAULT_TIMEOUT)
-        with states.StateManager.donePlotting as evt:
-            evt.wait(self.DEFAULT_TIMEOUT)
-        self.preparing.disconnect(self.current.prepare)
-        self.aboutToStart.disconnect(self.current.start)
-        self.aboutToFinish.disconnect(self.current.stop)
+        if states.StateManager.doneStorage.wait(self.DEFAULT_TIMEOUT) == False:
+            print(f"***{self.name}: storage did not finish within {self.DEFAULT_TIMEOUT} ms")
+        if states.StateManager.donePlotting.wait(self.DEFAULT_TIMEOUT) == False:
+            print(f"***{self.name}: view did not finish within {self.DEFAULT_TIMEOUT} ms")
+        with self._firstlock:
+            if self._startedat is not None:
+                # no sample has arrived
+                self._startedat = None
+                self.current.dataAvailable.disconnect(self._report_first_sample)
+        if self.current.prearmed == False:
+            self.disarm()
+
+    def _report_first_sample(self, data):
+        """called (in the acquisition thread) upon the first chunk of an acquisition."""
+        with self._firstlock:
+            if self._startedat is None:
+                return
+            self.latency    = (time.perf_counter() - self._startedat)*1000
+            self._startedat = None
+            self.current.dataAvailable.disconnect(self._report_first_sample)
+        chunk = data.shape[0]*1000/self.current.rate
+        print(f"[{self.name}] start-to-first-sample latency: {self.latency:.1f} ms "+
+              f"(including {chunk:.1f} ms of acquisition of the first chunk)")
 
 
 class BaseDeviceDriver(models.DriverInterface):
-    """Basic behaviors as an acquisition driver."""
-    dataAvailable = QtCore.pyqtSignal(np.ndarray)
+    """Basic behaviors as an acquisition driver.
+
+    drivers with digital ports (see add_port()) emit digitalAvailable with
+    the (scans x ports) uint8 words of every chunk, right after dataAvailable.
+    drivers set `_arrival` (time.perf_counter() in msec) to the arrival of the oldest chunk
+    of every delivery before emitting it, so that a hook can be timed from it (see attach_hook())."""
+    dataAvailable    = QtCore.pyqtSignal(np.ndarray)
+    digitalAvailable = QtCore.pyqtSignal(np.ndarray)
+    interval_changed = QtCore.pyqtSignal()
+
+    rate     = param.Parameter('Sampling rate (Hz)', mode='int',
+                    convert=lambda self, val: utils.validate_integer(val, self.raterange, 'sampling rate'))
+    interval = param.Parameter('Update interval (Samples)', mode='int', signal='interval_changed',
+                    convert=lambda self, val: utils.validate_integer(val, self.intervalrange, 'update interval'))
+    prearmed = param.Parameter('Keep armed between runs', mode='bool', convert=param.as_bool)
 
     def __init__(self, name, parent=None, raterange=None, intervalrange=None):
         super().__init__(parent)
@@ -64,36 +184,27 @@ class BaseDeviceDriver(models.DriverInterface):
         self.intervalrange  = intervalrange
         self._rate          = DEFAULT_SAMPLING_RATE
         self._interval      = DEFAULT_SAMPLING_INTERVALS # in samples*channels
+        self._prearmed      = False
+        self._hook          = None
+        self._arrival       = None # the arrival of the oldest chunk of the delivery (None if not timed)
+        self._stimulus      = None
+        self.plan           = None # set by DeviceManager before prepare() (see plans.AcquisitionPlan)
         self._channels      = OrderedDict()
-        self._configs       = []
-        self._configs.append(param.ParameterController(label='Sampling rate (Hz)',
-                                                        mode='int',
-                                                        getter=self.get_rate,
-                                                        setter=self.set_rate))
-        self._configs.append(param.ParameterController(label='Update interval (Samples)',
-                                                        mode='int',
-                                                        getter=self.get_interval,
-                                                        setter=self.set_interval))
-
-    def __getattr__(self, name):
-        if name == 'rate':
-            return self.get_rate()
-        elif name == 'dt':
-            return 1/(self.get_rate())
-        elif name == 'interval':
-            return self.get_interval()
-        elif name == 'channels':
-            return self.get_channels()
-        else:
-            raise AttributeError(name)
+        self._ports         = OrderedDict()
+        self._configs       = [] # the ParameterControllers other than the declared ones
+        self._controllers   = None
 
-    def __setattr__(self, name, val):
-        if name == 'rate':
-            return self.set_rate(val)
-        elif name == 'interval':
-            return self.set_interval(val)
-        else:
-            super().__setattr__(name, val)
+    @property
+    def dt(self):
+        return 1/self._rate
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def ports(self):
+        return self._ports
 
     def prepare(self):
         """prepares the acquisition task using the current configurations."""
@@ -104,61 +215,207 @@ class BaseDeviceDriver(models.DriverInterface):
         pass
 
     def stop(self):
-        """stops the currently running acquisition task."""
+        """stops the currently running acquisition task.
+        if the driver is pre-armed, the task should be kept for the next start()."""
+        pass
+
+    def disarm(self):
+        """releases the task that has been kept armed (if any)."""
+        pass
+
+    def attach_writer(self, writer):
+        """hands every chunk to `writer` (a mosca.lib.nativeio.NativeWriter) from
+        the acquisition thread itself, without going through dataAvailable.
+        returns False if the driver does not support it."""
+        return False
+
+    def detach_writer(self):
+        """stops handing chunks to the writer given by attach_writer()."""
         pass
 
-    def get_channels(self):
-        if hasattr(self, '_channels'):
-            return getattr(self, '_channels')
+    def attach_hook(self, hook):
+        """calls `hook` (a hooks.ClosedLoopHook) with every chunk in the acquisition thread,
+        before the other consumers. drivers may override it to call the hook earlier.
+        returns False if the hook cannot be called (i.e. it only has a native function)."""
+        if hook.func is None:
+            return False
+        hook.reset()
+        self._hook = hook
+        self.dataAvailable.connect(self._invoke_hook, QtCore.Qt.DirectConnection)
+        return True
+
+    def _invoke_hook(self, data):
+        if self._arrival is None:
+            self._hook.invoke(data) # only the run time of the hook is measured
         else:
-            raise AttributeError("{0} has no 'channels'".format(self.__class__.__name__))
+            self._hook.invoke(data, time.perf_counter()*1000 - self._arrival)
 
-    def get_interval(self):
-        return self._interval
+    def detach_hook(self):
+        """called after the driver has stopped."""
+        if self._hook is not None:
+            self.dataAvailable.disconnect(self._invoke_hook)
+        self._hook = None
 
-    def get_rate(self):
-        return self._rate
+    def sync_terminals(self):
+        """returns the (sample clock, start trigger) terminals that other drivers
+        can be synchronized to (see set_sync()), or None if the driver cannot lead."""
+        return None
 
-    def configs(self):
-        return self._configs
+    def set_sync(self, clock, trigger):
+        """makes the next prepare() take the sample clock and the start trigger
+        from the given terminals (its own ones if they are empty).
+        drivers without external timing ignore it."""
+        pass
+
+    def attach_stimulus(self, stimulus):
+        """plays `stimulus` (a stimuli.Stimulus) on the analog outputs, sample-locked
+        to the acquisition, from the next prepare() on.
+        returns False if the driver has no analog output."""
+        return False
+
+    def detach_stimulus(self):
+        """called after the driver has stopped."""
+        self._stimulus = None
 
-    def set_interval(self, val):
-        self._interval = utils.validate_integer(val, self.intervalrange, 'update interval')
+    def get_delivery_batch(self):
+        """the number of update intervals that are delivered at once by dataAvailable."""
+        return 1
 
-    def set_rate(self, val):
-        self._rate = utils.validate_integer(val, self.raterange, 'sampling rate')
+    def set_delivery_batch(self, batch):
+        """delivers `batch` update intervals at once from the next chunk on (while running),
+        without changing the update interval of the task (see tuning.IntervalTuner).
+        returns the batch in effect (drivers may cap it, or ignore it by default)."""
+        return self.get_delivery_batch()
+
+    def arm_signature(self):
+        """the settings that a pre-armed task depends on.
+        prepare() may reuse the armed task as long as the signature does not change."""
+        inuse = tuple((name, ch.name) for name, ch in self.channels.items() if ch.inuse == True)
+        ports = tuple(port.name for port in self._ports.values() if port.inuse == True)
+        return (inuse, ports, self.rate, self.interval)
+
+    def add_port(self, name, physical, lines=8):
+        """adds a digital input port (off by default), with its switch in the configs."""
+        port = channels.DigitalPortModel(physical, lines=lines, parent=self)
+        self._ports[name] = port
+        self._configs.append(param.ParameterController(label='Digital input {0} ({1} lines)'.format(name, lines),
+                                                        mode='bool',
+                                                        getter=port.get_inuse,
+                                                        setter=port.set_inuse))
+
+    def configs(self):
+        if self._controllers is None:
+            self._controllers = param.controllers(self)
+        return self._controllers + self._configs
 
 class DummyDeviceDriver(BaseDeviceDriver):
+    """generates sine waves.
+
+    a stimulus is looped back: its i-th output replaces the i-th channel in use.
+    its digital port simulates a frame clock (line 0), a trial marker (line 1),
+    and a detector of the first sine wave (line 2)."""
+
     def __init__(self, parent=None, raterange=None, intervalrange=None):
         super().__init__('Dummy', parent=parent, raterange=None, intervalrange=None)
+        self._timer     = None
+        self._armed     = None
+        self._generator = None
+        self._batch     = 1
+        self._held      = []
         for ch in range(4):
             name = "AI{0}".format(ch)
             self._channels[name] = channels.BaseChannelModel(name, parent=self)
+        self.add_port("port0", "port0", lines=3)
 
     def _prepare_next(self):
         self.source = np.roll(self.source, (-self.Nsamp), axis=0)
+        if self.digital is not None:
+            self.digital = np.roll(self.digital, (-self.Nsamp), axis=0)
 
     def _fire_data_available(self):
-        self.dataAvailable.emit(self.source[:(self.Nsamp)])
+        arrival = time.perf_counter()*1000
+        data = self.source[:(self.Nsamp)]
+        if self._generator is not None:
+            block = self._generator.next_block()
+            nout  = min(block.shape[1], data.shape[1])
+            data  = data.copy()
+            data[:, :nout] = block[:, :nout]
+        words = self.digital[:(self.Nsamp)] if self.digital is not None else None
         self._prepare_next()
+        if self._batch == 1:
+            self._arrival = arrival
+            self._emit(data, words)
+        else:
+            self._held.append((data.copy(), words.copy() if words is not None else None, arrival))
+            if len(self._held) >= self._batch:
+                self._emit_held()
+
+    def _emit(self, data, words):
+        self.dataAvailable.emit(data)
+        if words is not None:
+            self.digitalAvailable.emit(words)
+
+    def _emit_held(self):
+        data  = np.concatenate([held[0] for held in self._held], axis=0)
+        words = None
+        if self._held[0][1] is not None:
+            words = np.concatenate([held[1] for held in self._held], axis=0)
+        self._arrival = self._held[0][2]
+        self._held    = []
+        self._emit(data, words)
+
+    def get_delivery_batch(self):
+        return self._batch
+
+    def set_delivery_batch(self, batch):
+        self._batch = max(int(batch), 1)
+        return self._batch
+
+    def attach_stimulus(self, stimulus):
+        self._stimulus = stimulus
+        return True
+
+    def detach_stimulus(self):
+        super().detach_stimulus()
+        self._generator = None
 
     def prepare(self):
-        self.nchan = len([ch for ch in self.channels.values() if ch.inuse == True])
+        signature = self.arm_signature()
+        if (self._timer is not None) and (signature == self._armed):
+            return
+        self.disarm()
+        self.nchan = self.plan.nchan
         self.Nsamp = self.interval
         self.source = np.empty((20000, self.nchan), dtype=float)
         y = np.sin(2*math.pi*np.arange(20000)/4000)
         delta = 20000 // (self.nchan)
         for i in range(self.nchan):
             self.source[:,i] = np.roll(y, delta*i)
+        self.digital = None
+        if self._ports["port0"].inuse == True:
+            n = np.arange(20000)
+            self.digital = (((n // 50) % 2) | (((n % 10000) < 1000) << 1) | ((y > 0.5) << 2)).astype(np.uint8).reshape((-1,1))
         self._timer = QtCore.QTimer(parent=self)
-        self._timer.setInterval(self.interval*1000/(self.rate))
+        self._timer.setInterval(int(round(self.interval*1000/(self.rate))))
         self._timer.timeout.connect(self._fire_data_available)
+        self._armed = signature
 
     def start(self):
+        if self._stimulus is not None:
+            self._generator = stimuli.StimulusGenerator(self._stimulus, self.rate, self.Nsamp)
         self._timer.start()
 
     def stop(self):
         self._timer.stop()
+        if len(self._held) > 0:
+            self._emit_held()
+        self._batch = 1
+
+    def disarm(self):
+        if self._timer is not None:
+            self._timer.deleteLater()
+        self._timer = None
+        self._armed = None
 
 def setup(cfg):
     global DeviceManager
@@ -0,0 +1,126 @@
+
+import os
+from collections import OrderedDict
+import numpy as np
+from pyqtgraph.Qt import QtCore
+from . import devices, storages
+
+##
+## Digital inputs: packed words and edge tables
+##
+## the digital ports of a driver (see BaseDeviceDriver.add_port()) are acquired
+## alongside the analog channels as one uint8 word per port per scan (bit i = line i),
+## i.e. 1 bit per line per sample instead of a float64 analog channel.
+##
+## DigitalManager runs in its own thread, extracts the edges online, and saves
+## two sidecar files next to the recording:
+##
+##   <basename>_<acqno>_digital.npy  -- the (scans x ports) uint8 words, written as they
+##                                      arrive (its shape is completed upon StorageManager.closing)
+##   <basename>_<acqno>_edges.npy    -- a structured array of EDGE_DTYPE, in the order of time
+##
+## the names of the sidecars and the ports are added to the .cfg file under "digital".
+##
+
+EDGE_DTYPE = np.dtype([('sample', '<i8'), ('port', '<u1'), ('line', '<u1'), ('rising', '?')])
+
+DigitalManager = None
+
+def extract_edges(words, previous=None, offset=0):
+    """returns the transitions of the lines in `words` ((scans x ports) uint8) as EDGE_DTYPE,
+    sorted by sample, port and line.
+
+    `previous` is the last word of each port before `words` (no transition
+    is reported at the first scan if it is None), and `offset` is the sample index of
+    the first scan. only the scans that have changed are unpacked."""
+    if previous is None:
+        previous = words[0]
+    # the XOR with the previous scan is the bitwise counterpart of np.diff()
+    flat    = np.ascontiguousarray(words).reshape((-1,))
+    flips   = flat ^ np.concatenate([np.reshape(previous, (-1,)), flat[:-words.shape[1]]])
+    index   = np.flatnonzero(flips)
+    if index.shape[0] == 0:
+        return np.zeros((0,), dtype=EDGE_DTYPE)
+    changed = np.unpackbits(flips[index].reshape((-1,1)), axis=1, bitorder='little')
+    which, lines = np.nonzero(changed)
+    index   = index[which]
+    edges   = np.empty(index.shape, dtype=EDGE_DTYPE)
+    edges['sample'] = offset + index // words.shape[1]
+    edges['port']   = index % words.shape[1]
+    edges['line']   = lines
+    edges['rising'] = (flat[index] >> lines.astype(np.uint8)) & 1
+    return edges
+
+class DigitalRecorderObject(QtCore.QObject):
+    """writes the digital words of the acquired chunks (in its own thread),
+    and saves their edges when the recording is finalized."""
+
+    detected = QtCore.pyqtSignal(np.ndarray)
+
+    def __init__(self, edges=True, parent=None):
+        super().__init__(parent)
+        self.name     = "Digital"
+        self.edges    = edges
+        self.ports    = None
+        self._target  = None
+        self._edges   = []
+
+    def prepare(self, save=True):
+        self.ports = None
+        driver = devices.DeviceManager.current
+        ports  = [port for port in driver.ports.values() if port.inuse == True]
+        if len(ports) == 0:
+            return
+        self.ports     = ports
+        self._target   = None
+        if save == True:
+            # StorageManager has been prepared (i.e. the acquisition number is settled)
+            self._target = storages.NpyTarget(storages.StorageManager.current.path_prefix() + "_digital.npy",
+                                              np.uint8, len(ports))
+        self._edges    = []
+        self._previous = None
+        self._offset   = 0
+        driver.digitalAvailable.connect(self.update)
+
+    def update(self, words):
+        if self.edges == True:
+            edges = extract_edges(words, self._previous, self._offset)
+            if edges.shape[0] > 0:
+                self._edges.append(edges)
+                self.detected.emit(edges)
+        if self._target is not None:
+            self._target.write(words)
+        self._previous = words[-1]
+        self._offset  += words.shape[0]
+
+    def finalize(self, prefix, sidecars):
+        """completes `prefix`_digital.npy, saves the edges as `prefix`_edges.npy
+        (unless `prefix` is empty), and adds the "digital" entry to `sidecars`."""
+        if self.ports is None:
+            return
+        devices.DeviceManager.current.digitalAvailable.disconnect(self.update)
+        if len(self._edges) > 0:
+            edges = np.concatenate(self._edges)
+        else:
+            edges = np.zeros((0,), dtype=EDGE_DTYPE)
+        print(f"[{self.name}] {self._offset} scans, {edges.shape[0]} edges")
+        if self._target is not None:
+            self._target.close()
+        if len(prefix) > 0:
+            path  = prefix + "_digital.npy"
+            entry = OrderedDict(file=os.path.basename(path), scans=self._offset, bitorder='little',
+                                ports=[OrderedDict(name=port.name, lines=port.lines) for port in self.ports])
+            if self.edges == True:
+                edgepath = prefix + "_edges.npy"
+                np.save(edgepath, edges)
+                entry['edges'] = os.path.basename(edgepath)
+                entry['count'] = int(edges.shape[0])
+            sidecars['digital'] = entry
+            print(f"[{self.name}] saved: {path}")
+        self._target = None
+        self._edges  = []
+        self.ports   = None
+
+def setup(cfg):
+    global DigitalManager
+    DigitalManager = DigitalRecorderObject(**cfg.get('digital', {}))
@@ -0,0 +1,173 @@
+
+import os
+from collections import OrderedDict
+import numpy as np
+from pyqtgraph.Qt import QtCore
+from . import devices
+
+##
+## Online event (spike) detection
+##
+## EventManager runs in its own thread, receives the chunks through dataAvailable,
+## and saves the detected events into a sidecar file next to the recording
+## (upon StorageManager.closing):
+##
+##   <basename>_<acqno>_events.npy  -- a structured array of EVENT fields (see event_dtype())
+##
+## the name of the sidecar and the detection settings are added to the .cfg file
+## under "events".
+##
+
+DEFAULT_THRESHOLD   = 5.0   # in units of the noise s.d.
+DEFAULT_POLARITY    = 'negative' # 'negative', 'positive' or 'both'
+DEFAULT_REFRACTORY  = 1.0   # in msec
+DEFAULT_PRE         = 0.5   # in msec
+DEFAULT_POST        = 1.0   # in msec
+DEFAULT_ADAPTATION  = 0.1   # weight of the newest chunk in the noise estimate
+
+EventManager = None
+
+def event_dtype(snippetsize):
+    return np.dtype([('sample', '<i8'), ('channel', '<i4'), ('amplitude', '<f4'),
+                     ('snippet', '<f4', (snippetsize,))])
+
+class ThresholdDetector:
+    """threshold-crossing detection with a refractory period, vectorized across a chunk.
+
+    the threshold of each channel is `threshold` times its noise s.d., estimated as
+    median(|x - median(x)|)/0.6745 and averaged exponentially across chunks.
+    a snippet of `pre` + `post` samples around the crossing is kept for every event,
+    so that the events near the end of a chunk are reported with the next chunk."""
+
+    def __init__(self, nchan, rate, threshold=DEFAULT_THRESHOLD, polarity=DEFAULT_POLARITY,
+                    refractory=DEFAULT_REFRACTORY, pre=DEFAULT_PRE, post=DEFAULT_POST,
+                    adaptation=DEFAULT_ADAPTATION):
+        if polarity not in ('negative', 'positive', 'both'):
+            raise ValueError(f"unknown polarity: '{polarity}'")
+        self.nchan      = nchan
+        self.threshold  = threshold
+        self.polarity   = polarity
+        self.adaptation = adaptation
+        self.refractory = max(int(round(refractory*rate/1000)), 1)
+        self.pre        = max(int(round(pre*rate/1000)), 1)
+        self.post       = max(int(round(post*rate/1000)), 1)
+        self.dtype      = event_dtype(self.pre + self.post)
+        self.noise      = np.full((nchan,), np.nan) # not estimated until the first chunk
+        self._carry     = np.zeros((0, nchan), dtype=float)
+        self._offset    = 0 # the sample index of the first row of _carry
+        self._scanned   = 1 # the sample index of the next crossing to be examined
+        self._last      = np.full((nchan,), -self.refractory, dtype=np.int64) # the last event of each channel
+
+    def process(self, data):
+        """returns the events whose snippets have become complete with `data`."""
+        center = np.median(data, axis=0)
+        sigma  = np.median(np.abs(data - center), axis=0)/0.6745
+        if np.isnan(self.noise).all():
+            self.noise = sigma
+        else:
+            self.noise = (1 - self.adaptation)*self.noise + self.adaptation*sigma
+
+        buf = np.concatenate([self._carry, data], axis=0)
+        if self.polarity == 'negative':
+            x = -buf
+        elif self.polarity == 'positive':
+            x = buf
+        else:
+            x = np.abs(buf)
+        above = x > (self.threshold*self.noise)
+
+        # the crossings at `first` .. `stop-1` (relative to buf) have complete snippets
+        first = max(self._scanned - self._offset, self.pre, 1)
+        stop  = buf.shape[0] - self.post + 1
+        events = np.zeros((0,), dtype=self.dtype)
+        if stop > first:
+            rows, chans = np.nonzero(above[first:stop] & ~above[first-1:stop-1])
+            rows += first
+            # the refractory period is resolved in the order of time (the events are sparse)
+            keep = np.ones(rows.shape, dtype=bool)
+            for i, (row, ch) in enumerate(zip(rows, chans)):
+                sample = self._offset + row
+                if sample - self._last[ch] < self.refractory:
+                    keep[i] = False
+                else:
+                    self._last[ch] = sample
+            rows, chans = rows[keep], chans[keep]
+
+            events = np.empty(rows.shape, dtype=self.dtype)
+            window = rows.reshape((-1,1)) + np.arange(-self.pre, self.post).reshape((1,-1))
+            snippets = buf[window, chans.reshape((-1,1))]
+            peaks = np.argmax(x[window, chans.reshape((-1,1))], axis=1)
+            events['sample']    = self._offset + rows
+            events['channel']   = chans
+            events['amplitude'] = snippets[np.arange(snippets.shape[0]), peaks]
+            events['snippet']   = snippets
+            self._scanned = self._offset + stop
+
+        keep = self.pre + self.post + 1
+        self._offset += max(buf.shape[0] - keep, 0)
+        self._carry   = buf[-keep:].copy()
+        return events
+
+class EventDetectorManager(QtCore.QObject):
+    """runs a ThresholdDetector on the acquired chunks (in its own thread),
+    and saves the events in a sidecar file when the recording is finalized."""
+
+    detected = QtCore.pyqtSignal(np.ndarray)
+
+    def __init__(self, enabled=False, threshold=DEFAULT_THRESHOLD, polarity=DEFAULT_POLARITY,
+                    refractory=DEFAULT_REFRACTORY, pre=DEFAULT_PRE, post=DEFAULT_POST, parent=None):
+        super().__init__(parent)
+        self.name       = "Events"
+        self.enabled    = enabled
+        self.settings   = OrderedDict(threshold=threshold, polarity=polarity,
+                                      refractory=refractory, pre=pre, post=post)
+        self.detector   = None
+        self._events    = []
+
+    def prepare(self, save=True):
+        self.detector = None
+        if self.enabled == False:
+            return
+        driver  = devices.DeviceManager.current
+        plan    = devices.DeviceManager.plan
+        if plan.nchan == 0:
+            return
+        self.scales   = plan.scales
+        self.detector = ThresholdDetector(plan.nchan, plan.rate, **self.settings)
+        self._events  = []
+        driver.dataAvailable.connect(self.update)
+
+    def update(self, data):
+        events = self.detector.process(data*self.scales)
+        if events.shape[0] > 0:
+            self._events.append(events)
+            self.detected.emit(events)
+
+    def finalize(self, prefix, sidecars):
+        """saves the events as `prefix`_events.npy (unless `prefix` is empty),
+        and adds its "events" entry to `sidecars`."""
+        if self.detector is None:
+            return
+        try:
+            devices.DeviceManager.current.dataAvailable.disconnect(self.update)
+            if len(self._events) > 0:
+                events = np.concatenate(self._events)
+            else:
+                events = np.zeros((0,), dtype=self.detector.dtype)
+            print(f"[{self.name}] detected {events.shape[0]} events")
+            if len(prefix) > 0:
+                path = prefix + "_events.npy"
+                np.save(path, events)
+                # the noise is null if no chunk has arrived
+                entry = OrderedDict(file=os.path.basename(path), count=int(events.shape[0]),
+                                    noise=[float(v) if np.isfinite(v) else None for v in self.detector.noise])
+                entry.update(self.settings)
+                sidecars['events'] = entry
+                print(f"[{self.name}] saved: {path}")
+        finally:
+            self._events  = []
+            self.detector = None
+
+def setup(cfg):
+    global EventManager
+    EventManager = EventDetectorManager(**cfg.get('events', {}))
@@ -0,0 +1,137 @@
+
+import time, math
+import numpy as np
+
+##
+## Closed-loop hooks
+##
+## a hook is a small function that is called on every chunk from within the acquisition
+## itself (before the chunk is delivered to the other consumers), e.g. to drive an output:
+##
+##   from mosca import hooks
+##   def react(data):            # data: (scans x channels), unscaled
+##       ...
+##   hooks.register(hooks.ClosedLoopHook(react, budget=0.5))
+##
+## drivers call ClosedLoopHook.invoke() in their acquisition thread (see BaseDeviceDriver.attach_hook()).
+## mosca.lib.NI.Board calls it once per delivery batch (use a batch of 1 chunk for closed loops),
+## or calls a native hook (a PyCapsule of a C function, see `native`) right after every
+## DAQmxReadAnalogF64(), without the GIL.
+##
+## the latency from the arrival of the chunk (the oldest one of a batch) to the completion
+## of the hook is recorded in a histogram with LATENCY_BINS_PER_OCTAVE bins per doubling,
+## from 1 usec on. if the driver does not time the arrivals (see BaseDeviceDriver._arrival),
+## the histogram only holds the run time of the hook, and is reported as such.
+## a hook that exceeds its `budget` `maxoverruns` times in a row is disabled until the next start.
+##
+
+LATENCY_BINS_PER_OCTAVE = 4
+LATENCY_NBINS           = 80 # up to ~1 sec (the last bin also counts the longer latencies)
+NATIVE_CAPSULE_NAME     = "mosca.hook" # int hook(void *ctx, const double *data, int32 nscans, int nchan)
+
+DEFAULT_BUDGET_MSEC     = 1.0
+DEFAULT_MAX_OVERRUNS    = 10
+
+Current = None # the registered ClosedLoopHook
+
+def latency_edges():
+    """the lower edges of the latency bins, in usec."""
+    return 2.0**(np.arange(LATENCY_NBINS)/LATENCY_BINS_PER_OCTAVE)
+
+def latency_bin(usec):
+    if usec < 1:
+        return 0
+    return min(int(math.floor(LATENCY_BINS_PER_OCTAVE*math.log2(usec))), LATENCY_NBINS - 1)
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = np.zeros((LATENCY_NBINS,), dtype=np.uint64)
+
+    def __getattr__(self, name):
+        if name == 'total':
+            return int(self.counts.sum())
+        else:
+            raise AttributeError(name)
+
+    def reset(self):
+        self.counts[:] = 0
+
+    def add(self, usec):
+        self.counts[latency_bin(usec)] += 1
+
+    def merge(self, counts):
+        self.counts += np.asarray(counts, dtype=np.uint64)
+
+    def percentile(self, q):
+        """the upper edge (in usec) of the bin that contains the `q`-th percentile."""
+        total = self.total
+        if total == 0:
+            return float('nan')
+        index = int(np.searchsorted(np.cumsum(self.counts), q*total/100))
+        return float(2.0**((index + 1)/LATENCY_BINS_PER_OCTAVE))
+
+    def summary(self, label='latency'):
+        if self.total == 0:
+            return "no invocation"
+        return "{0} invocations, {1} median <{2:.3f} ms, 99% <{3:.3f} ms, max <{4:.3f} ms".format(
+                    self.total, label, self.percentile(50)/1000, self.percentile(99)/1000, self.percentile(100)/1000)
+
+class ClosedLoopHook:
+    """`func` is called with every chunk (or batch) in the acquisition thread.
+
+    `native` may be a PyCapsule (named NATIVE_CAPSULE_NAME) of a C function with the
+    signature above, with its `ctx` as the capsule context; drivers that support it
+    (mosca.lib.NI.Board) call it instead of `func`, and a non-zero return value disables it.
+    the other drivers only call `func`: they refuse a hook without it (see BaseDeviceDriver.attach_hook())."""
+
+    def __init__(self, func=None, budget=DEFAULT_BUDGET_MSEC, maxoverruns=DEFAULT_MAX_OVERRUNS, native=None):
+        if (func is None) and (native is None):
+            raise ValueError("either a function or a native hook is required")
+        self.name        = getattr(func, '__name__', 'native')
+        self.func        = func
+        self.native      = native
+        self.budget      = float(budget)
+        self.maxoverruns = int(maxoverruns)
+        self.histogram   = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        """called by the driver upon attach_hook()."""
+        self.histogram.reset()
+        self.overruns = 0 # the number of invocations that exceeded the budget
+        self.untimed  = 0 # the number of invocations without the arrival of the chunk
+        self.disabled = False
+        self._streak  = 0
+
+    def invoke(self, data, delay=None):
+        """calls the hook on `data`, which arrived `delay` msec ago (None if unknown)."""
+        if self.disabled == True:
+            return
+        if delay is None:
+            self.untimed += 1
+            delay = 0.0
+        start = time.perf_counter()
+        self.func(data)
+        elapsed = (time.perf_counter() - start)*1000
+        self.histogram.add((delay + elapsed)*1000)
+        if elapsed > self.budget:
+            self.overruns += 1
+            self._streak  += 1
+            if self._streak >= self.maxoverruns:
+                self.disabled = True
+                print(f"***Hook '{self.name}': disabled after exceeding the budget ({self.budget} ms) {self._streak} times in a row")
+        else:
+            self._streak = 0
+
+    def report(self):
+        label = "latency" if self.untimed == 0 else "run time (the arrivals are not timed)"
+        print(f"[Hook] '{self.name}': {self.histogram.summary(label)}" +
+              (f"; {self.overruns} over budget" if self.overruns > 0 else ""))
+
+def register(hook):
+    """the hook is attached to the device driver from the next start on. None to unregister."""
+    global Current
+    Current = hook
+
+def unregister():
+    register(None)
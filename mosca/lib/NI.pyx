@@ -17,7 +17,14 @@ cdef extern from "NIDAQmx.h":
     DEF DAQmx_Val_Acquired_Into_Buffer      = 1
     DEF DAQmx_Val_Transferred_From_Buffer   = 2
 
+    DEF DAQmx_Val_Task_Commit               = 3
+
+    DEF DAQmx_Val_DoNotAllowRegen           = 10158
+
+    DEF DAQmx_Val_ChanForAllLines           = 1
+
     ctypedef void*  TaskHandle
+    ctypedef unsigned char  uInt8
     ctypedef signed long    int32
     ctypedef unsigned long  uInt32
     ctypedef uInt32         bool32
@@ -35,6 +42,14 @@ cdef extern from "NIDAQmx.h":
     int32 DAQmxStopTask (TaskHandle taskHandle) nogil
     int32 DAQmxWaitUntilTaskDone (TaskHandle taskHandle, float64 timeToWait) nogil
     int32 DAQmxClearTask (TaskHandle taskHandle) nogil
+    int32 DAQmxTaskControl (TaskHandle taskHandle, int32 action) nogil
+    int32 DAQmxCreateAOVoltageChan (TaskHandle taskHandle,
+                                    const char physicalChannel[],
+                                    const char nameToAssignToChannel[],
+                                    float64 minVal,
+                                    float64 maxVal,
+                                    int32 units,
+                                    const char customScaleName[]) nogil
     int32 DAQmxCreateAIVoltageChan (TaskHandle taskHandle,
                                     const char physicalChannel[],
                                     const char nameToAssignToChannel[],
@@ -43,12 +58,19 @@ cdef extern from "NIDAQmx.h":
                                     float64 maxVal,
                                     int32 units,
                                     const char customScaleName[]) nogil
+    int32 DAQmxCreateDIChan (TaskHandle taskHandle,
+                                const char lines[],
+                                const char nameToAssignToLines[],
+                                int32 lineGrouping) nogil
     int32 DAQmxCfgSampClkTiming ( TaskHandle taskHandle,
                                     const char source[],
                                     float64 rate,
                                     int32 activeEdge,
                                     int32 sampleMode,
                                     uInt64 sampsPerChan ) nogil
+    int32 DAQmxCfgDigEdgeStartTrig ( TaskHandle taskHandle,
+                                    const char triggerSource[],
+                                    int32 triggerEdge ) nogil
     int32 DAQmxRegisterEveryNSamplesEvent( TaskHandle task,
                                             int32 everyNsamplesEventType,
                                             uInt32 nSamples,
@@ -64,14 +86,36 @@ cdef extern from "NIDAQmx.h":
                                 uInt32 arraySizeInSamps,
                                 int32 *sampsPerChanRead,
                                 bool32 *reserved ) nogil
+    int32 DAQmxReadDigitalU8 ( TaskHandle taskHandle,
+                                int32 numSampsPerChan,
+                                float64 timeout,
+                                bool32 fillMode,
+                                uInt8 readArray[],
+                                uInt32 arraySizeInSamps,
+                                int32 *sampsPerChanRead,
+                                bool32 *reserved ) nogil
+    int32 DAQmxSetWriteRegenMode (TaskHandle taskHandle, int32 data) nogil
+    int32 DAQmxCfgOutputBuffer (TaskHandle taskHandle, uInt32 numSampsPerChan) nogil
+    int32 DAQmxWriteAnalogF64 ( TaskHandle taskHandle,
+                                int32 numSampsPerChan,
+                                bool32 autoStart,
+                                float64 timeout,
+                                bool32 dataLayout,
+                                const float64 writeArray[],
+                                int32 *sampsPerChanWritten,
+                                bool32 *reserved ) nogil
     int32 DAQmxGetExtendedErrorInfo ( char errorString[],
                                     uInt32 bufferSize) nogil
 
 from libc.stdio cimport printf
+from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
+from libc.math cimport log2, floor
+from cpython.pycapsule cimport PyCapsule_GetPointer, PyCapsule_GetContext
 
 from cpython cimport array as carray
-import array
-from threading import Thread
+import array, time
+from threading import Thread, Event
 from collections import OrderedDict
 
 import numpy as np
@@ -79,113 +123,462 @@ cimport numpy as cnumpy
 cnumpy.import_array()
 
 cimport corelib
+cimport nativeio
+from mosca import utils, param, scheduling, hooks
 from mosca.channels import BaseChannelModel
 from mosca.devices import BaseDeviceDriver
 
+# "DI": the hardware-timed digital input ports, and their numbers of lines
 boardspecs = {
-  "NI6321": {"AI": 16},
-  "USB6002": {"AI": 8}
+  "NI6321": {"AI": 16, "AO": 2, "DI": {"port0": 8}},
+  "USB6002": {"AI": 8, "AO": 2}
 }
 
 DEF bufsiz = 2048
 DEF DEFAULT_TIMEOUT_SEC = 10
+DEF MIN_RING_SLOTS = 8
+DEF OUTPUT_BLOCKS = 2           # the number of blocks in the buffer of an OutputTask
+DEF HOOK_BINS = 80              # the same as mosca.hooks.LATENCY_NBINS
+DEF HOOK_BINS_PER_OCTAVE = 4    # the same as mosca.hooks.LATENCY_BINS_PER_OCTAVE
 cdef carray.array cbuf_temp = array.array('b', [])
 cdef carray.array dbuf_temp = array.array('d', [])
 cdef char errbuf[bufsiz]
 
+DEFAULT_BATCH_CHUNKS = 1
+DEFAULT_BUDGET_MSEC  = 50
+
 class NIDAQmxError(RuntimeError):
     def __init__(self, msg):
         super().__init__(msg)
 
 cpdef void _check_error(int ret):
-    cdef uInt32 size
     if ret < 0:
-        size = DAQmxGetExtendedErrorInfo(errbuf, bufsiz)
-        raise NIDAQmxError( (<bytes>(errbuf[:size])).decode('ascii') )
+        # DAQmxGetExtendedErrorInfo() returns a status code (not the length),
+        # and the message is NUL-terminated.
+        DAQmxGetExtendedErrorInfo(errbuf, bufsiz)
+        raise NIDAQmxError( (<bytes>errbuf).decode('ascii') )
 
 
 class Board(BaseDeviceDriver):
     """a wrapper implementation for NI DAQmx-based boards.
-    for the moment, it only supports floating-point AI channels in RSE mode."""
+    for the moment, it only supports floating-point AI channels in RSE mode,
+    the hardware-timed DI ports (clocked by the AI sample clock),
+    and the AO channels for playing a stimulus (see attach_stimulus()).
+    a board can share its sample clock and start trigger with other boards
+    (see sync_terminals() and mosca.composite); the terminals must be routed,
+    e.g. through an RTSI cable."""
+
+    batch  = param.Parameter('Delivery batch (chunks)', mode='int',
+                    convert=lambda self, val: utils.validate_integer(val, (1, 1000), 'delivery batch'))
+    budget = param.Parameter('Delivery budget (ms)', mode='int',
+                    convert=lambda self, val: utils.validate_integer(val, (0, 60000), 'delivery budget'))
 
     def __init__(self, name, boardtype=None, raterange=None, intervalrange=None,
+                    batch=DEFAULT_BATCH_CHUNKS, budget=DEFAULT_BUDGET_MSEC,
                     parent=None):
         super().__init__("{0} ({1})".format(name, boardtype),
                             parent=parent,
                             raterange=raterange,
                             intervalrange=intervalrange)
         self._boardname = name
+        self._batch     = batch
+        self._budget    = budget
+        self._task      = None
+        self._armed     = None
+        self._writer    = None
+        self._output    = None
+        self._clock     = "" # the external sample clock (if synchronized to another board)
+        self._trigger   = "" # the external start trigger
+        self._started   = Event()
+        self._physical  = {} # the channel models may be renamed (e.g. by mosca.composite)
         for i in range(boardspecs[boardtype]["AI"]):
             physical = "{0}/ai{1:d}".format(name, i)
             virtual  = "AI{0:d}".format(i)
             self._channels[virtual] = BaseChannelModel(physical, parent=self)
+            self._physical[virtual] = physical
+        self._outputs   = ["{0}/ao{1:d}".format(name, i) for i in range(boardspecs[boardtype].get("AO", 0))]
+        for port, lines in boardspecs[boardtype].get("DI", {}).items():
+            self.add_port(port, "{0}/{1}".format(name, port), lines=lines)
+
+    def arm_signature(self):
+        return super().arm_signature() + (self._batch, self._budget, self._clock, self._trigger)
 
+    def sync_terminals(self):
+        return ("/{0}/ai/SampleClock".format(self._boardname), "/{0}/ai/StartTrigger".format(self._boardname))
+
+    def set_sync(self, clock, trigger):
+        self._clock   = clock
+        self._trigger = trigger
 
     def prepare(self):
-        self._inuse = [ch for ch in self._channels.values() if ch.inuse == True]
-        self._nchan = len(self._inuse)
-        self._nsamp = self.interval
-        self._buf   = np.empty((self._nsamp * self._nchan,), dtype=float)
-        self._buf[:]= np.nan
-        self._task = OscilloTask(self, "mosca", self._inuse, self.rate, self.interval)
-        self._thread = Thread(target=self._task.start)
-        print("prepared: {0} channels with interval {1} samples".format(self._nchan, self._nsamp))
+        signature = self.arm_signature()
+        if (self._task is not None) and (signature == self._armed):
+            print("prepared: reusing the armed task")
+        else:
+            self.disarm()
+            self._inuse = [self._physical[name] for name in self.plan.names]
+            self._nchan = len(self._inuse)
+            self._nsamp = self.interval
+            ports       = [port.name for port in self._ports.values() if port.inuse == True]
+            self._task = OscilloTask(self, "mosca", self._inuse, self.rate, self.interval,
+                                        self._batch, self._budget,
+                                        ports=ports, clock="/{0}/ai/SampleClock".format(self._boardname),
+                                        source=self._clock, trigger=self._trigger)
+            self._task.commit()
+            self._armed = signature
+            if self._writer is not None:
+                self._task.attach_writer(self._writer)
+            if self._hook is not None:
+                self._task.attach_hook(self._hook)
+            print("prepared: {0} channels with interval {1} samples (batch: {2} chunks or {3} ms)".format(
+                    self._nchan, self._nsamp, self._batch, self._budget))
+        if self._stimulus is not None:
+            # the stimulus may differ between the runs: the output task is never kept armed
+            period = self._stimulus.render(self.rate)[:, :len(self._outputs)]
+            self._output = OutputTask("mosca-ao", self._outputs[:period.shape[1]],
+                                        "/{0}/ai/SampleClock".format(self._boardname),
+                                        self.rate, self.interval, period, self._stimulus.repeat)
+            print("prepared: stimulus on {0} channels ({1} samples per period)".format(
+                    period.shape[1], period.shape[0]))
+        self._thread = Thread(target=self._run_task)
+
+    def _run_task(self):
+        # the delivery loop runs outside of DeviceThread
+        scheduling.apply('device')
+        if self._output is not None:
+            # waits for the sample clock of the AI task
+            self._output.start()
+        self._task.start(onstart=self._started.set)
 
     def start(self):
+        self._started.clear()
         self._thread.start()
+        if len(self._trigger) > 0:
+            # armed before the leader starts
+            if self._started.wait(DEFAULT_TIMEOUT_SEC) == False:
+                print("***{0}: the task did not start within {1} sec".format(self.name, DEFAULT_TIMEOUT_SEC))
+
+    def get_delivery_batch(self):
+        if self._task is None:
+            return self._batch
+        return self._task.get_batch()
+
+    def set_delivery_batch(self, batch):
+        """the time budget is extended by the chunks added to the configured batch."""
+        if self._task is None:
+            return self._batch
+        budget = self._budget + max(batch - self._batch, 0)*1000*self.interval/self.rate
+        return self._task.set_batch(batch, budget)
 
     def stop(self):
-        self._task.stop()
+        self._task.stop(clear=(self.prearmed == False))
         self._thread.join()
-        del self._task
         del self._thread
+        self._task.detach_hook() # collects the statistics of a native hook
+        if self._output is not None:
+            self._output.stop()
+            self._output = None
+        if self.prearmed == False:
+            self._task  = None
+            self._armed = None
+        else:
+            self._task.set_batch(self._batch, self._budget)
+
+    def disarm(self):
+        if self._task is not None:
+            self._task.close()
+        self._task  = None
+        self._armed = None
+
+    def attach_writer(self, writer):
+        self._writer = writer
+        if self._task is not None:
+            self._task.attach_writer(writer)
+        return True
+
+    def detach_writer(self):
+        self._writer = None
+        if self._task is not None:
+            self._task.detach_writer()
+
+    def attach_hook(self, hook):
+        """a native hook is called right after every read from the DAQmx callback;
+        otherwise the hook is called upon every delivery batch, before dataAvailable is emitted."""
+        hook.reset()
+        self._hook = hook
+        if self._task is not None:
+            self._task.attach_hook(hook)
+        return True
+
+    def detach_hook(self):
+        self._hook = None
+        if self._task is not None:
+            self._task.detach_hook()
+
+    def attach_stimulus(self, stimulus):
+        """the stimulus is played on the AO channels (from ao0 on), clocked by the AI sample clock."""
+        if len(self._outputs) == 0:
+            return False
+        if stimulus.nchan > len(self._outputs):
+            print("***{0}: the board has {1} AO channels; the rest of the stimulus is not played".format(
+                    self.name, len(self._outputs)))
+        self._stimulus = stimulus
+        return True
+
+ctypedef int (*chunkhook)(void *ctx, const double *data, int32 nscans, int nchan) nogil
+
+ctypedef struct chunkring:
+    # the native ring of chunks, shared between the DAQmx callback thread
+    # and the delivery thread. every field is guarded by `io`.
+    TaskHandle      handle
+    double         *data        # nslots x chunksiz
+    int32          *counts      # number of scans read into each slot
+    uInt32          interval
+    uInt32          chunksiz
+    uInt32          nslots
+    uInt64          head        # total number of chunks read from the device
+    uInt64          tail        # total number of chunks delivered to Python
+    uInt64          stalls      # number of chunks that waited for a slot, because the ring was full
+    uInt32          batch
+    double          budget
+    double          lastflush
+    int             ready
+    int             term
+    int32           error
+    corelib.mutex_t io
+    corelib.cond_t  update
+    corelib.cond_t  space       # notified when the delivery thread frees slots
+    nativeio.nativewriter *writer  # receives every chunk read (guarded by `wio`)
+    uInt64          unwritten   # number of chunks that the writer refused
+    corelib.mutex_t wio
+    double         *arrivals    # the clock when the chunk of each slot arrived
+    TaskHandle      dihandle    # the DI task clocked by the AI task (or NULL)
+    uInt8          *digital     # nslots x digisiz, in parallel with `data`
+    uInt32          nports
+    uInt32          digisiz
+    chunkhook       hook        # the native hook called upon every chunk read (guarded by `hio`)
+    void           *hookctx
+    double          hookbudget  # in msec
+    uInt32          hookmaxoverruns
+    uInt32          hookstreak  # the number of consecutive overruns
+    uInt64          hookoverruns
+    int             hookstatus  # 1 if disabled by overruns, or the non-zero value returned from the hook
+    uInt64          hookcounts[HOOK_BINS]
+    corelib.mutex_t hio
+
+
+cdef void _run_hook(chunkring *ring, double *data, int32 nscans, double arrival) nogil:
+    """calls the native hook, and accounts for its latency from the arrival of the chunk.
+    must be called with `hio` held."""
+    cdef double start = corelib.clock_msec()
+    cdef int    ret   = ring.hook(ring.hookctx, data, nscans, <int>(ring.chunksiz // ring.interval))
+    cdef double done  = corelib.clock_msec()
+    cdef double usec  = (done - arrival)*1000
+    cdef int    b     = 0
+    if usec >= 1:
+        b = <int>floor(HOOK_BINS_PER_OCTAVE*log2(usec))
+        if b >= HOOK_BINS:
+            b = HOOK_BINS - 1
+    ring.hookcounts[b] += 1
+    if ret != 0:
+        ring.hookstatus = ret
+        ring.hook       = NULL
+    elif (done - start) > ring.hookbudget:
+        ring.hookoverruns += 1
+        ring.hookstreak   += 1
+        if ring.hookstreak >= ring.hookmaxoverruns:
+            ring.hookstatus = 1
+            ring.hook       = NULL
+    else:
+        ring.hookstreak = 0
+
+
+cdef int32 _read_chunk(TaskHandle handle, int32 evttype, uInt32 nsamp, void *wrapper) nogil:
+    """registered and called as EveryNSamplesEvent from NIDAQmx.
+    'wrapper' should be the pointer to the chunkring of an OscilloTask.
+
+    Note that the caller thread is _not_ a Python thread: this function never touches
+    Python objects. It only copies the chunk into the ring (after calling the native
+    hook and handing it to the native writer, if any), and notifies the delivery
+    thread when a batch is complete or the time budget has been spent.
+
+    When the ring is full, it waits for the delivery thread to free a slot (the scans
+    meanwhile stay in the buffer of the driver), so that no chunk is ever dropped."""
+    cdef double arrival = corelib.clock_msec()
+    cdef chunkring *ring = <chunkring *>wrapper
+    cdef int32  status
+    cdef int32  nread = 0
+    cdef int32  dread = 0
+    cdef double *dst
+    cdef uInt8  *ddst = NULL
+
+    corelib.mutex_lock(&(ring.io))
+    if ((ring.head - ring.tail) >= ring.nslots) and (ring.term == 0):
+        ring.stalls += 1
+        ring.ready   = 1
+        corelib.cond_notify_all(&(ring.update))
+        while ((ring.head - ring.tail) >= ring.nslots) and (ring.term == 0):
+            corelib.cond_wait(&(ring.space), &(ring.io), -1)
+    if ring.term != 0:
+        # the task is stopping, and the delivery loop may have returned already
+        corelib.mutex_unlock(&(ring.io))
+        return 0
+    corelib.mutex_unlock(&(ring.io))
+
+    # the slot at `head` is invisible to the delivery thread until `head` is incremented,
+    # so it is safe to read into it without holding the lock.
+    dst = ring.data + (<size_t>(ring.head % ring.nslots)) * ring.chunksiz
+    if ring.dihandle is not NULL:
+        ddst = ring.digital + (<size_t>(ring.head % ring.nslots)) * ring.digisiz
+    status = DAQmxReadAnalogF64(
+                    ring.handle,
+                    ring.interval,
+                    DEFAULT_TIMEOUT_SEC,
+                    DAQmx_Val_GroupByScanNumber,
+                    dst,
+                    ring.chunksiz,
+                    &nread,
+                    NULL
+                )
+    # the DI task shares the sample clock: the same scans are available
+    if (ddst is not NULL) and (status >= 0) and (nread > 0):
+        status = DAQmxReadDigitalU8(
+                    ring.dihandle,
+                    nread,
+                    DEFAULT_TIMEOUT_SEC,
+                    DAQmx_Val_GroupByScanNumber,
+                    ddst,
+                    ring.digisiz,
+                    &dread,
+                    NULL
+                )
+
+    # the hook comes first, as it is waited for by the closed loop.
+    if (status >= 0) and (nread > 0):
+        corelib.mutex_lock(&(ring.hio))
+        if ring.hook is not NULL:
+            _run_hook(ring, dst, nread, arrival)
+        corelib.mutex_unlock(&(ring.hio))
+        corelib.mutex_lock(&(ring.wio))
+        if ring.writer is not NULL:
+            if nativeio.writer_push(ring.writer, dst, nread) != 0:
+                ring.unwritten += 1
+        corelib.mutex_unlock(&(ring.wio))
+
+    corelib.mutex_lock(&(ring.io))
+    if status < 0:
+        ring.error = status
+        ring.term  = 1
+        ring.ready = 1
+        printf("abort\n")
+    else:
+        ring.counts[ring.head % ring.nslots]   = nread
+        ring.arrivals[ring.head % ring.nslots] = arrival
+        ring.head += 1
+        if ((ring.head - ring.tail) >= ring.batch) or \
+                ((corelib.clock_msec() - ring.lastflush) >= ring.budget):
+            ring.ready = 1
+    if ring.ready != 0:
+        corelib.cond_notify_all(&(ring.update))
+    corelib.mutex_unlock(&(ring.io))
+    return 0
 
 
 cdef class OscilloTask:
+    """an AI task that acquires chunks of `interval` scans of the physical `channels`
+    (e.g. 'Dev1/ai0') into a native ring, and delivers them to Python in batches
+    of `batch` chunks (or after `budget` msec).
+
+    the DI `ports` (if any) are acquired by another task, clocked by the AI sample
+    clock `clock` (e.g. '/Dev1/ai/SampleClock'), and read right after every AI chunk.
+    the AI task itself takes its sample clock from `source` and waits for the start
+    trigger `trigger`, if they are given (e.g. the terminals of another board).
 
-    cdef double *_buf
-    cdef cnumpy.ndarray _array
+    the delivery loop (start()) only takes the GIL once per batch."""
+
+    cdef cnumpy.ndarray _array  # the staging buffer that is exposed to Python
+    cdef double      *_staging
+    cdef cnumpy.ndarray _digital  # the staging buffer of the DI words
+    cdef uInt8       *_dstaging
+    cdef carray.array diname
+    cdef chunkring    _ring
 
     cdef carray.array name
     cdef int          _nchan
-    cdef uInt32       _interval
-    cdef uInt32       _chunksiz
     cdef TaskHandle   _handle
     cdef object       _parent
-
-    cdef corelib.mutex_t _io
-    cdef corelib.cond_t  _update
-    cdef int          _term
-    cdef int32        _read
-
-    def __cinit__(self, parent, name, channels, rate, interval):
-        self.name       = array.array('b', name.encode('utf8')+b'\0')
-        self._interval  = interval
-        self._nchan      = <int>len(channels)
-        self._chunksiz  = len(channels)*self._interval
-        self._array     = np.empty((self._interval, self._nchan), dtype=np.float64, order='C')
+    cdef object       _writer   # keeps the NativeWriter alive while it is attached
+    cdef object       _hook     # the attached hooks.ClosedLoopHook
+    cdef double       _arrival  # the arrival of the oldest chunk in the staged batch
+
+    def __cinit__(self, parent, name, channels, rate, interval, batch=1, budget=0, ports=(), clock="", source="", trigger=""):
+        cdef uInt32 nslots
+        self.name           = array.array('b', name.encode('utf8')+b'\0')
+        self.diname         = array.array('b', (name + "-di").encode('utf8')+b'\0')
+        self._nchan         = <int>len(channels)
+        self._handle        = NULL
+        self._ring.data     = NULL
+        self._ring.counts   = NULL
+        self._ring.arrivals = NULL
+        self._ring.writer   = NULL
+        self._ring.hook     = NULL
+        self._ring.dihandle = NULL
+        self._ring.digital  = NULL
+        self._ring.nports   = len(ports)
+        self._ring.digisiz  = len(ports)*interval
+        self._hook          = None
+        self._ring.interval = interval
+        self._ring.chunksiz = len(channels)*interval
+        self._ring.batch    = max(<uInt32>batch, 1)
+        self._ring.budget   = budget
+        nslots              = max(4*self._ring.batch, MIN_RING_SLOTS)
+        self._ring.nslots   = nslots
+        self._ring.data     = <double *>malloc(nslots * self._ring.chunksiz * sizeof(double))
+        self._ring.counts   = <int32 *>malloc(nslots * sizeof(int32))
+        self._ring.arrivals = <double *>malloc(nslots * sizeof(double))
+        if self._ring.nports > 0:
+            self._ring.digital = <uInt8 *>malloc(nslots * self._ring.digisiz * sizeof(uInt8))
+        if (self._ring.data is NULL) or (self._ring.counts is NULL) or (self._ring.arrivals is NULL) or \
+                ((self._ring.nports > 0) and (self._ring.digital is NULL)):
+            raise MemoryError("failed to allocate the acquisition ring")
+        self._array     = np.empty((nslots * interval, self._nchan), dtype=np.float64, order='C')
+        self._digital   = np.empty((nslots * interval, max(len(ports), 1)), dtype=np.uint8, order='C')
 
         cdef double[:,:] proxy = self._array
-        self._buf       = &(proxy[0,0])
-        self._handle    = NULL
+        self._staging   = &(proxy[0,0])
+        cdef unsigned char[:,:] dproxy = self._digital
+        self._dstaging  = &(dproxy[0,0])
         assert isinstance(parent, Board)
         self._parent    = parent
-        corelib.errorcheck(corelib.mutex_init(&(self._io)))
-        corelib.errorcheck(corelib.cond_init(&(self._update)))
+        corelib.errorcheck(corelib.mutex_init(&(self._ring.io)))
+        corelib.errorcheck(corelib.cond_init(&(self._ring.update)))
+        corelib.errorcheck(corelib.cond_init(&(self._ring.space)))
+        corelib.errorcheck(corelib.mutex_init(&(self._ring.wio)))
+        corelib.errorcheck(corelib.mutex_init(&(self._ring.hio)))
         _check_error(DAQmxCreateTask(self.name.data.as_chars, &self._handle))
+        self._ring.handle = self._handle
 
     def __dealloc__(self):
         self.close()
-        corelib.mutex_free(&(self._io))
-        corelib.cond_free(&(self._update))
-
-
-    def __init__(self, parent, name, channels, rate, interval):
+        corelib.mutex_free(&(self._ring.io))
+        corelib.cond_free(&(self._ring.update))
+        corelib.cond_free(&(self._ring.space))
+        corelib.mutex_free(&(self._ring.wio))
+        corelib.mutex_free(&(self._ring.hio))
+        free(self._ring.data)
+        free(self._ring.counts)
+        free(self._ring.arrivals)
+        free(self._ring.digital)
+
+    def __init__(self, parent, name, channels, rate, interval, batch=1, budget=0, ports=(), clock="", source="", trigger=""):
         cdef carray.array namebuf
+        cdef carray.array clockbuf = array.array('b', clock.encode('utf8')+b'\0')
+        cdef carray.array sourcebuf = array.array('b', source.encode('utf8')+b'\0')
+        cdef carray.array triggerbuf = array.array('b', trigger.encode('utf8')+b'\0')
         cdef float64 _rate = rate
         try:
             for ch in channels:
-                namebuf = array.array('b', ch.name.encode('utf8')+b'\0')
+                namebuf = array.array('b', ch.encode('utf8')+b'\0')
                 printf("init: AI: %s...", namebuf.data.as_chars)
                 _check_error(DAQmxCreateAIVoltageChan(self._handle,
                                 namebuf.data.as_chars,
@@ -198,96 +591,410 @@ cdef class OscilloTask:
                 printf("done.\n")
             printf("init: rate: %d...", _rate)
             _check_error(DAQmxCfgSampClkTiming(self._handle,
-                            "",
+                            sourcebuf.data.as_chars,
                             _rate,
                             DAQmx_Val_Rising,
                             DAQmx_Val_ContSamps,
-                            self._interval))
+                            self._ring.interval))
             printf("done.\n")
-            printf("init: interval: %d...", self._interval)
+            if len(trigger) > 0:
+                _check_error(DAQmxCfgDigEdgeStartTrig(self._handle, triggerbuf.data.as_chars, DAQmx_Val_Rising))
+            printf("init: interval: %d...", self._ring.interval)
             _check_error(DAQmxRegisterEveryNSamplesEvent(self._handle,
                             DAQmx_Val_Acquired_Into_Buffer,
-                            self._interval,
+                            self._ring.interval,
                             0,
-                            OscilloTask.update,
-                            <void *>self))
+                            _read_chunk,
+                            <void *>&(self._ring)))
             printf("done.\n")
+            if len(ports) > 0:
+                _check_error(DAQmxCreateTask(self.diname.data.as_chars, &(self._ring.dihandle)))
+                for port in ports:
+                    namebuf = array.array('b', port.encode('utf8')+b'\0')
+                    printf("init: DI: %s...", namebuf.data.as_chars)
+                    _check_error(DAQmxCreateDIChan(self._ring.dihandle,
+                                    namebuf.data.as_chars,
+                                    "",
+                                    DAQmx_Val_ChanForAllLines))
+                    printf("done.\n")
+                _check_error(DAQmxCfgSampClkTiming(self._ring.dihandle,
+                                clockbuf.data.as_chars,
+                                _rate,
+                                DAQmx_Val_Rising,
+                                DAQmx_Val_ContSamps,
+                                self._ring.interval))
         except NIDAQmxError as e:
             self.close()
             raise e
         printf("init: done.\n")
 
-    def start(self):
+    def start(self, onstart=None):
+        """runs the delivery loop until the task stops. `onstart` is called
+        once the task has started (or is waiting for its start trigger)."""
+        cdef int    term = 0
+        cdef size_t rows
+        self._ring.head      = 0
+        self._ring.tail      = 0
+        self._ring.stalls    = 0
+        self._ring.ready     = 0
+        self._ring.term      = 0
+        self._ring.error     = 0
+        self._ring.unwritten = 0
+        self._ring.lastflush = corelib.clock_msec()
         try:
-            self._term      = 0
-            corelib.errorcheck(corelib.mutex_lock(&(self._io)))
             printf("starting...\n")
+            if self._ring.dihandle is not NULL:
+                # waits for the AI sample clock
+                _check_error(DAQmxStartTask(self._ring.dihandle))
             _check_error(DAQmxStartTask(self._handle))
             printf("started.\n")
-            with nogil:
-                while self._term == 0:
-                    corelib.cond_wait(&(self._update), &(self._io), -1)
-                    # printf("update: %d\n", self._read)
-                    with gil:
-                        self.fire_update()
-                corelib.mutex_unlock(&(self._io))
+            if onstart is not None:
+                onstart()
+            while term == 0:
+                with nogil:
+                    rows = self._wait_batch(&term)
+                if rows > 0:
+                    self.fire_update(rows)
+            if self._ring.stalls > 0:
+                print("***OscilloTask: the acquisition waited {0} times for the delivery to keep up".format(self._ring.stalls))
+            if self._ring.unwritten > 0:
+                print("***OscilloTask: the writer refused {0} chunks".format(self._ring.unwritten))
+            _check_error(self._ring.error)
         except NIDAQmxError as e:
             self.close()
             raise e
 
-    def stop(self):
-        DAQmxStopTask(self._handle)
+    def get_batch(self):
+        return self._ring.batch
+
+    def set_batch(self, batch, budget):
+        """changes the delivery batch (up to half of the ring) and the time budget,
+        from the next chunk on. returns the batch in effect."""
+        cdef uInt32 nchunks = <uInt32>min(max(batch, 1), self._ring.nslots // 2)
+        cdef double msec    = budget
+        with nogil:
+            corelib.mutex_lock(&(self._ring.io))
+            self._ring.batch  = nchunks
+            self._ring.budget = msec
+            corelib.mutex_unlock(&(self._ring.io))
+        return nchunks
+
+    cdef size_t _wait_batch(self, int *term) nogil:
+        """waits for the next batch, and copies it into the staging buffer.
+        returns the number of scans staged, and sets `term` when the task is terminating."""
+        cdef uInt64 first, count, i
+        cdef size_t rows = 0
+        cdef size_t slot, nvalues
+        corelib.mutex_lock(&(self._ring.io))
+        while (self._ring.ready == 0) and (self._ring.term == 0):
+            corelib.cond_wait(&(self._ring.update), &(self._ring.io), -1)
+        first           = self._ring.tail
+        count           = self._ring.head - self._ring.tail
+        if count > 0:
+            self._arrival = self._ring.arrivals[first % self._ring.nslots]
+        term[0]         = self._ring.term
+        self._ring.ready = 0
+        corelib.mutex_unlock(&(self._ring.io))
+
+        for i in range(first, first + count):
+            slot    = <size_t>(i % self._ring.nslots)
+            nvalues = (<size_t>self._ring.counts[slot]) * self._nchan
+            memcpy(self._staging + rows * self._nchan,
+                   self._ring.data + slot * self._ring.chunksiz,
+                   nvalues * sizeof(double))
+            if self._ring.nports > 0:
+                memcpy(self._dstaging + rows * self._ring.nports,
+                       self._ring.digital + slot * self._ring.digisiz,
+                       (<size_t>self._ring.counts[slot]) * self._ring.nports)
+            rows += self._ring.counts[slot]
+
+        corelib.mutex_lock(&(self._ring.io))
+        self._ring.tail     += count
+        self._ring.lastflush = corelib.clock_msec()
+        if count > 0:
+            corelib.cond_notify_all(&(self._ring.space))
+        corelib.mutex_unlock(&(self._ring.io))
+        return rows
+
+    def attach_writer(self, nativeio.NativeWriter writer):
+        """makes the DAQmx callback hand every chunk to `writer` (unscaled), without the GIL."""
+        if writer.nchan != self._nchan:
+            raise ValueError(f"the writer expects {writer.nchan} channels, but the task has {self._nchan}")
+        with nogil:
+            corelib.mutex_lock(&(self._ring.wio))
+            self._ring.writer = &(writer._writer)
+            corelib.mutex_unlock(&(self._ring.wio))
+        self._writer = writer
+
+    def detach_writer(self):
+        """after this returns, the DAQmx callback never touches the writer."""
+        with nogil:
+            corelib.mutex_lock(&(self._ring.wio))
+            self._ring.writer = NULL
+            corelib.mutex_unlock(&(self._ring.wio))
+        self._writer = None
+
+    def attach_hook(self, hook):
+        """a native hook (`hook.native`) is called from the DAQmx callback, without the GIL.
+        otherwise, `hook` is invoked from fire_update()."""
+        cdef chunkhook func = NULL
+        cdef void *ctx = NULL
+        cdef double budget = hook.budget
+        cdef uInt32 maxoverruns = hook.maxoverruns
+        cdef int i
+        self.detach_hook()
+        if hook.native is not None:
+            func = <chunkhook>PyCapsule_GetPointer(hook.native, hooks.NATIVE_CAPSULE_NAME.encode('ascii'))
+            ctx  = PyCapsule_GetContext(hook.native)
+        with nogil:
+            corelib.mutex_lock(&(self._ring.hio))
+            for i in range(HOOK_BINS):
+                self._ring.hookcounts[i] = 0
+            self._ring.hookoverruns    = 0
+            self._ring.hookstreak      = 0
+            self._ring.hookstatus      = 0
+            self._ring.hookbudget      = budget
+            self._ring.hookmaxoverruns = maxoverruns
+            self._ring.hookctx         = ctx
+            self._ring.hook            = func
+            corelib.mutex_unlock(&(self._ring.hio))
+        self._hook = hook
+
+    def detach_hook(self):
+        """after this returns, the DAQmx callback never calls the native hook.
+        its statistics are added to the hook."""
+        cdef int status
+        if self._hook is None:
+            return
+        hook, self._hook = self._hook, None
+        with nogil:
+            corelib.mutex_lock(&(self._ring.hio))
+            self._ring.hook = NULL
+            status          = self._ring.hookstatus
+            corelib.mutex_unlock(&(self._ring.hio))
+        if hook.native is None:
+            return
+        hook.histogram.merge([self._ring.hookcounts[i] for i in range(HOOK_BINS)])
+        hook.overruns += self._ring.hookoverruns
+        if status != 0:
+            hook.disabled = True
+            if status == 1:
+                print(f"***Hook '{hook.name}': disabled after exceeding the budget ({hook.budget} ms) {hook.maxoverruns} times in a row")
+            else:
+                print(f"***Hook '{hook.name}': disabled after returning {status}")
+
+    def commit(self):
+        """programs the hardware in advance, so that start() only needs to start the clock.
+        a stopped task returns to this state, and can be started again."""
+        _check_error(DAQmxTaskControl(self._handle, DAQmx_Val_Task_Commit))
+        if self._ring.dihandle is not NULL:
+            _check_error(DAQmxTaskControl(self._ring.dihandle, DAQmx_Val_Task_Commit))
+
+    def stop(self, clear=True):
+        """stops the task. unless `clear` is False, the task is also destroyed."""
+        cdef int32 status
+        # without the GIL: the callback may be waiting for the delivery loop to free a slot
+        with nogil:
+            DAQmxStopTask(self._handle)
+            if self._ring.dihandle is not NULL:
+                DAQmxStopTask(self._ring.dihandle)
+            status = DAQmxWaitUntilTaskDone(self._handle, DEFAULT_TIMEOUT_SEC)
         try:
-            _check_error(DAQmxWaitUntilTaskDone(self._handle, DEFAULT_TIMEOUT_SEC))
-            with nogil:
-                corelib.mutex_lock(&(self._io))
-                self._term = 1
-                corelib.cond_notify_all(&(self._update))
-                corelib.mutex_unlock(&(self._io))
+            _check_error(status)
         except NIDAQmxError as e:
             raise e
         finally:
+            # the delivery loop flushes whatever remains in the ring before returning
+            with nogil:
+                corelib.mutex_lock(&(self._ring.io))
+                self._ring.term = 1
+                corelib.cond_notify_all(&(self._ring.update))
+                corelib.cond_notify_all(&(self._ring.space))
+                corelib.mutex_unlock(&(self._ring.io))
             printf("stop\n")
+            if clear == True:
+                self.close()
+
+    def fire_update(self, rows):
+        # the staging buffer is reused for the next batch; consumers receive a copy.
+        chunk = self._array[:rows].copy()
+        delay = corelib.clock_msec() - self._arrival
+        # (in the clock of BaseDeviceDriver, e.g. for mosca.composite)
+        self._parent._arrival = time.perf_counter()*1000 - delay
+        if (self._hook is not None) and (self._hook.native is None):
+            self._hook.invoke(chunk, delay)
+        self._parent.dataAvailable.emit(chunk)
+        if self._ring.nports > 0:
+            self._parent.digitalAvailable.emit(self._digital[:rows].copy())
+
+    def close(self):
+        self.detach_writer()
+        self.detach_hook()
+        if self._handle is not NULL:
+            DAQmxStopTask(self._handle)
+            DAQmxClearTask(self._handle)
+            self._handle = NULL
+            self._ring.handle = NULL
+            printf("task handle destroyed.\n")
+        if self._ring.dihandle is not NULL:
+            DAQmxStopTask(self._ring.dihandle)
+            DAQmxClearTask(self._ring.dihandle)
+            self._ring.dihandle = NULL
+
+
+ctypedef struct outring:
+    # the stimulus being played by an OutputTask. only the DAQmx callback
+    # touches it while the task is running.
+    TaskHandle      handle
+    double         *period      # length x nchan
+    uInt64          length
+    uInt64          position    # total number of scans written to the device
+    int             repeat
+    double         *block       # interval x nchan
+    uInt32          interval
+    uInt32          nchan
+    int32           error
+
+
+cdef void _fill_block(outring *out) nogil:
+    """copies the next `interval` scans of the period into the block,
+    wrapping around (or holding the last scan if the stimulus is not repeated)."""
+    cdef size_t rowsiz = out.nchan * sizeof(double)
+    cdef uInt64 done = 0
+    cdef uInt64 pos, n
+    while done < out.interval:
+        n = out.interval - done
+        if out.repeat != 0:
+            pos = out.position % out.length
+        else:
+            pos = out.position if out.position < out.length else out.length - 1
+        if (out.repeat != 0) or (out.position < out.length):
+            if n > out.length - pos:
+                n = out.length - pos
+            memcpy(out.block + done * out.nchan, out.period + pos * out.nchan, n * rowsiz)
+        else:
+            n = 1
+            memcpy(out.block + done * out.nchan, out.period + pos * out.nchan, rowsiz)
+        out.position += n
+        done         += n
+
+
+cdef int32 _write_block(TaskHandle handle, int32 evttype, uInt32 nsamp, void *wrapper) nogil:
+    """registered and called as EveryNSamplesEvent (Transferred_From_Buffer) from NIDAQmx.
+    'wrapper' should be the pointer to the outring of an OutputTask.
+
+    refills the block that has just been transferred to the device (not a Python thread)."""
+    cdef outring *out = <outring *>wrapper
+    cdef int32 written = 0
+    cdef int32 status
+    if out.error < 0:
+        return 0
+    _fill_block(out)
+    status = DAQmxWriteAnalogF64(out.handle, out.interval, 0, DEFAULT_TIMEOUT_SEC,
+                                    DAQmx_Val_GroupByScanNumber, out.block, &written, NULL)
+    if status < 0:
+        out.error = status
+    return 0
+
+
+cdef class OutputTask:
+    """an AO task that plays the (length x nchan) `period` of a stimulus,
+    clocked by the sample clock `clock` of the AI task (e.g. '/Dev1/ai/SampleClock').
+
+    the output buffer holds OUTPUT_BLOCKS blocks of `interval` scans without regeneration:
+    every time a block has been transferred to the device, the DAQmx callback writes
+    the next one from the period (without the GIL). start() must be called before
+    the AI task starts, so that both begin with the same sample."""
+
+    cdef outring      _out
+    cdef TaskHandle   _handle
+    cdef carray.array name
+    cdef cnumpy.ndarray _period # keeps the period alive
+
+    def __cinit__(self, name, channels, clock, rate, interval, period, repeat=True):
+        self.name           = array.array('b', name.encode('utf8')+b'\0')
+        self._handle        = NULL
+        self._period        = np.ascontiguousarray(period, dtype=np.float64)
+        if (self._period.ndim != 2) or (self._period.shape[0] == 0) or (self._period.shape[1] != len(channels)):
+            raise ValueError("the period must be a non-empty (samples x {0}) array".format(len(channels)))
+        cdef double[:,:] proxy = self._period
+        self._out.period    = &(proxy[0,0])
+        self._out.length    = self._period.shape[0]
+        self._out.nchan     = len(channels)
+        self._out.interval  = interval
+        self._out.repeat    = 1 if repeat else 0
+        self._out.position  = 0
+        self._out.error     = 0
+        self._out.block     = <double *>malloc(self._out.interval * self._out.nchan * sizeof(double))
+        if self._out.block is NULL:
+            raise MemoryError("failed to allocate the output block")
+        _check_error(DAQmxCreateTask(self.name.data.as_chars, &self._handle))
+        self._out.handle    = self._handle
+
+    def __dealloc__(self):
+        self.close()
+        free(self._out.block)
+
+    def __init__(self, name, channels, clock, rate, interval, period, repeat=True):
+        cdef carray.array namebuf
+        cdef carray.array clockbuf = array.array('b', clock.encode('utf8')+b'\0')
+        cdef float64 _rate = rate
+        cdef int i
+        try:
+            for ch in channels:
+                namebuf = array.array('b', ch.encode('utf8')+b'\0')
+                printf("init: AO: %s...", namebuf.data.as_chars)
+                _check_error(DAQmxCreateAOVoltageChan(self._handle,
+                                namebuf.data.as_chars,
+                                "",
+                                -10.0,
+                                10.0,
+                                DAQmx_Val_Volts,
+                                NULL))
+                printf("done.\n")
+            _check_error(DAQmxCfgSampClkTiming(self._handle,
+                            clockbuf.data.as_chars,
+                            _rate,
+                            DAQmx_Val_Rising,
+                            DAQmx_Val_ContSamps,
+                            self._out.interval))
+            _check_error(DAQmxSetWriteRegenMode(self._handle, DAQmx_Val_DoNotAllowRegen))
+            _check_error(DAQmxCfgOutputBuffer(self._handle, OUTPUT_BLOCKS * self._out.interval))
+            _check_error(DAQmxRegisterEveryNSamplesEvent(self._handle,
+                            DAQmx_Val_Transferred_From_Buffer,
+                            self._out.interval,
+                            0,
+                            _write_block,
+                            <void *>&(self._out)))
+            # fills the buffer before the start
+            for i in range(OUTPUT_BLOCKS):
+                _write_block(self._handle, DAQmx_Val_Transferred_From_Buffer, self._out.interval, <void *>&(self._out))
+            _check_error(self._out.error)
+        except NIDAQmxError as e:
             self.close()
+            raise e
 
-    @staticmethod
-    cdef int32 update(TaskHandle handle, int32 evttype, uInt32 nsamp, void *wrapper):
-        """registered and called as EveryNSamplesEvent from NIDAQmx.
-        'wrapper' should be the pointer to an OscilloTask object for the task.
+    def __getattr__(self, name):
+        if name == 'written':
+            return self._out.position
+        else:
+            raise AttributeError(name)
 
-        Note that the caller thread is _not_ a Python thread, and thus Python can crush
-        miserably when you try to call a Python method/function directly from this function.
-        Use another thread to wait for the buffer to be filled in."""
-        cdef OscilloTask obj
-        cdef int32 status
-        obj = <OscilloTask>wrapper
-        corelib.mutex_lock(&(obj._io))
-        status = DAQmxReadAnalogF64(
-                        obj._handle,
-                        obj._interval,
-                        DEFAULT_TIMEOUT_SEC,
-                        DAQmx_Val_GroupByScanNumber,
-                        obj._buf,
-                        obj._chunksiz,
-                        &(obj._read),
-                        NULL
-                    )
-        if status < 0:
-            obj._read = 0
-            obj._term = 1
-            obj.close()
-            printf("abort\n")
-
-        corelib.cond_notify_all(&(obj._update))
-        corelib.mutex_unlock(&(obj._io))
-        return 0
+    def start(self):
+        _check_error(DAQmxStartTask(self._handle))
 
-    def fire_update(self):
-        self._parent.dataAvailable.emit(self._array[:(self._read)])
+    def stop(self):
+        """stops and destroys the task. the errors during the generation are reported here."""
+        error = self._out.error
+        self.close()
+        print("OutputTask: wrote {0} scans".format(self._out.position))
+        if error < 0:
+            DAQmxGetExtendedErrorInfo(errbuf, bufsiz)
+            print("***OutputTask: the generation failed: {0}".format((<bytes>errbuf).decode('ascii')))
 
     def close(self):
         if self._handle is not NULL:
             DAQmxStopTask(self._handle)
             DAQmxClearTask(self._handle)
             self._handle = NULL
-            printf("task handle destroyed.\n")
+            self._out.handle = NULL
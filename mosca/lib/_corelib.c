@@ -2,6 +2,7 @@
 #include <stdio.h>
 #include <string.h>
 #include <errno.h>
+#include <time.h>
 
 #define get_opaque(ptr) (&((ptr)->_opaque))
 #define MILLION 1000000
@@ -13,12 +14,7 @@ int coremutex_init      (coremutex *mutex)
     InitializeCriticalSectionAndSpinCount(get_opaque(mutex), 0x400); // try setting spin count this way for now
     return 0;
 #else
-    if( pthread_mutex_init(get_opaque(mutex), 0) ) // try setting mutexatttr this way for now
-    {
-        return errno;
-    } else {
-        return 0;
-    }
+    return pthread_mutex_init(get_opaque(mutex), 0); // try setting mutexatttr this way for now
 #endif
 }
 
@@ -28,12 +24,7 @@ int coremutex_lock      (coremutex *mutex)
     EnterCriticalSection(get_opaque(mutex));
     return 0;
 #else
-    if( pthread_mutex_lock(get_opaque(mutex)) )
-    {
-        return errno;
-    } else {
-        return 0;
-    }
+    return pthread_mutex_lock(get_opaque(mutex));
 #endif
 }
 
@@ -42,19 +33,8 @@ int coremutex_trylock   (coremutex *mutex)
 #ifdef _WIN32
     return (TryEnterCriticalSection(get_opaque(mutex)) != 0)? 0 : 0xA7; // returns LOCK_FAILED
 #else
-    switch( pthread_mutex_trylock(get_opaque(mutex)) )
-    {
-    case 0:
-        // successful
-        return 0;
-    case EBUSY:
-        // already locked by another thread
-        return EBUSY;
-    case EINVAL:
-    default:
-        // invalid mutex
-        return errno;
-    }
+    // 0 if successful, EBUSY if already locked by another thread, EINVAL for an invalid mutex
+    return pthread_mutex_trylock(get_opaque(mutex));
 #endif
 }
 
@@ -64,12 +44,7 @@ int coremutex_unlock    (coremutex *mutex)
     LeaveCriticalSection(get_opaque(mutex));
     return 0;
 #else
-    if( pthread_mutex_unlock(get_opaque(mutex)) )
-    {
-        return errno;
-    } else {
-        return 0;
-    }
+    return pthread_mutex_unlock(get_opaque(mutex));
 #endif
 }
 
@@ -79,12 +54,7 @@ int coremutex_free      (coremutex *mutex)
     DeleteCriticalSection(get_opaque(mutex));
     return 0;
 #else
-    if( pthread_mutex_destroy(get_opaque(mutex)) )
-    {
-        return errno;
-    } else {
-        return 0;
-    }
+    return pthread_mutex_destroy(get_opaque(mutex));
 #endif
 }
 
@@ -93,13 +63,22 @@ int corecond_init       (corecond *cond)
 #ifdef _WIN32
     InitializeConditionVariable(get_opaque(cond));
     return 0;
+#elif defined(__APPLE__)
+    // no pthread_condattr_setclock(): corecond_wait() uses a relative timeout instead
+    return pthread_cond_init(get_opaque(cond), 0);
 #else
-    if( pthread_cond_init(get_opaque(cond), 0) )
-    {
-        return errno;
-    } else {
-        return 0;
+    pthread_condattr_t attr;
+    int err;
+    if( (err = pthread_condattr_init(&attr)) != 0 ){
+        return err;
     }
+    // timed waits are measured with the monotonic clock,
+    // so that they are not affected by changes of the system time
+    if( (err = pthread_condattr_setclock(&attr, CLOCK_MONOTONIC)) == 0 ){
+        err = pthread_cond_init(get_opaque(cond), &attr);
+    }
+    pthread_condattr_destroy(&attr);
+    return err;
 #endif
 }
 
@@ -108,25 +87,32 @@ int corecond_wait       (corecond *cond, coremutex *mutex, long timeout_msec)
 #ifdef _WIN32
     if (SleepConditionVariableCS(get_opaque(cond), get_opaque(mutex), (timeout_msec>=0)? timeout_msec: INFINITE) == 0)
     {
+        // ERROR_TIMEOUT (i.e. CORE_ETIMEDOUT) on timeout
         return GetLastError();
     } else {
         return 0;
     }
 #else
-    int err;
+    struct timespec timeout;
     if( timeout_msec < 0 ){
-        err = pthread_cond_wait(get_opaque(cond), get_opaque(mutex));
-    } else {
-        struct timespec timeout;
-        timeout.tv_nsec = (timeout_msec * MILLION) % BILLION;
-        timeout.tv_sec = time(0) + ( timeout_msec - timeout.tv_nsec );
-        err = pthread_cond_timedwait(get_opaque(cond), get_opaque(mutex), &timeout);
+        return pthread_cond_wait(get_opaque(cond), get_opaque(mutex));
     }
-    if( err ){
-        return errno;
-    } else {
-        return 0;
+#if defined(__APPLE__)
+    timeout.tv_sec  = timeout_msec / 1000;
+    timeout.tv_nsec = (timeout_msec % 1000) * MILLION;
+    return pthread_cond_timedwait_relative_np(get_opaque(cond), get_opaque(mutex), &timeout);
+#else
+    // the absolute deadline on the clock set in corecond_init()
+    clock_gettime(CLOCK_MONOTONIC, &timeout);
+    timeout.tv_sec  += timeout_msec / 1000;
+    timeout.tv_nsec += (timeout_msec % 1000) * MILLION;
+    if( timeout.tv_nsec >= BILLION ){
+        timeout.tv_sec  += 1;
+        timeout.tv_nsec -= BILLION;
     }
+    // 0 when notified (or woken spuriously), ETIMEDOUT on timeout
+    return pthread_cond_timedwait(get_opaque(cond), get_opaque(mutex), &timeout);
+#endif
 #endif
 }
 
@@ -136,12 +122,7 @@ int corecond_notify     (corecond *cond)
     WakeConditionVariable(get_opaque(cond));
     return 0;
 #else
-    if( pthread_cond_signal(get_opaque(cond)) )
-    {
-        return errno;
-    } else {
-        return 0;
-    }
+    return pthread_cond_signal(get_opaque(cond));
 #endif
 }
 
@@ -151,12 +132,7 @@ int corecond_notify_all (corecond *cond)
     WakeAllConditionVariable(get_opaque(cond));
     return 0;
 #else
-    if( pthread_cond_broadcast(get_opaque(cond)) )
-    {
-        return errno;
-    } else {
-        return 0;
-    }
+    return pthread_cond_broadcast(get_opaque(cond));
 #endif
 }
 
@@ -166,12 +142,62 @@ int corecond_free       (corecond *cond)
     // seems to need nothing for condition variable
     return 0;
 #else
-    if( pthread_cond_destroy(get_opaque(cond)) )
-    {
-        return errno;
-    } else {
-        return 0;
+    return pthread_cond_destroy(get_opaque(cond));
+#endif
+}
+
+#ifdef _WIN32
+static DWORD WINAPI corethread_main(LPVOID arg)
+{
+    corethread *thread = (corethread *)arg;
+    thread->_func(thread->_arg);
+    return 0;
+}
+#else
+static void *corethread_main(void *arg)
+{
+    corethread *thread = (corethread *)arg;
+    thread->_func(thread->_arg);
+    return NULL;
+}
+#endif
+
+int corethread_start    (corethread *thread, corethread_func func, void *arg)
+{
+    thread->_func = func;
+    thread->_arg  = arg;
+#ifdef _WIN32
+    thread->_opaque = CreateThread(NULL, 0, corethread_main, thread, 0, NULL);
+    return (thread->_opaque == NULL)? GetLastError() : 0;
+#else
+    return pthread_create(get_opaque(thread), NULL, corethread_main, thread);
+#endif
+}
+
+int corethread_join     (corethread *thread)
+{
+#ifdef _WIN32
+    if( WaitForSingleObject(thread->_opaque, INFINITE) == WAIT_FAILED ){
+        return GetLastError();
     }
+    CloseHandle(thread->_opaque);
+    return 0;
+#else
+    return pthread_join(thread->_opaque, NULL);
+#endif
+}
+
+double coreclock_msec   (void)
+{
+#ifdef _WIN32
+    LARGE_INTEGER freq, count;
+    QueryPerformanceFrequency(&freq);
+    QueryPerformanceCounter(&count);
+    return ((double)(count.QuadPart)) * 1000.0 / ((double)(freq.QuadPart));
+#else
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return ((double)(now.tv_sec)) * 1000.0 + ((double)(now.tv_nsec)) / MILLION;
 #endif
 }
 
@@ -1,3 +1,6 @@
+#ifndef __MOSCA_CORELIB_H__
+#define __MOSCA_CORELIB_H__
+
 #include <stddef.h>
 
 #ifdef _WIN32
@@ -5,12 +8,24 @@
 
 typedef CRITICAL_SECTION    _opaquemutex_t;
 typedef CONDITION_VARIABLE  _opaquecond_t;
+typedef HANDLE              _opaquethread_t;
 
 #else
 #include <pthread.h>
 
 typedef pthread_mutex_t     _opaquemutex_t;
 typedef pthread_cond_t      _opaquecond_t;
+typedef pthread_t           _opaquethread_t;
+#endif
+
+/**
+*   the code returned by corecond_wait() when the timeout has expired.
+*/
+#ifdef _WIN32
+#define CORE_ETIMEDOUT  ERROR_TIMEOUT
+#else
+#include <errno.h>
+#define CORE_ETIMEDOUT  ETIMEDOUT
 #endif
 
 typedef struct _coremutex {
@@ -21,6 +36,14 @@ typedef struct _corecond {
     _opaquecond_t   _opaque;
 } corecond;
 
+typedef void (*corethread_func)(void *arg);
+
+typedef struct _corethread {
+    _opaquethread_t _opaque;
+    corethread_func _func;
+    void           *_arg;
+} corethread;
+
 /**
 *   the below function returns zero if no error.
 */
@@ -40,10 +63,31 @@ int coremutex_trylock   (coremutex *mutex);
 int coremutex_unlock    (coremutex *mutex);
 int coremutex_free      (coremutex *mutex);
 
+/**
+*   corecond_wait() waits for at most `timeout_msec` (measured with a monotonic clock),
+*   or indefinitely if `timeout_msec` is negative.
+*   it returns 0 when woken up (note that the wake-up may be spurious),
+*   and CORE_ETIMEDOUT when the timeout has expired.
+*/
 int corecond_init       (corecond *cond);
 int corecond_wait       (corecond *cond, coremutex *mutex, long timeout_msec);
 int corecond_notify     (corecond *cond);
 int corecond_notify_all (corecond *cond);
 int corecond_free       (corecond *cond);
 
+/**
+*   corethread_start() runs `func(arg)` on a new native thread.
+*   the corethread object must stay valid until corethread_join() returns.
+*/
+int corethread_start    (corethread *thread, corethread_func func, void *arg);
+int corethread_join     (corethread *thread);
+
+/**
+*   returns the time in milliseconds from an arbitrary (but fixed) point,
+*   measured with a monotonic clock.
+*/
+double coreclock_msec   (void);
+
 size_t get_error        (int code, char *buf, size_t buflen);
+
+#endif
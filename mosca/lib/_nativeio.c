@@ -0,0 +1,184 @@
+#include "_nativeio.h"
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+
+static void nativewriter_main(void *arg)
+{
+    nativewriter *writer = (nativewriter *)arg;
+    size_t slot, rows, done, i, ch;
+    double *src;
+
+    while( 1 ){
+        coremutex_lock(&(writer->lock));
+        while( (writer->head == writer->tail) && (writer->term == 0) ){
+            corecond_wait(&(writer->hasdata), &(writer->lock), -1);
+        }
+        if( writer->head == writer->tail ){
+            // terminated, and everything has been written
+            coremutex_unlock(&(writer->lock));
+            break;
+        }
+        slot = (size_t)(writer->tail % writer->nslots);
+        coremutex_unlock(&(writer->lock));
+
+        // the slot at `tail` is not touched by the producer until `tail` is incremented
+        rows = writer->rows[slot];
+        src  = writer->slots + slot * writer->slotrows * writer->nchan;
+        for( i = 0; i < rows; i++ ){
+            for( ch = 0; ch < writer->nchan; ch++ ){
+                writer->scratch[i * writer->nchan + ch] = src[i * writer->nchan + ch] * writer->scales[ch];
+            }
+        }
+        // after a failure, the slots are still consumed (but not written),
+        // so that the producer does not wait forever
+        done = 0;
+        if( writer->error == 0 ){
+            errno = 0;
+            done  = fwrite(writer->scratch, sizeof(double) * writer->nchan, rows, writer->file);
+            if( done != rows ){
+                writer->error = (errno != 0)? errno : EIO;
+            }
+        }
+
+        coremutex_lock(&(writer->lock));
+        writer->tail    += 1;
+        writer->written += done;
+        corecond_notify_all(&(writer->hasroom));
+        coremutex_unlock(&(writer->lock));
+    }
+}
+
+int nativewriter_open     (nativewriter *writer, const char *path, size_t nchan,
+                           const double *scales, size_t slotrows, size_t nslots)
+{
+    int err;
+    memset(writer, 0, sizeof(nativewriter));
+    writer->nchan    = nchan;
+    writer->slotrows = slotrows;
+    writer->nslots   = nslots;
+    writer->scales   = (double *)malloc(sizeof(double) * nchan);
+    writer->slots    = (double *)malloc(sizeof(double) * nslots * slotrows * nchan);
+    writer->rows     = (size_t *)malloc(sizeof(size_t) * nslots);
+    writer->scratch  = (double *)malloc(sizeof(double) * slotrows * nchan);
+    if( (writer->scales == NULL) || (writer->slots == NULL) ||
+        (writer->rows == NULL) || (writer->scratch == NULL) ){
+        err = ENOMEM;
+        goto failed;
+    }
+    memcpy(writer->scales, scales, sizeof(double) * nchan);
+
+    writer->file = fopen(path, "ab");
+    if( writer->file == NULL ){
+        err = errno;
+        goto failed;
+    }
+    if( (err = coremutex_init(&(writer->lock))) != 0 ){
+        goto failed;
+    }
+    corecond_init(&(writer->hasdata));
+    corecond_init(&(writer->hasroom));
+    if( (err = corethread_start(&(writer->thread), nativewriter_main, writer)) != 0 ){
+        corecond_free(&(writer->hasdata));
+        corecond_free(&(writer->hasroom));
+        coremutex_free(&(writer->lock));
+        goto failed;
+    }
+    writer->running = 1;
+    return 0;
+
+failed:
+    if( writer->file != NULL ){
+        fclose(writer->file);
+        writer->file = NULL;
+    }
+    free(writer->scales);
+    free(writer->slots);
+    free(writer->rows);
+    free(writer->scratch);
+    writer->scales = writer->slots = writer->scratch = NULL;
+    writer->rows   = NULL;
+    return err;
+}
+
+int nativewriter_push     (nativewriter *writer, const double *data, size_t rows)
+{
+    size_t   slot, count;
+    uint64_t head;
+
+    if( writer->running == 0 ){
+        return EBADF;
+    }
+    while( rows > 0 ){
+        count = (rows < writer->slotrows)? rows : writer->slotrows;
+
+        coremutex_lock(&(writer->lock));
+        if( (writer->head - writer->tail) >= writer->nslots ){
+            writer->stalls += 1;
+            while( ((writer->head - writer->tail) >= writer->nslots) && (writer->term == 0) ){
+                corecond_wait(&(writer->hasroom), &(writer->lock), -1);
+            }
+        }
+        if( writer->term != 0 ){
+            coremutex_unlock(&(writer->lock));
+            return EPIPE;
+        }
+        head = writer->head;
+        coremutex_unlock(&(writer->lock));
+
+        // only the producer touches the slot at `head` until `head` is incremented
+        slot = (size_t)(head % writer->nslots);
+        memcpy(writer->slots + slot * writer->slotrows * writer->nchan, data,
+               sizeof(double) * count * writer->nchan);
+        writer->rows[slot] = count;
+
+        coremutex_lock(&(writer->lock));
+        writer->head += 1;
+        corecond_notify_all(&(writer->hasdata));
+        coremutex_unlock(&(writer->lock));
+
+        data += count * writer->nchan;
+        rows -= count;
+    }
+    return 0;
+}
+
+uint64_t nativewriter_written  (nativewriter *writer)
+{
+    uint64_t written;
+    if( writer->running == 0 ){
+        return writer->written;
+    }
+    coremutex_lock(&(writer->lock));
+    written = writer->written;
+    coremutex_unlock(&(writer->lock));
+    return written;
+}
+
+int nativewriter_close    (nativewriter *writer)
+{
+    if( writer->running == 0 ){
+        return writer->error;
+    }
+    coremutex_lock(&(writer->lock));
+    writer->term = 1;
+    corecond_notify_all(&(writer->hasdata));
+    coremutex_unlock(&(writer->lock));
+    corethread_join(&(writer->thread));
+    writer->running = 0;
+
+    if( (fclose(writer->file) != 0) && (writer->error == 0) ){
+        writer->error = errno;
+    }
+    writer->file = NULL;
+    corecond_free(&(writer->hasdata));
+    corecond_free(&(writer->hasroom));
+    coremutex_free(&(writer->lock));
+    free(writer->scales);
+    free(writer->slots);
+    free(writer->rows);
+    free(writer->scratch);
+    writer->scales = writer->slots = writer->scratch = NULL;
+    writer->rows   = NULL;
+    return writer->error;
+}
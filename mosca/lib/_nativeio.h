@@ -0,0 +1,56 @@
+#ifndef __MOSCA_NATIVEIO_H__
+#define __MOSCA_NATIVEIO_H__
+
+#include <stdio.h>
+#include <stdint.h>
+#include "_corelib.h"
+
+/**
+*   nativewriter -- scales multi-channel chunks and writes them to a file
+*   from its own native thread.
+*
+*   the producer (e.g. the DAQmx callback) only copies the chunk into one of
+*   `nslots` slots of `slotrows` rows. it waits for the writer thread (i.e. for
+*   the disk) when all the slots are occupied, and `stalls` counts these waits.
+*   `written` counts the rows that have actually been written to the file;
+*   after the first failed write, the rest is discarded and `error` is returned
+*   by nativewriter_close().
+*   none of the functions below touches Python objects.
+*/
+typedef struct _nativewriter {
+    FILE       *file;
+    size_t      nchan;
+    size_t      slotrows;
+    size_t      nslots;
+    double     *scales;     // nchan
+    double     *slots;      // nslots x slotrows x nchan
+    size_t     *rows;       // rows in each slot
+    double     *scratch;    // slotrows x nchan (used by the writer thread)
+    uint64_t    head;       // total number of slots filled
+    uint64_t    tail;       // total number of slots written
+    uint64_t    written;    // total number of rows successfully written to the file
+    uint64_t    stalls;     // number of times the producer had to wait for a free slot
+    int         term;
+    int         error;      // errno of the first failed write
+    int         running;
+    coremutex   lock;
+    corecond    hasdata;
+    corecond    hasroom;
+    corethread  thread;
+} nativewriter;
+
+/**
+*   opens `path` for appending, and starts the writer thread.
+*   returns 0 if successful, or an error code that can be passed to get_error().
+*/
+int      nativewriter_open     (nativewriter *writer, const char *path, size_t nchan,
+                                const double *scales, size_t slotrows, size_t nslots);
+int      nativewriter_push     (nativewriter *writer, const double *data, size_t rows);
+uint64_t nativewriter_written  (nativewriter *writer);
+/**
+*   writes out all the pushed chunks, stops the writer thread and closes the file.
+*   returns the error (if any) that occurred during writing.
+*/
+int      nativewriter_close    (nativewriter *writer);
+
+#endif
@@ -4,9 +4,11 @@
 you can have access to all the functions, plus:
 
 + you can refer to platformas as constants UNIX/WINDOWS.
-+ mutex/conditional type is renamed as mutex_t and cond_t, respectively.
++ mutex/conditional/thread type is renamed as mutex_t, cond_t and thread_t, respectively.
 + Mutex/Condition wrapper Python class is available.
++ Event (a flag with a monotonic-clock timed wait) is available.
 + errorcheck() Python function is available for raising RuntimeError's.
++ TIMEDOUT is the code returned from a timed wait that has expired.
 
 """
 
@@ -16,6 +18,9 @@ cdef extern from "_corelib.h":
         pass
     ctypedef struct cond_t "corecond":
         pass
+    ctypedef struct thread_t "corethread":
+        pass
+    ctypedef void (*thread_func "corethread_func")(void *arg) nogil
 
     int mutex_init      "coremutex_init"    (mutex_t *mutex) nogil
     int mutex_lock      "coremutex_lock"    (mutex_t *mutex) nogil
@@ -29,11 +34,18 @@ cdef extern from "_corelib.h":
     int cond_notify_all "corecond_notify_all" (cond_t *cond) nogil
     int cond_free       "corecond_free"     (cond_t *cond) nogil
 
+    int thread_start    "corethread_start"  (thread_t *thread, thread_func func, void *arg) nogil
+    int thread_join     "corethread_join"   (thread_t *thread) nogil
+
+    double clock_msec   "coreclock_msec"    () nogil
+
     int get_error    (int code, char *buf, int buflen) nogil
 
-cdef size_t BUFSIZ  = 2048
+    enum: TIMEDOUT "CORE_ETIMEDOUT"
 
-cpdef void errorcheck(int code)
+cdef size_t BUFSIZ # the size of the message buffer (initialized in corelib.pyx)
+
+cpdef void errorcheck(int code) except *
 
 cdef class Mutex:
     cdef mutex_t    _mutex
@@ -43,3 +55,12 @@ cdef class Mutex:
 cdef class Condition:
     cdef cond_t     _cond
     cdef int        _err
+
+
+cdef class Event:
+    cdef mutex_t        _mutex
+    cdef cond_t         _cond
+    cdef int            _flag
+    cdef readonly unsigned long wakeups
+    cdef readonly unsigned long spurious
+    cdef readonly unsigned long timeouts
@@ -1,13 +1,15 @@
 from libc.stdio cimport printf
+from libc.math cimport ceil
 from cpython cimport array as carray
 from corelib cimport *
 import array
 
 cdef carray.array chararray = array.array('b')
 
+BUFSIZ = 2048 # an initializer in corelib.pxd would be ignored
 cdef carray.array err = carray.clone(chararray, BUFSIZ, zero=False)
 
-cpdef void errorcheck(int code):
+cpdef void errorcheck(int code) except *:
     if code != 0:
         valid = get_error(code, err.data.as_chars, BUFSIZ)
         raise RuntimeError(err.tobytes()[:valid].decode('utf8'))
@@ -24,7 +26,10 @@ cdef class Mutex:
         mutex_free(&(self._mutex))
 
     def lock(self):
-        self._err = mutex_lock(&(self._mutex))
+        cdef int err
+        with nogil:
+            err = mutex_lock(&(self._mutex))
+        self._err = err
         return self._err
 
     def trylock(self):
@@ -47,7 +52,11 @@ cdef class Condition:
         cond_free(&(self._cond))
 
     def wait(self, Mutex mutex, long timeout_msec):
-        self._err = cond_wait(&(self._cond), &(mutex._mutex), timeout_msec)
+        """returns 0 when woken up, or TIMEDOUT. releases the GIL while waiting."""
+        cdef int err
+        with nogil:
+            err = cond_wait(&(self._cond), &(mutex._mutex), timeout_msec)
+        self._err = err
         return self._err
 
     def notify(self):
@@ -57,3 +66,80 @@ cdef class Condition:
     def notify_all(self):
         self._err = cond_notify_all(&(self._cond))
         return self._err
+
+cdef class Event:
+    """a flag that threads can wait for, similar to threading.Event.
+
+    the timeout of wait() is in milliseconds and is measured with a monotonic clock;
+    spurious wake-ups are absorbed (and counted) without extending the deadline.
+    the GIL is released while waiting."""
+    # cdef mutex_t        _mutex
+    # cdef cond_t         _cond
+    # cdef int            _flag
+
+    def __cinit__(self):
+        self._flag      = 0
+        self.wakeups    = 0
+        self.spurious   = 0
+        self.timeouts   = 0
+        errorcheck(mutex_init(&(self._mutex)))
+        errorcheck(cond_init(&(self._cond)))
+
+    def __dealloc__(self):
+        cond_free(&(self._cond))
+        mutex_free(&(self._mutex))
+
+    def set(self):
+        """sets the flag, and wakes up all the waiting threads."""
+        with nogil:
+            mutex_lock(&(self._mutex))
+            self._flag = 1
+            cond_notify_all(&(self._cond))
+            mutex_unlock(&(self._mutex))
+
+    def clear(self):
+        with nogil:
+            mutex_lock(&(self._mutex))
+            self._flag = 0
+            mutex_unlock(&(self._mutex))
+
+    def is_set(self):
+        return self._flag != 0
+
+    def wait(self, timeout_msec=None):
+        """waits until the flag is set, or for at most `timeout_msec` milliseconds.
+        returns True if the flag is set."""
+        cdef double deadline  = 0
+        cdef double remaining
+        cdef int    forever   = (timeout_msec is None) or (timeout_msec < 0)
+        cdef int    err       = 0
+        cdef int    flag
+        if not forever:
+            deadline = clock_msec() + <double>timeout_msec
+        with nogil:
+            mutex_lock(&(self._mutex))
+            while self._flag == 0:
+                if forever:
+                    err = cond_wait(&(self._cond), &(self._mutex), -1)
+                else:
+                    remaining = deadline - clock_msec()
+                    if remaining <= 0:
+                        err = TIMEDOUT
+                    else:
+                        # round up so that we do not wake up just before the deadline
+                        err = cond_wait(&(self._cond), &(self._mutex), <long>ceil(remaining))
+                if err == TIMEDOUT:
+                    if (forever == 0) and (clock_msec() >= deadline):
+                        self.timeouts += 1
+                        break
+                elif err != 0:
+                    break
+                elif self._flag == 0:
+                    self.spurious += 1
+                else:
+                    self.wakeups += 1
+            flag = self._flag
+            mutex_unlock(&(self._mutex))
+        if (err != 0) and (err != TIMEDOUT):
+            errorcheck(err)
+        return flag != 0
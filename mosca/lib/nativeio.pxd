@@ -0,0 +1,26 @@
+""" a thin wrapper for _nativeio.
+
++ NativeWriter scales and writes chunks to a file from its own native thread.
++ other extensions can cimport this module, and hand chunks to a NativeWriter
+  without the GIL by calling writer_push() on its `_writer` member.
+
+"""
+from libc.stdint cimport uint64_t
+
+cdef extern from "_nativeio.h":
+
+    ctypedef struct nativewriter:
+        uint64_t    stalls
+        int         error
+
+    int      writer_open    "nativewriter_open"     (nativewriter *writer, const char *path, size_t nchan,
+                                                     const double *scales, size_t slotrows, size_t nslots) nogil
+    int      writer_push    "nativewriter_push"     (nativewriter *writer, const double *data, size_t rows) nogil
+    uint64_t writer_written "nativewriter_written"  (nativewriter *writer) nogil
+    int      writer_close   "nativewriter_close"    (nativewriter *writer) nogil
+
+cdef class NativeWriter:
+    cdef nativewriter   _writer
+    cdef int            _open
+    cdef readonly object path
+    cdef readonly size_t nchan
@@ -0,0 +1,65 @@
+from nativeio cimport *
+cimport corelib
+import numpy as np
+
+DEFAULT_SLOT_ROWS   = 1000
+DEFAULT_SLOTS       = 64
+
+cdef class NativeWriter:
+    """appends scaled float64 rows to the file at `path` from a native thread.
+
+    the file is opened for appending, so that the caller can write a header in advance.
+    write() (or writer_push() from Cython) only copies the chunk into one of `nslots`
+    slots of `slotrows` rows; it waits for the disk only when all the slots are occupied.
+    `rows` counts the rows actually written, and close() raises the first I/O error.
+    """
+    # cdef nativewriter   _writer
+    # cdef int            _open
+
+    def __cinit__(self, path, scales, slotrows=DEFAULT_SLOT_ROWS, nslots=DEFAULT_SLOTS):
+        cdef double[::1] cscales = np.array(scales, dtype=np.float64).ravel()
+        cdef bytes cpath = path.encode('utf8')
+        self._open = 0
+        self.path  = path
+        self.nchan = cscales.shape[0]
+        corelib.errorcheck(writer_open(&(self._writer), cpath, self.nchan, &cscales[0],
+                                        max(<size_t>slotrows, 1), max(<size_t>nslots, 2)))
+        self._open = 1
+
+    def __dealloc__(self):
+        if self._open != 0:
+            writer_close(&(self._writer))
+
+    def write(self, data):
+        """hands a (rows x nchan) chunk to the writer thread."""
+        cdef const double[:, ::1] view = np.ascontiguousarray(data, dtype=np.float64)
+        cdef int ret
+        if self._open == 0:
+            raise ValueError("the writer has been closed")
+        if view.shape[1] != self.nchan:
+            raise ValueError(f"expected {self.nchan} channels, got {view.shape[1]}")
+        if view.shape[0] == 0:
+            return
+        with nogil:
+            ret = writer_push(&(self._writer), &view[0,0], view.shape[0])
+        corelib.errorcheck(ret)
+
+    def __getattr__(self, name):
+        if name == 'rows':
+            return writer_written(&(self._writer))
+        elif name == 'stalls':
+            return self._writer.stalls
+        elif name == 'closed':
+            return self._open == 0
+        else:
+            raise AttributeError(name)
+
+    def close(self):
+        """waits until all the rows are written, and closes the file."""
+        cdef int ret
+        if self._open == 0:
+            return
+        with nogil:
+            ret = writer_close(&(self._writer))
+        self._open = 0
+        corelib.errorcheck(ret)
@@ -0,0 +1,132 @@
+/**
+*   NIDAQmx.h -- a minimal stand-in for the NI-DAQmx C API.
+*
+*   it declares only the subset of the API that mosca.lib.NI uses,
+*   so that the driver can be built and exercised without NI hardware
+*   (see nidaqmx_stub.c, and build with MOSCA_NI_STUB=1).
+*/
+#ifndef __MOSCA_NIDAQMX_STUB_H__
+#define __MOSCA_NIDAQMX_STUB_H__
+
+#include <stdint.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+#define DAQmx_Val_Cfg_Default               (-1)
+
+#define DAQmx_Val_Volts                     10348
+
+#define DAQmx_Val_Rising                    10280
+#define DAQmx_Val_Falling                   10171
+
+#define DAQmx_Val_FiniteSamps               10178
+#define DAQmx_Val_ContSamps                 10123
+
+#define DAQmx_Val_GroupByChannel            0
+#define DAQmx_Val_GroupByScanNumber         1
+
+#define DAQmx_Val_Acquired_Into_Buffer      1
+#define DAQmx_Val_Transferred_From_Buffer   2
+
+#define DAQmx_Val_Task_Start                0
+#define DAQmx_Val_Task_Stop                 1
+#define DAQmx_Val_Task_Verify               2
+#define DAQmx_Val_Task_Commit               3
+#define DAQmx_Val_Task_Reserve              4
+#define DAQmx_Val_Task_Unreserve            5
+#define DAQmx_Val_Task_Abort                6
+
+#define DAQmx_Val_AllowRegen                10097
+#define DAQmx_Val_DoNotAllowRegen           10158
+
+#define DAQmx_Val_ChanPerLine               0
+#define DAQmx_Val_ChanForAllLines           1
+
+typedef void*       TaskHandle;
+typedef uint8_t     uInt8;
+typedef int32_t     int32;
+typedef uint32_t    uInt32;
+typedef uInt32      bool32;
+typedef uint64_t    uInt64;
+typedef double      float64;
+
+typedef int32 (*DAQmxEveryNSamplesEventCallbackPtr)(TaskHandle taskHandle,
+                        int32 everyNsamplesEventType,
+                        uInt32 nSamples,
+                        void *callbackData);
+
+int32 DAQmxCreateTask           (const char taskName[], TaskHandle *taskHandle);
+int32 DAQmxStartTask            (TaskHandle taskHandle);
+int32 DAQmxStopTask             (TaskHandle taskHandle);
+int32 DAQmxWaitUntilTaskDone    (TaskHandle taskHandle, float64 timeToWait);
+int32 DAQmxClearTask            (TaskHandle taskHandle);
+int32 DAQmxTaskControl          (TaskHandle taskHandle, int32 action);
+int32 DAQmxCreateAIVoltageChan  (TaskHandle taskHandle,
+                                 const char physicalChannel[],
+                                 const char nameToAssignToChannel[],
+                                 int32 terminalConfig,
+                                 float64 minVal,
+                                 float64 maxVal,
+                                 int32 units,
+                                 const char customScaleName[]);
+int32 DAQmxCreateAOVoltageChan  (TaskHandle taskHandle,
+                                 const char physicalChannel[],
+                                 const char nameToAssignToChannel[],
+                                 float64 minVal,
+                                 float64 maxVal,
+                                 int32 units,
+                                 const char customScaleName[]);
+int32 DAQmxCreateDIChan         (TaskHandle taskHandle,
+                                 const char lines[],
+                                 const char nameToAssignToLines[],
+                                 int32 lineGrouping);
+int32 DAQmxCfgSampClkTiming     (TaskHandle taskHandle,
+                                 const char source[],
+                                 float64 rate,
+                                 int32 activeEdge,
+                                 int32 sampleMode,
+                                 uInt64 sampsPerChan);
+int32 DAQmxCfgDigEdgeStartTrig  (TaskHandle taskHandle,
+                                 const char triggerSource[],
+                                 int32 triggerEdge);
+int32 DAQmxRegisterEveryNSamplesEvent(TaskHandle task,
+                                 int32 everyNsamplesEventType,
+                                 uInt32 nSamples,
+                                 uInt32 options,
+                                 DAQmxEveryNSamplesEventCallbackPtr callbackFunction,
+                                 void *callbackData);
+int32 DAQmxReadAnalogF64        (TaskHandle taskHandle,
+                                 int32 numSampsPerChan,
+                                 float64 timeout,
+                                 bool32 fillMode,
+                                 float64 readArray[],
+                                 uInt32 arraySizeInSamps,
+                                 int32 *sampsPerChanRead,
+                                 bool32 *reserved);
+int32 DAQmxReadDigitalU8        (TaskHandle taskHandle,
+                                 int32 numSampsPerChan,
+                                 float64 timeout,
+                                 bool32 fillMode,
+                                 uInt8 readArray[],
+                                 uInt32 arraySizeInSamps,
+                                 int32 *sampsPerChanRead,
+                                 bool32 *reserved);
+int32 DAQmxSetWriteRegenMode    (TaskHandle taskHandle, int32 data);
+int32 DAQmxCfgOutputBuffer      (TaskHandle taskHandle, uInt32 numSampsPerChan);
+int32 DAQmxWriteAnalogF64       (TaskHandle taskHandle,
+                                 int32 numSampsPerChan,
+                                 bool32 autoStart,
+                                 float64 timeout,
+                                 bool32 dataLayout,
+                                 const float64 writeArray[],
+                                 int32 *sampsPerChanWritten,
+                                 bool32 *reserved);
+int32 DAQmxGetExtendedErrorInfo (char errorString[], uInt32 bufferSize);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif
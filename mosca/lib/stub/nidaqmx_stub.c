@@ -0,0 +1,512 @@
+/**
+*   nidaqmx_stub.c -- a local imitation of the NI-DAQmx C API (POSIX only).
+*
+*   each task runs its own sample clock on a pthread. every `nSamples` scans,
+*   it calls the registered EveryNSamples callback from that (non-Python) thread,
+*   just like the DAQmx runtime does. DAQmxReadAnalogF64 returns sine waves
+*   (one phase per channel) in the requested layout.
+*
+*   an AO task whose sample clock is another terminal (e.g. '/Dev1/ai/SampleClock')
+*   has no clock of its own: it is advanced by the clock of the running AI task,
+*   right after the AI callback. the written samples are looped back, i.e.
+*   the i-th AI channel reads the i-th AO channel (for the scans that have been written).
+*
+*   a DI task clocked by another terminal is read on demand: DAQmxReadDigitalU8 returns
+*   a binary counter of the scans (port p counts every 2^(STUB_DIGITAL_SHIFT + p) scans).
+*/
+#include "NIDAQmx.h"
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <pthread.h>
+
+#define STUB_MAX_CHANNELS       256
+#define STUB_SIGNAL_FREQ        10.0
+#define STUB_ERR_INVALID_TASK   (-200088)
+#define STUB_ERR_TOO_MANY_CHANS (-200170)
+#define STUB_ERR_NOT_CONFIGURED (-200077)
+#define STUB_ERR_BUFFER_SIZE    (-200229)
+#define STUB_ERR_THREAD         (-50103)
+#define STUB_ERR_UNDERFLOW      (-200290)
+#define STUB_OUTPUT_SCANS       (1 << 16) // the scans kept for the loopback
+#define STUB_DIGITAL_SHIFT      4
+#define BILLION                 1000000000L
+
+#ifndef M_PI
+#define M_PI                    3.14159265358979323846
+#endif
+
+typedef struct _stubtask {
+    int                                 nchan;
+    double                              rate;
+    uInt32                              nsamples;
+    DAQmxEveryNSamplesEventCallbackPtr  callback;
+    void                               *callbackData;
+    pthread_t                           clock;
+    pthread_mutex_t                     lock;
+    volatile int                        running;
+    uInt64                              acquired; // scans produced by the sample clock
+    uInt64                              consumed; // scans read by the client
+    int                                 output;   // 1 for an AO task
+    int                                 digital;  // 1 for a DI task
+    int                                 slaved;   // 1 if clocked by the AI task
+    int32                               evttype;
+    double                             *outbuf;   // STUB_OUTPUT_SCANS x nchan
+    uInt64                              written;  // scans written by the client
+} stubtask;
+
+static char laststatus[2048] = "";
+
+// the running AO task that is clocked by the AI task (guarded by `slavelock`).
+// the lock is recursive, since the AO callback (called with the lock held) writes the samples.
+static stubtask        *slave = NULL;
+static pthread_mutex_t  slavelock;
+static pthread_once_t   slavelock_once = PTHREAD_ONCE_INIT;
+
+static void init_slavelock(void)
+{
+    pthread_mutexattr_t attr;
+    pthread_mutexattr_init(&attr);
+    pthread_mutexattr_settype(&attr, PTHREAD_MUTEX_RECURSIVE);
+    pthread_mutex_init(&slavelock, &attr);
+    pthread_mutexattr_destroy(&attr);
+}
+
+static void lock_slave(void)
+{
+    pthread_once(&slavelock_once, init_slavelock);
+    pthread_mutex_lock(&slavelock);
+}
+
+static int32 stub_error(int32 code, const char *msg)
+{
+    snprintf(laststatus, sizeof(laststatus), "(stub) %s (status code: %d)", msg, (int)code);
+    return code;
+}
+
+static void *stub_clock(void *arg)
+{
+    stubtask *task = (stubtask *)arg;
+    struct timespec deadline;
+    long period = (long)(((double)BILLION) * task->nsamples / task->rate);
+
+    clock_gettime(CLOCK_MONOTONIC, &deadline);
+    while( task->running ){
+        deadline.tv_nsec += period;
+        while( deadline.tv_nsec >= BILLION ){
+            deadline.tv_nsec -= BILLION;
+            deadline.tv_sec  += 1;
+        }
+        clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &deadline, NULL);
+        if( !(task->running) ){
+            break;
+        }
+        pthread_mutex_lock(&(task->lock));
+        task->acquired += task->nsamples;
+        pthread_mutex_unlock(&(task->lock));
+        if( task->callback ){
+            task->callback((TaskHandle)task, task->evttype,
+                            task->nsamples, task->callbackData);
+        }
+        if( task->output ){
+            continue;
+        }
+        lock_slave();
+        if( slave != NULL ){
+            // the samples are generated regardless of what has been written
+            slave->acquired += task->nsamples;
+            if( slave->callback && (slave->acquired % slave->nsamples) == 0 ){
+                slave->callback((TaskHandle)slave, slave->evttype,
+                                slave->nsamples, slave->callbackData);
+            }
+        }
+        pthread_mutex_unlock(&slavelock);
+    }
+    return NULL;
+}
+
+int32 DAQmxCreateTask           (const char taskName[], TaskHandle *taskHandle)
+{
+    stubtask *task = (stubtask *)calloc(1, sizeof(stubtask));
+    (void)taskName;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_THREAD, "failed to allocate a task");
+    }
+    pthread_mutex_init(&(task->lock), NULL);
+    *taskHandle = (TaskHandle)task;
+    return 0;
+}
+
+int32 DAQmxCreateAIVoltageChan  (TaskHandle taskHandle,
+                                 const char physicalChannel[],
+                                 const char nameToAssignToChannel[],
+                                 int32 terminalConfig,
+                                 float64 minVal,
+                                 float64 maxVal,
+                                 int32 units,
+                                 const char customScaleName[])
+{
+    stubtask *task = (stubtask *)taskHandle;
+    (void)physicalChannel; (void)nameToAssignToChannel; (void)terminalConfig;
+    (void)minVal; (void)maxVal; (void)units; (void)customScaleName;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    if( task->nchan >= STUB_MAX_CHANNELS ){
+        return stub_error(STUB_ERR_TOO_MANY_CHANS, "too many channels");
+    }
+    task->nchan++;
+    return 0;
+}
+
+int32 DAQmxCreateAOVoltageChan  (TaskHandle taskHandle,
+                                 const char physicalChannel[],
+                                 const char nameToAssignToChannel[],
+                                 float64 minVal,
+                                 float64 maxVal,
+                                 int32 units,
+                                 const char customScaleName[])
+{
+    stubtask *task = (stubtask *)taskHandle;
+    int32 ret = DAQmxCreateAIVoltageChan(taskHandle, physicalChannel, nameToAssignToChannel,
+                                DAQmx_Val_Cfg_Default, minVal, maxVal, units, customScaleName);
+    if( ret == 0 ){
+        task->output = 1;
+    }
+    return ret;
+}
+
+int32 DAQmxCreateDIChan         (TaskHandle taskHandle,
+                                 const char lines[],
+                                 const char nameToAssignToLines[],
+                                 int32 lineGrouping)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    int32 ret;
+    (void)lineGrouping;
+    ret = DAQmxCreateAIVoltageChan(taskHandle, lines, nameToAssignToLines,
+                                DAQmx_Val_Cfg_Default, 0.0, 5.0, DAQmx_Val_Volts, NULL);
+    if( ret == 0 ){
+        task->digital = 1;
+    }
+    return ret;
+}
+
+int32 DAQmxCfgSampClkTiming     (TaskHandle taskHandle,
+                                 const char source[],
+                                 float64 rate,
+                                 int32 activeEdge,
+                                 int32 sampleMode,
+                                 uInt64 sampsPerChan)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    (void)activeEdge; (void)sampleMode; (void)sampsPerChan;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    task->rate   = rate;
+    task->slaved = (source != NULL) && (strlen(source) > 0);
+    return 0;
+}
+
+int32 DAQmxCfgDigEdgeStartTrig  (TaskHandle taskHandle,
+                                 const char triggerSource[],
+                                 int32 triggerEdge)
+{
+    // every task starts on its own (the AI tasks also run their own clocks)
+    (void)triggerSource; (void)triggerEdge;
+    if( taskHandle == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    return 0;
+}
+
+int32 DAQmxSetWriteRegenMode    (TaskHandle taskHandle, int32 data)
+{
+    (void)data;
+    if( taskHandle == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    return 0;
+}
+
+int32 DAQmxCfgOutputBuffer      (TaskHandle taskHandle, uInt32 numSampsPerChan)
+{
+    (void)numSampsPerChan;
+    if( taskHandle == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    return 0;
+}
+
+int32 DAQmxRegisterEveryNSamplesEvent(TaskHandle taskHandle,
+                                 int32 everyNsamplesEventType,
+                                 uInt32 nSamples,
+                                 uInt32 options,
+                                 DAQmxEveryNSamplesEventCallbackPtr callbackFunction,
+                                 void *callbackData)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    (void)options;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    task->evttype       = everyNsamplesEventType;
+    task->nsamples      = nSamples;
+    task->callback      = callbackFunction;
+    task->callbackData  = callbackData;
+    return 0;
+}
+
+int32 DAQmxStartTask            (TaskHandle taskHandle)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    if( task->digital && task->slaved ){
+        // read on demand, along with the AI task
+        task->consumed = 0;
+        task->running  = 1;
+        return 0;
+    }
+    if( (task->rate <= 0) || (task->nsamples == 0) ){
+        return stub_error(STUB_ERR_NOT_CONFIGURED, "timing or callback not configured");
+    }
+    if( task->running ){
+        return 0;
+    }
+    task->acquired = 0;
+    task->consumed = 0;
+    if( task->slaved && task->output ){
+        lock_slave();
+        slave         = task;
+        task->running = 1;
+        pthread_mutex_unlock(&slavelock);
+        return 0;
+    }
+    task->running  = 1;
+    if( pthread_create(&(task->clock), NULL, stub_clock, task) ){
+        task->running = 0;
+        return stub_error(STUB_ERR_THREAD, "failed to start the sample clock");
+    }
+    return 0;
+}
+
+int32 DAQmxStopTask             (TaskHandle taskHandle)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    if( task->running && task->slaved && task->output ){
+        lock_slave();
+        if( slave == task ){
+            slave = NULL;
+        }
+        task->running = 0;
+        pthread_mutex_unlock(&slavelock);
+    } else if( task->running ){
+        task->running = 0;
+        // the clock thread may be the caller (i.e. stopping from within the callback)
+        if( pthread_equal(pthread_self(), task->clock) ){
+            pthread_detach(task->clock);
+        } else {
+            pthread_join(task->clock, NULL);
+        }
+    }
+    return 0;
+}
+
+int32 DAQmxTaskControl          (TaskHandle taskHandle, int32 action)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    switch( action ){
+    case DAQmx_Val_Task_Start:
+        return DAQmxStartTask(taskHandle);
+    case DAQmx_Val_Task_Stop:
+    case DAQmx_Val_Task_Abort:
+        return DAQmxStopTask(taskHandle);
+    case DAQmx_Val_Task_Verify:
+    case DAQmx_Val_Task_Commit:
+        if( task->rate <= 0 ){
+            return stub_error(STUB_ERR_NOT_CONFIGURED, "timing not configured");
+        }
+        return 0;
+    default:
+        return 0;
+    }
+}
+
+int32 DAQmxWaitUntilTaskDone    (TaskHandle taskHandle, float64 timeToWait)
+{
+    (void)timeToWait;
+    if( taskHandle == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    return 0;
+}
+
+int32 DAQmxClearTask            (TaskHandle taskHandle)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    DAQmxStopTask(taskHandle);
+    pthread_mutex_destroy(&(task->lock));
+    free(task->outbuf);
+    free(task);
+    return 0;
+}
+
+int32 DAQmxReadAnalogF64        (TaskHandle taskHandle,
+                                 int32 numSampsPerChan,
+                                 float64 timeout,
+                                 bool32 fillMode,
+                                 float64 readArray[],
+                                 uInt32 arraySizeInSamps,
+                                 int32 *sampsPerChanRead,
+                                 bool32 *reserved)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    uInt64 first, available, i;
+    int    ch;
+    double t;
+    (void)timeout; (void)reserved;
+
+    if( task == NULL ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    if( ((uInt64)numSampsPerChan) * task->nchan > arraySizeInSamps ){
+        return stub_error(STUB_ERR_BUFFER_SIZE, "read buffer is too small");
+    }
+
+    pthread_mutex_lock(&(task->lock));
+    first     = task->consumed;
+    available = task->acquired - task->consumed;
+    if( available > (uInt64)numSampsPerChan ){
+        available = (uInt64)numSampsPerChan;
+    }
+    task->consumed += available;
+    pthread_mutex_unlock(&(task->lock));
+
+    lock_slave();
+    for( i = 0; i < available; i++ ){
+        t = ((double)(first + i)) / task->rate;
+        for( ch = 0; ch < task->nchan; ch++ ){
+            double value;
+            if( (slave != NULL) && (ch < slave->nchan) && ((first + i) < slave->written) ){
+                value = slave->outbuf[((first + i) % STUB_OUTPUT_SCANS) * slave->nchan + ch];
+            } else {
+                value = sin(2.0 * M_PI * (STUB_SIGNAL_FREQ * t + ((double)ch) / task->nchan));
+            }
+            if( fillMode == DAQmx_Val_GroupByScanNumber ){
+                readArray[i * task->nchan + ch] = value;
+            } else {
+                readArray[ch * available + i] = value;
+            }
+        }
+    }
+    pthread_mutex_unlock(&slavelock);
+    *sampsPerChanRead = (int32)available;
+    return 0;
+}
+
+int32 DAQmxReadDigitalU8        (TaskHandle taskHandle,
+                                 int32 numSampsPerChan,
+                                 float64 timeout,
+                                 bool32 fillMode,
+                                 uInt8 readArray[],
+                                 uInt32 arraySizeInSamps,
+                                 int32 *sampsPerChanRead,
+                                 bool32 *reserved)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    uInt64 first, i;
+    int    port;
+    (void)timeout; (void)reserved;
+
+    if( (task == NULL) || !(task->digital) ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    if( ((uInt64)numSampsPerChan) * task->nchan > arraySizeInSamps ){
+        return stub_error(STUB_ERR_BUFFER_SIZE, "read buffer is too small");
+    }
+    first = task->consumed;
+    for( i = 0; i < (uInt64)numSampsPerChan; i++ ){
+        for( port = 0; port < task->nchan; port++ ){
+            uInt8 value = (uInt8)((first + i) >> (STUB_DIGITAL_SHIFT + port));
+            if( fillMode == DAQmx_Val_GroupByScanNumber ){
+                readArray[i * task->nchan + port] = value;
+            } else {
+                readArray[port * numSampsPerChan + i] = value;
+            }
+        }
+    }
+    task->consumed += numSampsPerChan;
+    *sampsPerChanRead = numSampsPerChan;
+    return 0;
+}
+
+int32 DAQmxWriteAnalogF64       (TaskHandle taskHandle,
+                                 int32 numSampsPerChan,
+                                 bool32 autoStart,
+                                 float64 timeout,
+                                 bool32 dataLayout,
+                                 const float64 writeArray[],
+                                 int32 *sampsPerChanWritten,
+                                 bool32 *reserved)
+{
+    stubtask *task = (stubtask *)taskHandle;
+    uInt64 i, scan;
+    int    ch;
+    (void)autoStart; (void)timeout; (void)reserved;
+
+    if( (task == NULL) || !(task->output) ){
+        return stub_error(STUB_ERR_INVALID_TASK, "invalid task");
+    }
+    // `outbuf`, `written` and `acquired` are read by the AI task under the lock
+    lock_slave();
+    if( task->outbuf == NULL ){
+        task->outbuf = (double *)calloc(((size_t)STUB_OUTPUT_SCANS) * task->nchan, sizeof(double));
+        if( task->outbuf == NULL ){
+            pthread_mutex_unlock(&slavelock);
+            return stub_error(STUB_ERR_THREAD, "failed to allocate the output buffer");
+        }
+    }
+    if( task->running && (task->written < task->acquired) ){
+        pthread_mutex_unlock(&slavelock);
+        return stub_error(STUB_ERR_UNDERFLOW, "the output buffer has underflowed");
+    }
+    for( i = 0; i < (uInt64)numSampsPerChan; i++ ){
+        scan = (task->written + i) % STUB_OUTPUT_SCANS;
+        for( ch = 0; ch < task->nchan; ch++ ){
+            if( dataLayout == DAQmx_Val_GroupByScanNumber ){
+                task->outbuf[scan * task->nchan + ch] = writeArray[i * task->nchan + ch];
+            } else {
+                task->outbuf[scan * task->nchan + ch] = writeArray[ch * numSampsPerChan + i];
+            }
+        }
+    }
+    task->written += numSampsPerChan;
+    pthread_mutex_unlock(&slavelock);
+    *sampsPerChanWritten = numSampsPerChan;
+    return 0;
+}
+
+int32 DAQmxGetExtendedErrorInfo (char errorString[], uInt32 bufferSize)
+{
+    if( bufferSize == 0 ){
+        return (int32)(strlen(laststatus) + 1);
+    }
+    strncpy(errorString, laststatus, bufferSize - 1);
+    errorString[bufferSize - 1] = '\0';
+    return 0;
+}
@@ -0,0 +1,195 @@
+
+import os, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import recordings
+
+##
+## Chunked map/reduce over recordings
+##
+## map_chunks(path, func) calls `func(chunk)` on consecutive chunks of a recording (given by
+## any of its files), and combines the results in the order of the chunks, e.g.
+##
+##   def crossings(chunk):
+##       x    = chunk.data[:, 0]
+##       rows = np.flatnonzero((x[:-1] < 0.5) & (x[1:] >= 0.5)) + 1 + chunk.offset
+##       return rows[(rows >= chunk.start) & (rows < chunk.stop)]
+##
+##   onsets = mapreduce.map_chunks('wave_001.cfg', crossings, halo=1)
+##
+## `chunk.data` holds the rows [start, stop) of the chunk with up to `halo` rows on each side
+## (fewer at the ends of the recording); `chunk.offset` is the index of its first row.
+##
+## the chunks of a .npy recording are mapped on a pool of `jobs` processes. each process maps
+## the file into its memory, and `chunk.data` is a read-only view of the map (no copy),
+## unless channels are selected or the samples are quantized (see mosca.convert).
+## with the 'columns' layout (one .npy file per channel), `chunk.data` is a view only if it
+## holds a single channel; the chunks of several channels are copied into one array.
+## at most 2 x `jobs` chunks are in flight, so that the memory in use is bounded by the chunks
+## (and the results), not by the recording. `func` and its results must be picklable
+## (e.g. `func` is defined at the top level of a module).
+## a .zdat recording can only be read from its beginning, and is mapped in this process.
+##
+
+DEFAULT_CHUNK_ROWS = 1 << 20
+INFLIGHT_PER_JOB   = 2
+
+class Chunk:
+    """a chunk of a recording, as it is given to the mapped function."""
+
+    __slots__ = ('data', 'index', 'offset', 'start', 'stop', 'rate')
+
+    def __init__(self, data, index, offset, start, stop, rate):
+        self.data   = data   # the rows [offset, offset + len(data)), including the halo
+        self.index  = index  # the number of the chunk
+        self.offset = offset
+        self.start  = start  # the rows that the chunk is responsible for
+        self.stop   = stop
+        self.rate   = rate
+
+    @property
+    def core(self):
+        """the rows [start, stop) (without the halo)."""
+        return self.data[self.start - self.offset:self.stop - self.offset]
+
+def _concatenate(results):
+    return np.concatenate(results, axis=0) if len(results) > 0 else np.empty((0,))
+
+class _Fold:
+    """folds the results, in the order of the chunks, with `reduce(accumulated, result)`."""
+
+    def __init__(self, reduce, initial=None):
+        self.reduce = reduce
+        self.value  = initial
+        self.empty  = (initial is None)
+
+    def add(self, result):
+        if self.empty == True:
+            self.value, self.empty = result, False
+        else:
+            self.value = self.reduce(self.value, result)
+
+class _Collect:
+    """keeps the results, and combines them at once at the end."""
+
+    def __init__(self, combine):
+        self.combine = combine
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+
+    @property
+    def value(self):
+        return self.combine(self.results)
+
+def _reducer(reduce, initial):
+    if reduce == 'concatenate':
+        return _Collect(_concatenate)
+    elif reduce == 'list':
+        return _Collect(list)
+    elif reduce == 'sum':
+        return _Fold(lambda total, result: total + result, initial)
+    elif callable(reduce):
+        return _Fold(reduce, initial)
+    else:
+        raise ValueError(f"unknown reduce: {reduce!r} (expected 'concatenate', 'sum', 'list' or a function)")
+
+def map_chunks(path, func, reduce='concatenate', initial=None, chunkrows=DEFAULT_CHUNK_ROWS, halo=0,
+               channels=None, jobs=None, verbose=False):
+    """calls `func(chunk)` on the chunks of the recording at `path` (see the comment above),
+    and returns the results combined by `reduce`:
+
+    'concatenate' -- the results (arrays) concatenated along the first axis.
+    'sum'         -- the sum of the results (e.g. the counts of histograms with common bins).
+    'list'        -- the list of the results.
+    a function    -- `reduce(accumulated, result)`, applied in the order of the chunks
+                     (starting from `initial`, or from the first result).
+
+    `channels` selects the channels by their names (or sources); `jobs` is the number of
+    processes (all the cores by default; 0 maps the chunks in this process)."""
+    if (chunkrows < 1) or (halo < 0):
+        raise ValueError("chunkrows must be >= 1, and halo >= 0")
+    recording = recordings.Recording(path)
+    columns   = None if channels is None else recording.column_indices(channels)
+    reader    = recording.reader()
+    rows, random_access = reader.rows, reader.random_access
+    reader.close()
+    if jobs is None:
+        jobs = os.cpu_count()
+    reducer   = _reducer(reduce, initial)
+    started   = time.perf_counter()
+    bounds    = [(index, start, min(start + chunkrows, rows)) for index, start in enumerate(range(0, rows, chunkrows))]
+    if random_access == False:
+        for chunk in _stream_chunks(recording, chunkrows, halo, columns):
+            reducer.add(func(chunk))
+    elif jobs == 0:
+        for index, start, stop in bounds:
+            reducer.add(map_chunk(recording.prefix, func, index, start, stop, halo, columns))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            inflight = deque()
+            for index, start, stop in bounds:
+                if len(inflight) >= INFLIGHT_PER_JOB*jobs:
+                    reducer.add(inflight.popleft().result())
+                inflight.append(pool.submit(map_chunk, recording.prefix, func, index, start, stop, halo, columns))
+            while len(inflight) > 0:
+                reducer.add(inflight.popleft().result())
+    if verbose == True:
+        elapsed = time.perf_counter() - started
+        nbytes  = rows*recording.shape[1]*recording.dtype.itemsize
+        print(f"[MapReduce] {len(bounds)} chunks of {recording.prefix} ({nbytes/1e6:.1f} MB) in {elapsed:.2f} s "+
+              f"({nbytes/1e6/max(elapsed, 1e-9):.1f} MB/s, {max(jobs, 1) if random_access else 1} processes)")
+    return reducer.value
+
+def map_chunk(prefix, func, index, start, stop, halo=0, columns=None):
+    """calls `func` on the rows [start, stop) of a random-access recording, with the halo
+    (in the worker processes of map_chunks())."""
+    recording = recordings.Recording(prefix)
+    reader    = recording.reader()
+    try:
+        offset = max(start - halo, 0)
+        data   = reader.view(offset, min(stop + halo, reader.rows), columns)
+        if recording.quantization is not None:
+            data = data*(recording.quantization if columns is None else recording.quantization[columns])
+        return func(Chunk(data, index, offset, start, stop, recording.rate))
+    finally:
+        reader.close()
+
+def _stream_chunks(recording, chunkrows, halo, columns):
+    """yields the chunks of a recording that can only be read from its beginning."""
+    reader = recording.reader()
+    scale  = recording.quantization
+    if (scale is not None) and (columns is not None):
+        scale = scale[columns]
+    try:
+        rows   = reader.rows
+        buf    = None
+        first  = 0 # the index of the first row in `buf`
+        for index, start in enumerate(range(0, rows, chunkrows)):
+            stop   = min(start + chunkrows, rows)
+            needed = min(stop + halo, rows)
+            blocks = [] if buf is None else [buf]
+            size   = 0 if buf is None else buf.shape[0]
+            while first + size < needed:
+                block = reader.read(needed - first - size)
+                if block.shape[0] == 0:
+                    break # the recording is shorter than its .cfg file says
+                if columns is not None:
+                    block = block[:, columns]
+                if scale is not None:
+                    block = block*scale
+                blocks.append(block)
+                size += block.shape[0]
+            if size == 0:
+                return
+            buf    = np.concatenate(blocks, axis=0) if len(blocks) > 1 else blocks[0]
+            offset = max(start - halo, 0)
+            buf    = buf[offset - first:]
+            first  = offset
+            if start >= first + buf.shape[0]:
+                return
+            yield Chunk(buf, index, offset, start, min(stop, first + buf.shape[0]), recording.rate)
+    finally:
+        reader.close()
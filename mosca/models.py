@@ -1,4 +1,5 @@
 
+import time, math
 import traceback
 from collections import OrderedDict
 from pyqtgraph.Qt import QtGui, QtCore
@@ -72,12 +73,13 @@ def _():
 _()
 """
         default_driver = None
-        for i, cfg in enumerate(driverconfigs):
+        for cfg in driverconfigs:
             try:
                 exec(registrar.format(**cfg), {'self':self})
                 isdefault = cfg.get('default', None)
                 if (isdefault is not None) and (bool(isdefault) == True):
-                    default_driver = i
+                    # the index among the drivers that have been loaded
+                    default_driver = len(self.drivers) - 1
             except ModuleNotFoundError:
                 print("***{managername}: could not load driver class: '{module}.{class}'".format(managername=self.name,
                         **cfg))
@@ -86,7 +88,7 @@ _()
                 print("***{managername}: could not load driver class: '{module}.{class}'".format(managername=self.name,
                         **cfg))
         if default_driver is not None:
-            self.set_driver(i)
+            self.set_driver(default_driver)
 
     def get_drivers(self):
         return self.drivers
@@ -165,11 +167,17 @@ class SynchronizedState(QtCore.QObject):
         self._condition.wakeAll()
 
     def wait(self, timeout=None):
-        """waits until the internal event is set and notified.
+        """waits until the internal event is set and notified, or for at most `timeout` msec.
+        returns the internal state (i.e. False on timeout).
         acquire the lock with the object before calling wait()."""
-        if self._state == True:
-            return
         if timeout is None:
-            timeout = sys.maxsize
+            while self._state == False:
+                self._condition.wait(self._mutex)
+            return True
+        deadline = time.monotonic() + timeout/1000
         while self._state == False:
-            self._condition.wait(self._mutex, timeout)
+            remaining = int(math.ceil((deadline - time.monotonic())*1000))
+            if remaining <= 0:
+                break
+            self._condition.wait(self._mutex, remaining)
+        return self._state
@@ -1,4 +1,6 @@
 
+import operator
+from collections import OrderedDict
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore
 from . import models
@@ -45,6 +47,113 @@ class ParameterController(QtCore.QObject):
     def read_only(self, value):
         raise ValueError("this parameter is read-only: no setter is specified")
 
+##
+## Declared parameters
+##
+## a driver or a channel model declares its parameters in the class body, e.g.
+##
+##   class Board(BaseDeviceDriver):
+##       batch = param.Parameter('Delivery batch (chunks)', mode='int',
+##                               convert=lambda self, val: utils.validate_integer(val, (1, 1000), 'delivery batch'))
+##
+## the value lives in the `_batch` attribute of the instance. reading `board.batch`
+## goes through an operator.attrgetter (about twice the cost of a plain attribute,
+## but without any Python-level call), whereas `board.batch = val` goes through `board.set_batch(val)`, so that subclasses can
+## validate the value in their own way. get_batch() and set_batch() are generated unless
+## the class defines them, and the ParameterControllers for the GUI are generated from
+## the declarations upon the first call to configs() (see controllers()).
+##
+
+def as_float(obj, value):
+    """a `convert` function for floating-point parameters."""
+    try:
+        return float(value)
+    except ValueError as e:
+        raise ValueError("failed to parse: '{0}'".format(value)) from e
+
+def as_bool(obj, value):
+    """a `convert` function for boolean parameters."""
+    return bool(value)
+
+class Parameter(property):
+    """a class-level declaration of a parameter (see the comment above).
+
+    label    -- the label in the GUI form.
+
+    mode     -- the data type (see ParameterController).
+
+    convert  -- `convert(obj, value)` validates `value` and returns the value to be stored.
+                it may raise a ValueError when it fails.
+
+    readonly -- makes the parameter read-only in the GUI (it can still be set from the code).
+
+    signal   -- the name of the signal of the instance that is emitted after the value is set.
+
+    first    -- places the parameter before the ones declared by the base classes in configs().
+    """
+
+    def __init__(self, label, mode='str', convert=None, readonly=False, signal=None, first=False):
+        super().__init__()
+        self.label    = label
+        self.mode     = mode
+        self.convert  = convert
+        self.readonly = readonly
+        self.signal   = signal
+        self.first    = first
+        self.name     = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        attr      = '_' + name
+        getter, setter = 'get_' + name, 'set_' + name
+        if getter in owner.__dict__:
+            fget = owner.__dict__[getter]
+        else:
+            fget = operator.attrgetter(attr)
+            setattr(owner, getter, _make_getter(attr))
+        if setter not in owner.__dict__:
+            setattr(owner, setter, _make_setter(attr, self.convert, self.signal))
+        def _set(obj, val):
+            getattr(obj, setter)(val)
+        property.__init__(self, fget, _set)
+
+def _make_getter(attr):
+    def _get(self):
+        return getattr(self, attr)
+    return _get
+
+def _make_setter(attr, convert, signal):
+    def _set(self, val):
+        if convert is not None:
+            val = convert(self, val)
+        setattr(self, attr, val)
+        if signal is not None:
+            getattr(self, signal).emit()
+    return _set
+
+_declared = {}
+
+def declared(cls):
+    """the Parameters that are declared by `cls` and its bases, in the order of the GUI form."""
+    if cls not in _declared:
+        params = OrderedDict()
+        for base in reversed(cls.__mro__):
+            for name, attr in vars(base).items():
+                if isinstance(attr, Parameter):
+                    params[name] = attr # a redeclaration keeps the position of the original
+        params = list(params.values())
+        _declared[cls] = [p for p in params if p.first] + [p for p in params if not p.first]
+    return _declared[cls]
+
+def controllers(obj):
+    """generates the ParameterControllers for the Parameters declared by the class of `obj`."""
+    return [ParameterController(mode=p.mode,
+                                label=p.label,
+                                getter=getattr(obj, 'get_' + p.name),
+                                setter=None if p.readonly else getattr(obj, 'set_' + p.name),
+                                signal=None if p.signal is None else getattr(obj, p.signal))
+            for p in declared(type(obj))]
+
 
 class FormView(object):
     """a base class to define the behavior of the form objects.
@@ -0,0 +1,84 @@
+
+import types
+from collections import OrderedDict
+import numpy as np
+
+##
+## Acquisition plan
+##
+## DeviceManager freezes the channels in use of the current driver into an AcquisitionPlan
+## upon every start, before any consumer is prepared (see DeviceDriverManager.build_plan()),
+## and hands it to the driver as `driver.plan`. the consumers take the column order, the
+## scales and the metadata from DeviceManager.plan instead of walking driver.channels,
+## so that the storage, the display and the .cfg file agree on the channels even if they
+## are edited during the acquisition.
+##
+## a plan is read-only: its attributes cannot be set, and its arrays are not writeable.
+##
+
+BASETYPE = np.dtype('float64')
+
+def _frozen(values):
+    array = np.array(values, dtype=BASETYPE).reshape((1,-1))
+    array.setflags(write=False)
+    return array
+
+class AcquisitionPlan:
+    """the channels in use of a driver (in the order of its columns), and the settings
+    that do not change during an acquisition."""
+
+    __slots__ = ('driver', 'channels', 'names', 'sources', 'titles', 'units', 'ranges',
+                 'index', 'nchan', 'scales', 'gains', 'offsets', 'dtype',
+                 'rate', 'interval', 'chunkshape', 'metadata')
+
+    def __init__(self, driver):
+        inuse = [(name, ch) for name, ch in driver.channels.items() if ch.inuse == True]
+        init  = super().__setattr__
+        init('driver',     driver.name)
+        init('channels',   tuple(ch for name, ch in inuse)) # the models (for the display settings)
+        init('names',      tuple(name for name, ch in inuse))
+        init('sources',    tuple(ch.name for name, ch in inuse))
+        init('titles',     tuple(ch.label if len(ch.label.strip()) > 0 else ch.name for name, ch in inuse))
+        init('units',      tuple(ch.unit for name, ch in inuse))
+        init('ranges',     tuple(ch.range for name, ch in inuse))
+        init('index',      types.MappingProxyType(OrderedDict((name, i) for i, (name, ch) in enumerate(inuse))))
+        init('nchan',      len(inuse))
+        init('scales',     _frozen([ch.scale for name, ch in inuse]))
+        init('gains',      _frozen([ch.gain for name, ch in inuse]))
+        init('offsets',    _frozen([ch.offset for name, ch in inuse]))
+        init('dtype',      BASETYPE)
+        init('rate',       driver.rate)
+        init('interval',   driver.interval)
+        init('chunkshape', (driver.interval, len(inuse)))
+        init('metadata',   self._describe(inuse))
+
+    def __setattr__(self, name, val):
+        raise AttributeError("an acquisition plan is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("an acquisition plan is read-only")
+
+    @staticmethod
+    def _describe(inuse):
+        """the "channels" entry of the .cfg file."""
+        entries = []
+        for i, (name, ch) in enumerate(inuse):
+            chinfo = OrderedDict()
+            chinfo['id']     = i
+            chinfo['name']   = ch.label if len(ch.label) > 0 else ch.name
+            chinfo['unit']   = ch.unit
+            chinfo['range']  = ch.range
+            chinfo['source'] = ch.name
+            entries.append(chinfo)
+        return tuple(entries)
+
+    def config(self, nsamples, dtype="float64", byteorder='little'):
+        """returns the contents of the .cfg file for `nsamples` samples (as a new dict)."""
+        info = OrderedDict()
+        info['channels'] = [OrderedDict(chinfo) for chinfo in self.metadata]
+        info['data'] = OrderedDict()
+        info['data']['datatype']  = dtype
+        info['data']['byteorder'] = byteorder
+        info['data']['shape']     = (nsamples, self.nchan)
+        info['data']['rate']      = self.rate
+        return info
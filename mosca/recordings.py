@@ -0,0 +1,349 @@
+
+import os, json, time, zlib, weakref
+from collections import OrderedDict
+import numpy as np
+from pyqtgraph.Qt import QtCore
+from . import devices
+from . import channels
+from . import param
+
+##
+## Reading and replaying the recordings
+##
+## a recording is the set of files that share a path prefix (e.g. 'wave_001'):
+## the '.cfg' file, and the samples in either '.npy' (NumpyIODriver) or '.zdat' (BareZLibDriver),
+## or in one '.npy' file per channel (`"layout": "columns"`, written by mosca.convert).
+## integer samples are multiplied by the `"quantization"` of the .cfg file (units per count).
+## PlaybackDeviceDriver streams a recording through dataAvailable, as if it were being acquired,
+## so that the display, the storage and the online processing can be run (and benchmarked)
+## on real data. as fast as possible, it reads ahead of the consumers by at most `maxinflight`
+## chunks: a chunk is in flight until every consumer has released it (e.g. while it waits
+## in the event queue of a consumer thread).
+##
+
+DEFAULT_SPEED       = 1.0   # in units of real time; 0 means 'as fast as possible'
+DEFAULT_MAX_IN_FLIGHT = 16  # in chunks, when replaying as fast as possible
+DEFAULT_ZLIB_BLOCK  = 1 << 20 # the number of compressed bytes read at a time
+
+def path_prefix(path):
+    """returns the path prefix of the recording that `path` (.cfg/.npy/.zdat) belongs to."""
+    base, ext = os.path.splitext(path)
+    return base if ext in ('.cfg', '.npy', '.zdat') else path
+
+class NpyReader:
+    """reads the rows of a .npy file through a memory map.
+
+    if the recording has not been finalized (the shape in the header is still
+    a placeholder), the number of rows is inferred from the size of the file."""
+
+    random_access = True
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        ncol    = shape[1] if len(shape) > 1 else 1 # a column of a 'columns' recording is 1-D
+        rowsize = ncol*dtype.itemsize
+        rows    = min(shape[0], (os.path.getsize(path) - offset)//rowsize)
+        self.data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(rows, ncol))
+        self.rows = rows
+        self._pos = 0
+
+    def rewind(self):
+        self._pos = 0
+
+    def seek(self, row):
+        self._pos = min(row, self.rows)
+
+    def read(self, rows):
+        """returns the next (up to) `rows` rows (a view of the memory map)."""
+        start = self._pos
+        self._pos = min(start + rows, self.rows)
+        return self.data[start:self._pos]
+
+    def view(self, start, stop, columns=None):
+        """returns the rows [start, stop) without copying them (unless `columns` are selected)."""
+        data = self.data[start:stop]
+        return data if columns is None else data[:, columns]
+
+    def close(self):
+        self.data = None
+
+class ColumnsReader:
+    """reads the rows of a recording that is stored as one .npy file per channel."""
+
+    random_access = True
+
+    def __init__(self, paths):
+        self.columns = [NpyReader(path) for path in paths]
+        self.rows    = min(column.rows for column in self.columns)
+
+    def rewind(self):
+        self.seek(0)
+
+    def seek(self, row):
+        for column in self.columns:
+            column.seek(min(row, self.rows))
+
+    def read(self, rows):
+        """returns the next (up to) `rows` rows (as a copy)."""
+        rows = min(rows, self.rows - self.columns[0]._pos)
+        return np.concatenate([column.read(rows) for column in self.columns], axis=1)
+
+    def view(self, start, stop, columns=None):
+        """returns the rows [start, stop) of `columns`, as one (rows x columns) array.
+        only a single column is a view of its file; more columns are copied into the array."""
+        columns = range(len(self.columns)) if columns is None else columns
+        if len(columns) == 1:
+            return self.columns[columns[0]].data[start:stop]
+        return np.concatenate([self.columns[c].data[start:stop] for c in columns], axis=1)
+
+    def close(self):
+        for column in self.columns:
+            column.close()
+
+class ZlibReader:
+    """reads the rows of a .zdat file with a streaming decompressor.
+    seeking decompresses the stream up to the row."""
+
+    random_access = False
+
+    def __init__(self, path, shape, dtype):
+        self.path   = path
+        self.rows   = shape[0]
+        self.nchan  = shape[1]
+        self.dtype  = np.dtype(dtype)
+        self._file  = open(path, 'rb')
+        self.rewind()
+
+    def rewind(self):
+        self._file.seek(0)
+        self._zlib    = zlib.decompressobj()
+        self._pending = b''
+        self._pos     = 0
+
+    def seek(self, row):
+        if row < self._pos:
+            self.rewind()
+        while self._pos < row:
+            if self.read(min(row - self._pos, DEFAULT_ZLIB_BLOCK)).shape[0] == 0:
+                break
+
+    def read(self, rows):
+        rows   = min(rows, self.rows - self._pos)
+        nbytes = rows*self.nchan*self.dtype.itemsize
+        chunks = [self._pending]
+        size   = len(self._pending)
+        while size < nbytes:
+            block = self._file.read(DEFAULT_ZLIB_BLOCK)
+            if len(block) == 0:
+                chunks.append(self._zlib.flush())
+                size += len(chunks[-1])
+                break
+            chunks.append(self._zlib.decompress(block))
+            size += len(chunks[-1])
+        buf = b''.join(chunks)
+        rows = min(rows, len(buf)//(self.nchan*self.dtype.itemsize))
+        nbytes = rows*self.nchan*self.dtype.itemsize
+        self._pending = buf[nbytes:]
+        self._pos += rows
+        return np.frombuffer(buf[:nbytes], dtype=self.dtype).reshape((rows, self.nchan))
+
+    def close(self):
+        self._file.close()
+
+class Recording:
+    """the description of a recording, as read from its .cfg file."""
+
+    def __init__(self, path):
+        self.prefix = path_prefix(path)
+        with open(self.prefix + ".cfg", 'r') as f:
+            self.info = json.load(f, object_pairs_hook=OrderedDict)
+        if 'data' not in self.info.keys():
+            raise ValueError(f"the recording has no samples: '{self.prefix}'")
+        data           = self.info['data']
+        self.channels  = self.info['channels']
+        self.shape     = tuple(data['shape'])
+        self.dtype     = np.dtype(data['datatype']).newbyteorder('<' if data['byteorder'] == 'little' else '>')
+        self.rate      = data.get('rate', None) # not recorded before the playback driver was added
+        self.layout    = data.get('layout', 'rows')
+        self.files     = data.get('files', None) # the files of the columns (relative to the .cfg file)
+        quantization   = data.get('quantization', None)
+        self.quantization = np.array(quantization, dtype=float) if quantization is not None else None
+
+    def column_indices(self, names):
+        """the columns of the channels in `names` (given by their names or their sources)."""
+        index = {}
+        for i, chinfo in enumerate(self.channels[:self.shape[1]]):
+            for key in ('name', 'source'):
+                if key in chinfo.keys():
+                    index.setdefault(chinfo[key], i)
+        missing = [name for name in names if name not in index.keys()]
+        if len(missing) > 0:
+            raise ValueError(f"no channel named {', '.join(missing)} in '{self.prefix}'")
+        return [index[name] for name in names]
+
+    def reader(self):
+        """returns a reader for the samples of the recording."""
+        if self.layout == 'columns':
+            directory = os.path.dirname(self.prefix)
+            return ColumnsReader([os.path.join(directory, name) for name in self.files])
+        elif os.path.exists(self.prefix + ".npy"):
+            return NpyReader(self.prefix + ".npy")
+        elif os.path.exists(self.prefix + ".zdat"):
+            return ZlibReader(self.prefix + ".zdat", self.shape, self.dtype)
+        else:
+            raise FileNotFoundError(f"no .npy or .zdat file for: '{self.prefix}'")
+
+class PlaybackDeviceDriver(devices.BaseDeviceDriver):
+    """replays a recording as chunks of `interval` samples.
+
+    the chunks are paced at `speed` times real time (as fast as possible if `speed` is 0,
+    with at most `maxinflight` chunks not yet released by the consumers),
+    and the channels of the recording appear as the channels of the driver, in the order
+    of the columns (a name that repeats an earlier one is suffixed with '#<column>').
+    the recorded values are already scaled, so the channels have a scale of 1."""
+
+    path  = param.Parameter('Recording (.cfg/.npy/.zdat)', mode='str', first=True)
+    speed = param.Parameter('Speed (x real time, 0: max)', mode='float')
+    loop  = param.Parameter('Loop', mode='bool', convert=param.as_bool)
+
+    def __init__(self, path='', speed=DEFAULT_SPEED, loop=False, maxinflight=DEFAULT_MAX_IN_FLIGHT,
+                    parent=None, raterange=None, intervalrange=None):
+        super().__init__('Playback', parent=parent, raterange=raterange, intervalrange=intervalrange)
+        self._timer     = None
+        self._armed     = None
+        self._reader    = None
+        self._recording = None
+        self._path      = ''
+        self._speed     = float(speed)
+        self._loop      = bool(loop)
+        self._maxinflight = max(int(maxinflight), 1)
+        self._inflight  = [] # weak references to the chunks that a consumer still holds
+        if len(path) > 0:
+            self.set_path(path)
+
+    def set_path(self, val):
+        try:
+            recording = Recording(val)
+        except (OSError, KeyError, TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"failed to open the recording '{val}': {e}") from e
+        self.disarm()
+        self._recording = recording
+        self._path      = val
+        self._channels  = OrderedDict()
+        for i, chinfo in enumerate(recording.channels):
+            name = chinfo['name']
+            if name in self._channels:
+                name = "{0}#{1:d}".format(name, i)
+                print(f"***{self.name}: the channel name '{chinfo['name']}' is repeated; column {i} is named '{name}'")
+            # (the driver may already live in the acquisition thread)
+            ch = channels.BaseChannelModel(name)
+            ch.unit  = chinfo.get('unit', ch.unit)
+            ch.range = chinfo.get('range', ch.range)
+            ch.inuse = True
+            self._channels[name] = ch
+        if recording.rate is not None:
+            self.rate = recording.rate
+        print(f"[{self.name}] opened: {recording.prefix} ({recording.shape[0]} samples x {recording.shape[1]} channels"+
+              (f" at {self.rate} Hz)" if recording.rate is not None else "; set the sampling rate)"))
+
+    def set_speed(self, val):
+        try:
+            val = float(val)
+        except ValueError as e:
+            raise ValueError("failed to parse: '{0}'".format(val)) from e
+        if val < 0:
+            raise ValueError("Speed must be >=0")
+        self._speed = val
+
+    def arm_signature(self):
+        return super().arm_signature() + (self._path,)
+
+    def prepare(self):
+        if self._recording is None:
+            raise RuntimeError(f"{self.name}: no recording has been selected")
+        signature = self.arm_signature()
+        if (self._timer is not None) and (signature == self._armed):
+            return
+        self.disarm()
+        names         = list(self._channels.keys())
+        self._columns = np.array([i for i, name in enumerate(names) if self._channels[name].inuse == True], dtype=int)
+        self._reader  = self._recording.reader()
+        self._timer   = QtCore.QTimer(parent=self)
+        self._timer.timeout.connect(self._fire_data_available)
+        self._armed   = signature
+
+    def start(self):
+        self._reader.rewind()
+        self._sent     = 0
+        self._ended    = False
+        self._started  = time.perf_counter()
+        self._stopped  = None
+        self._inflight = []
+        self._waits    = 0
+        # paced chunks are due on every timeout; 'as fast as possible' returns to the event loop between chunks
+        self._timer.setInterval(0 if self._speed == 0 else max(int(self.interval*1000/(self.rate*self._speed))//2, 1))
+        self._timer.start()
+
+    def _fire_data_available(self):
+        if self._speed == 0:
+            self._inflight = [ref for ref in self._inflight if ref() is not None]
+            if len(self._inflight) < self._maxinflight:
+                self._timer.setInterval(0)
+                self._emit_chunk()
+            else:
+                # waits for the consumers without spinning the acquisition thread
+                self._waits += 1
+                self._timer.setInterval(1)
+            return
+        due = (time.perf_counter() - self._started)*self.rate*self._speed
+        while (self._ended == False) and (self._sent + self.interval <= due):
+            self._emit_chunk()
+
+    def _emit_chunk(self):
+        arrival = time.perf_counter()*1000
+        data = self._reader.read(self.interval)
+        if (data.shape[0] < self.interval) and (self._loop == True):
+            self._reader.rewind()
+            data = np.concatenate([data, self._reader.read(self.interval - data.shape[0])], axis=0)
+        if data.shape[0] == 0:
+            if self._ended == False:
+                print(f"[{self.name}] reached the end of the recording")
+            self._ended   = True
+            self._stopped = time.perf_counter()
+            self._timer.stop()
+            return
+        self._sent += data.shape[0]
+        # the chunk would have been acquired when its last sample was due
+        self._arrival = arrival if self._speed == 0 else (self._started + self._sent/(self.rate*self._speed))*1000
+        data = np.ascontiguousarray(data[:, self._columns], dtype=float)
+        if self._recording.quantization is not None:
+            data *= self._recording.quantization[self._columns]
+        self._inflight.append(weakref.ref(data))
+        self.dataAvailable.emit(data)
+
+    def stop(self):
+        self._timer.stop()
+        elapsed = (time.perf_counter() if self._stopped is None else self._stopped) - self._started
+        if elapsed > 0:
+            print(f"[{self.name}] replayed {self._sent} samples at {self._sent/(self.rate*elapsed):.2f}x real time")
+        if self._speed == 0:
+            # the figure above includes the chunks that the consumers had yet to release
+            inflight = sum(1 for ref in self._inflight if ref() is not None)
+            print(f"[{self.name}] {inflight} chunks were in flight upon stop; "+
+                  f"waited {self._waits} times for the consumers (at most {self._maxinflight} chunks in flight)")
+        self._inflight = []
+
+    def disarm(self):
+        if self._timer is not None:
+            self._timer.deleteLater()
+        if self._reader is not None:
+            self._reader.close()
+        self._timer  = None
+        self._reader = None
+        self._armed  = None
@@ -0,0 +1,120 @@
+
+import os
+import ctypes, ctypes.util
+
+##
+## Real-time scheduling, CPU affinity and memory locking of the worker threads
+##
+## the settings are given per 'stage' (e.g. 'device', 'storage', 'gui') in config.json:
+##
+##   "scheduling": {
+##       "device":  {"policy": "fifo", "priority": 80, "cpus": [2], "mlock": true},
+##       "storage": {"policy": "rr",   "priority": 60, "cpus": [3]},
+##       "gui":     {"cpus": [0, 1]}
+##   }
+##
+## apply() is called from within the thread of each stage, and only affects that thread
+## (except for memory locking, which is process-wide). Failures are reported, not raised.
+## a new thread inherits the policy and the CPUs of the thread that starts it: apply() restores
+## those of the process (as they were upon setup()) where the stage does not give its own.
+##
+
+POLICIES = {}
+for _name, _attr in (('other', 'SCHED_OTHER'), ('batch', 'SCHED_BATCH'),
+                     ('idle', 'SCHED_IDLE'), ('fifo', 'SCHED_FIFO'), ('rr', 'SCHED_RR')):
+    if hasattr(os, _attr):
+        POLICIES[_name] = getattr(os, _attr)
+
+# from <sys/mman.h> on Linux
+MCL_CURRENT = 1
+MCL_FUTURE  = 2
+
+Stages = {}
+_defaults = None # the (policy, priority, CPUs) of the process before any stage is applied
+_memory_locked = False
+
+def setup(cfg):
+    global Stages, _defaults
+    Stages    = dict(cfg.get('scheduling', {}))
+    _defaults = _current()
+
+def _current():
+    """the (policy, priority, CPUs) of the calling thread, or None if they are not available."""
+    if not (hasattr(os, 'sched_getscheduler') and hasattr(os, 'sched_getaffinity')):
+        return None
+    try:
+        return (os.sched_getscheduler(0), os.sched_getparam(0).sched_priority, os.sched_getaffinity(0))
+    except OSError:
+        return None
+
+def _report(stage, msg):
+    print(f"***Scheduling[{stage}]: {msg}")
+
+def apply(stage):
+    """applies the settings for `stage` to the calling thread."""
+    if len(Stages) == 0:
+        return
+    settings = Stages.get(stage, {})
+    policy   = settings.get('policy', None)
+    priority = int(settings.get('priority', 0))
+    cpus     = settings.get('cpus', None)
+    restore_defaults(stage, policy is None, (cpus is None) or (len(cpus) == 0))
+
+    if policy is not None:
+        if policy not in POLICIES.keys():
+            _report(stage, f"scheduling policy '{policy}' is not available on this platform")
+        else:
+            try:
+                if policy not in ('fifo', 'rr'):
+                    priority = 0
+                os.sched_setscheduler(0, POLICIES[policy], os.sched_param(priority))
+                print(f"[Scheduling] {stage}: policy '{policy}' (priority {priority})")
+            except (OSError, ValueError) as e:
+                _report(stage, f"could not set policy '{policy}' (priority {priority}): {e}")
+
+    if (cpus is not None) and (len(cpus) > 0):
+        if not hasattr(os, 'sched_setaffinity'):
+            _report(stage, "CPU affinity is not available on this platform")
+        else:
+            try:
+                os.sched_setaffinity(0, [int(c) for c in cpus])
+                print(f"[Scheduling] {stage}: pinned to CPU(s) {sorted(os.sched_getaffinity(0))}")
+            except (OSError, ValueError) as e:
+                _report(stage, f"could not pin to CPU(s) {cpus}: {e}")
+
+    if bool(settings.get('mlock', False)) == True:
+        lock_memory(stage)
+
+def restore_defaults(stage, policy=True, cpus=True):
+    """restores the policy and/or the CPUs of the process (see setup()) in the calling thread,
+    in case it has inherited those of another stage."""
+    current = _current()
+    if (_defaults is None) or (current is None):
+        return
+    try:
+        if (policy == True) and (current[:2] != _defaults[:2]):
+            os.sched_setscheduler(0, _defaults[0], os.sched_param(_defaults[1]))
+        if (cpus == True) and (current[2] != _defaults[2]):
+            os.sched_setaffinity(0, _defaults[2])
+    except (OSError, ValueError) as e:
+        _report(stage, f"could not restore the settings of the process: {e}")
+
+def lock_memory(stage):
+    """locks the current and future pages of the process in RAM (once per process)."""
+    global _memory_locked
+    if _memory_locked == True:
+        return
+    libname = ctypes.util.find_library('c')
+    if (os.name != 'posix') or (libname is None):
+        _report(stage, "memory locking is not available on this platform")
+        return
+    libc = ctypes.CDLL(libname, use_errno=True)
+    if not hasattr(libc, 'mlockall'):
+        _report(stage, "memory locking is not available on this platform")
+        return
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        _report(stage, f"could not lock memory: {os.strerror(errno)} (check RLIMIT_MEMLOCK)")
+    else:
+        _memory_locked = True
+        print(f"[Scheduling] {stage}: locked the process memory")
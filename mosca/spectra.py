@@ -0,0 +1,230 @@
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui, QtCore
+
+##
+## Live spectrum and spectrogram
+##
+## SpectrumAnalyzer only copies the incoming chunks into a preallocated buffer;
+## the FFTs are computed on a timer (`refresh` msec), for at most `maxsegments`
+## segments per refresh, so that the CPU cost is bounded regardless of the sampling rate.
+## the spectra and the powers are computed into preallocated buffers as well
+## (numpy >= 2.0 is required for np.fft.rfft() to take `out`; older versions allocate the spectra).
+##
+
+DEFAULT_NFFT        = 1024
+DEFAULT_OVERLAP     = 0.5
+DEFAULT_ALPHA       = 0.2   # weight of the newest batch in the exponential average
+DEFAULT_SEGMENTS    = 8     # the maximum number of segments per refresh
+DEFAULT_HISTORY     = 200   # the number of refreshes shown in the spectrogram
+DEFAULT_REFRESH     = 100   # in msec
+
+def _rfft_takes_out():
+    try:
+        np.fft.rfft(np.zeros((2,)), out=np.empty((2,), dtype=complex))
+        return True
+    except TypeError:
+        return False
+
+RFFT_OUT = _rfft_takes_out()
+
+def _shift(buf, start, stop):
+    """moves the rows [start, stop) of `buf` to its beginning, in blocks that do not
+    overlap (an overlapping assignment would allocate a temporary copy)."""
+    for dst in range(0, stop - start, start):
+        count = min(start, stop - start - dst)
+        buf[dst:dst + count] = buf[start + dst:start + dst + count]
+
+class SpectrumAnalyzer:
+    """incremental Welch estimate of the power spectral densities of all the channels.
+
+    every call to process() takes the latest (up to `maxsegments`) windowed segments
+    of `nfft` samples, computes their rfft's for all the channels at once, and updates
+    the exponentially-averaged PSD (in unit^2/Hz) and the spectrogram of channel `channel`.
+    the samples that could not be processed in time are skipped (and counted)."""
+
+    def __init__(self, nchan, rate, nfft=DEFAULT_NFFT, overlap=DEFAULT_OVERLAP,
+                    alpha=DEFAULT_ALPHA, maxsegments=DEFAULT_SEGMENTS, history=DEFAULT_HISTORY):
+        self.nchan       = nchan
+        self.rate        = rate
+        self.nfft        = nfft
+        self.hop         = max(int(nfft*(1 - overlap)), 1)
+        self.alpha       = alpha
+        self.maxsegments = maxsegments
+        self.channel     = 0
+        self.skipped     = 0 # number of samples that have not been analyzed
+        self.freqs       = np.fft.rfftfreq(nfft, 1/rate)
+
+        window           = np.hanning(nfft)
+        self._window     = window.reshape((1,1,-1))
+        self._norm       = np.full((1, len(self.freqs)), 2/(rate*(window**2).sum()))
+        self._norm[0,0]  = self._norm[0,0]/2
+        if nfft % 2 == 0:
+            self._norm[0,-1] = self._norm[0,-1]/2
+        self._pending    = np.zeros((nfft + (maxsegments - 1)*self.hop, nchan), dtype=float)
+        # channels x samples, so that the FFTs run along contiguous rows
+        self._segments   = np.empty((maxsegments, nchan, nfft), dtype=float)
+        self._spectra    = np.empty((maxsegments, nchan, len(self.freqs)), dtype=complex)
+        self._power      = np.empty((maxsegments, nchan, len(self.freqs)), dtype=float)
+        self._batch      = np.empty((nchan, len(self.freqs)), dtype=float)
+        self.psd         = np.zeros((len(self.freqs), nchan), dtype=float)
+        self.history     = history
+        # every row is written twice, so that the latest `history` rows are always contiguous
+        self._sgrows     = np.zeros((2*history, len(self.freqs)), dtype=float)
+        self._sgnext     = 0
+        self.reset()
+
+    def reset(self):
+        """discards the pending samples and the averages (but keeps the buffers)."""
+        self.skipped        = 0
+        self._filled        = 0
+        self._started       = False
+        self.psd[:]         = 0
+        self._sgrows[:]     = 0
+        self._sgnext        = 0
+
+    def feed(self, data):
+        """stores the (scaled) chunk until the next process()."""
+        capacity = self._pending.shape[0]
+        rows     = data.shape[0]
+        if rows >= capacity:
+            self.skipped += self._filled + rows - capacity
+            self._pending[:] = data[-capacity:]
+            self._filled = capacity
+            return
+        if self._filled + rows > capacity:
+            drop = self._filled + rows - capacity
+            self.skipped += drop
+            _shift(self._pending, drop, self._filled)
+            self._filled -= drop
+        self._pending[self._filled:self._filled + rows] = data
+        self._filled += rows
+
+    def process(self):
+        """analyzes the pending segments. returns False if there was not enough data."""
+        if self._filled < self.nfft:
+            return False
+        nseg = (self._filled - self.nfft)//self.hop + 1 # never exceeds maxsegments
+        segs = self._segments[:nseg]
+        rowstride, colstride = self._pending.strides
+        overlapping = as_strided(self._pending, shape=(nseg, self.nchan, self.nfft),
+                                    strides=(self.hop*rowstride, colstride, rowstride), writeable=False)
+        np.multiply(overlapping, self._window, out=segs)
+        if RFFT_OUT == True:
+            spectra = np.fft.rfft(segs, axis=-1, out=self._spectra[:nseg])
+        else:
+            spectra = np.fft.rfft(segs, axis=-1)
+        power = self._power[:nseg]                          # (segments x channels x freqs)
+        np.abs(spectra, out=power)
+        np.square(power, out=power)
+        np.mean(power, axis=0, out=self._batch)
+        self._batch *= self._norm
+        batch = self._batch.T                               # (freqs x channels)
+        if self._started == False:
+            self.psd[:]   = batch
+            self._started = True
+        else:
+            self.psd     *= (1 - self.alpha)
+            self.psd     += self.alpha*batch
+        row = self._sgrows[self._sgnext]
+        np.add(batch[:,self.channel], 1e-20, out=row)
+        np.log10(row, out=row)
+        row *= 10
+        self._sgrows[self._sgnext + self.history] = row
+        self._sgnext = (self._sgnext + 1) % self.history
+
+        consumed = nseg*self.hop
+        rest     = self._filled - consumed
+        _shift(self._pending, consumed, self._filled)
+        self._filled = rest
+        return True
+
+    @property
+    def spectrogram(self):
+        """the latest `history` rows (in dB), the oldest first (a view of the buffer)."""
+        return self._sgrows[self._sgnext:self._sgnext + self.history]
+
+class SpectrumView(QtGui.QWidget):
+    """a window with the averaged PSDs of the displayed channels (top),
+    and the spectrogram of one of them (bottom)."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Mosca spectrum")
+        self.resize(800,600)
+        self.analyzer = None
+        self._layout  = QtGui.QVBoxLayout(self)
+        self.selector = QtGui.QComboBox()
+        self.selector.currentIndexChanged.connect(self.set_channel)
+        tools = QtGui.QHBoxLayout()
+        tools.addWidget(QtGui.QLabel("Spectrogram:"))
+        tools.addWidget(self.selector)
+        tools.addStretch(1)
+        self._layout.addLayout(tools)
+
+        self.plots = pg.GraphicsLayoutWidget(border=(255,255,255))
+        self.psdplot = self.plots.addPlot(row=0, col=0)
+        self.psdplot.setLogMode(y=True)
+        self.psdplot.setLabel('bottom', text='Frequency', units='Hz')
+        self.psdplot.setLabel('left', text='PSD (unit²/Hz)')
+        self.psdplot.addLegend()
+        self.sgplot  = self.plots.addPlot(row=1, col=0)
+        self.sgplot.setLabel('bottom', text='Frequency', units='Hz')
+        self.sgplot.setLabel('left', text='Refresh')
+        self.image   = pg.ImageItem()
+        self.sgplot.addItem(self.image)
+        self._layout.addWidget(self.plots)
+        self.curves  = []
+
+        self.timer = QtCore.QTimer(parent=self)
+        self.timer.setInterval(DEFAULT_REFRESH)
+        self.timer.timeout.connect(self.refresh)
+
+    def prepare(self, channels, rate, scales):
+        """(re)builds the analyzer and the curves for `channels` (a list of channel models)."""
+        self.scales   = scales
+        if (self.analyzer is not None) and (self.analyzer.nchan == len(channels)) and (self.analyzer.rate == rate):
+            self.analyzer.reset()
+        else:
+            self.analyzer = SpectrumAnalyzer(len(channels), rate)
+        for curve in self.curves:
+            self.psdplot.removeItem(curve)
+        self.psdplot.legend.clear()
+        self.curves = []
+        names       = []
+        for i, ch in enumerate(channels):
+            names.append(ch.label if len(ch.label.strip()) > 0 else ch.name)
+            self.curves.append(self.psdplot.plot(pen=pg.intColor(i, hues=max(len(channels), 1)), name=names[-1]))
+        # the spectrogram keeps its channel (if any), and the selector shows the same one
+        channel = self.analyzer.channel if self.analyzer.channel < len(names) else 0
+        self.selector.blockSignals(True)
+        self.selector.clear()
+        self.selector.addItems(names)
+        self.selector.setCurrentIndex(channel)
+        self.selector.blockSignals(False)
+        self.analyzer.channel = channel
+        df = self.analyzer.freqs[1]
+        self.image.setImage(self.analyzer.spectrogram.T, levels=(-1, 0))
+        self.image.setRect(QtCore.QRectF(0, 0, df*len(self.analyzer.freqs), self.analyzer.spectrogram.shape[0]))
+        self.timer.start()
+
+    def feed(self, data):
+        self.analyzer.feed(data*self.scales)
+
+    def set_channel(self, index):
+        if (self.analyzer is not None) and (index >= 0):
+            self.analyzer.channel = index
+
+    def refresh(self):
+        if self.analyzer.process() == False:
+            return
+        for i, curve in enumerate(self.curves):
+            curve.setData(self.analyzer.freqs[1:], self.analyzer.psd[1:,i])
+        self.image.setImage(self.analyzer.spectrogram.T, autoLevels=True)
+
+    def finalize(self):
+        self.timer.stop()
+        if self.analyzer.skipped > 0:
+            print(f"[Spectrum] skipped {self.analyzer.skipped} samples to keep up")
@@ -1,15 +1,18 @@
 
 from pyqtgraph.Qt import QtGui, QtCore
 from . import models
+from .lib import corelib
 
 StateManager = None
 
 class DefaultAcquisitionStateManager(QtCore.QObject):
-    """a class used for the device manager to wait for view/storage managers."""
+    """a class used for the device manager to wait for view/storage managers.
+
+    donePlotting/doneStorage are corelib.Event's: use set(), clear() and wait(timeout_msec)."""
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.donePlotting = models.SynchronizedState(parent=self)
-        self.doneStorage  = models.SynchronizedState(parent=self)
+        self.donePlotting = corelib.Event()
+        self.doneStorage  = corelib.Event()
 
 def setup(cfg):
     global StateManager
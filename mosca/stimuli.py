@@ -0,0 +1,160 @@
+
+import numpy as np
+
+##
+## Stimulus waveforms for the analog outputs
+##
+## a Stimulus is a list of segments per output channel, e.g. in config.json:
+##
+##   "stimulus": {"enabled": true, "repeat": true, "channels": [
+##       [{"type": "hold",  "duration": 100.0, "level": 0.0},
+##        {"type": "pulse", "duration": 900.0, "amplitude": 5.0, "width": 1.0, "period": 100.0}],
+##       [{"type": "sine",  "duration": 1000.0, "amplitude": 1.0, "frequency": 10.0}]
+##   ]}
+##
+## (the durations are in msec, and the levels in volts). the stimulus is attached to the
+## device driver from the next start on (see BaseDeviceDriver.attach_stimulus()):
+## it is rendered once into a (samples x channels) period, which the driver streams
+## block by block, sample-locked to the acquisition (and repeated if `repeat` is true).
+##
+
+Current = None # the Stimulus to be played during the acquisitions (if any)
+
+def _samples(duration, rate):
+    return max(int(round(duration*rate/1000)), 0)
+
+class Hold:
+    def __init__(self, duration, level=0.0):
+        self.duration = float(duration)
+        self.level    = float(level)
+
+    def render(self, rate):
+        return np.full((_samples(self.duration, rate),), self.level)
+
+class Ramp:
+    def __init__(self, duration, start=0.0, stop=1.0):
+        self.duration = float(duration)
+        self.start    = float(start)
+        self.stop     = float(stop)
+
+    def render(self, rate):
+        n = _samples(self.duration, rate)
+        return self.start + (self.stop - self.start)*np.arange(n)/max(n, 1)
+
+class Pulse:
+    """a train of rectangular pulses of `width` msec every `period` msec, from the start of the segment."""
+
+    def __init__(self, duration, amplitude=1.0, width=1.0, period=None, baseline=0.0):
+        self.duration  = float(duration)
+        self.amplitude = float(amplitude)
+        self.width     = float(width)
+        self.period    = float(period) if period is not None else self.duration
+        self.baseline  = float(baseline)
+
+    def render(self, rate):
+        n      = _samples(self.duration, rate)
+        period = max(_samples(self.period, rate), 1)
+        width  = _samples(self.width, rate)
+        return np.where((np.arange(n) % period) < width, self.baseline + self.amplitude, self.baseline)
+
+class Sine:
+    def __init__(self, duration, amplitude=1.0, frequency=1.0, phase=0.0, offset=0.0):
+        self.duration  = float(duration)
+        self.amplitude = float(amplitude)
+        self.frequency = float(frequency)
+        self.phase     = float(phase) # in degrees
+        self.offset    = float(offset)
+
+    def render(self, rate):
+        t = np.arange(_samples(self.duration, rate))/rate
+        return self.offset + self.amplitude*np.sin(2*np.pi*self.frequency*t + np.deg2rad(self.phase))
+
+class FromFile:
+    """a waveform from a .npy file, sampled at the acquisition rate (a column of a 2-D array)."""
+
+    def __init__(self, path, column=0, scale=1.0):
+        self.path   = path
+        self.column = int(column)
+        self.scale  = float(scale)
+
+    def render(self, rate):
+        data = np.load(self.path, mmap_mode='r')
+        if data.ndim > 1:
+            data = data[:, self.column]
+        return np.asarray(data, dtype=float)*self.scale
+
+SEGMENTS = dict(hold=Hold, ramp=Ramp, pulse=Pulse, sine=Sine, file=FromFile)
+
+def segment(spec):
+    """creates a segment from its specification, e.g. {"type": "ramp", "duration": 100.0, "stop": 5.0}."""
+    spec = dict(spec)
+    typ  = spec.pop('type')
+    if typ not in SEGMENTS.keys():
+        raise ValueError(f"unknown stimulus segment type: '{typ}'")
+    return SEGMENTS[typ](**spec)
+
+class Stimulus:
+    def __init__(self, channels, repeat=True):
+        """`channels` is a list of segment lists (one per output channel)."""
+        if len(channels) == 0:
+            raise ValueError("a stimulus needs at least one channel")
+        self.channels = channels
+        self.repeat   = bool(repeat)
+
+    @classmethod
+    def from_config(cls, opts):
+        return cls([[segment(spec) for spec in segments] for segments in opts['channels']],
+                    repeat=opts.get('repeat', True))
+
+    def __getattr__(self, name):
+        if name == 'nchan':
+            return len(self.channels)
+        else:
+            raise AttributeError(name)
+
+    def render(self, rate):
+        """returns one period of the stimulus as a (samples x channels) array.
+        the shorter channels hold their last value until the end of the period."""
+        waves  = [np.concatenate([seg.render(rate) for seg in segments] + [np.zeros((0,))])
+                    for segments in self.channels]
+        length = max(max(wave.shape[0] for wave in waves), 1)
+        period = np.zeros((length, len(waves)), dtype=float)
+        for i, wave in enumerate(waves):
+            period[:wave.shape[0], i] = wave
+            if 0 < wave.shape[0] < length:
+                period[wave.shape[0]:, i] = wave[-1]
+        return period
+
+class StimulusGenerator:
+    """streams the period of a Stimulus in blocks of `blocksize` samples.
+
+    the blocks are taken from the period with one vectorized indexing, into two
+    alternating (preallocated) buffers: a block stays valid while the next one is generated.
+    after the end of a non-repeated stimulus, the last values are held."""
+
+    def __init__(self, stimulus, rate, blocksize):
+        self.period    = stimulus.render(rate)
+        self.repeat    = stimulus.repeat
+        self.position  = 0 # the number of samples generated so far
+        self._offsets  = np.arange(blocksize)
+        self._buffers  = (np.empty((blocksize, self.period.shape[1])),
+                          np.empty((blocksize, self.period.shape[1])))
+        self._next     = 0
+
+    def next_block(self):
+        index = self.position + self._offsets
+        if self.repeat == True:
+            index %= self.period.shape[0]
+        else:
+            np.minimum(index, self.period.shape[0] - 1, out=index)
+        block = self._buffers[self._next]
+        np.take(self.period, index, axis=0, out=block)
+        self._next     = 1 - self._next
+        self.position += block.shape[0]
+        return block
+
+def setup(cfg):
+    global Current
+    opts = cfg.get('stimulus', {})
+    if bool(opts.get('enabled', False)) == True:
+        Current = Stimulus.from_config(opts)
@@ -1,5 +1,5 @@
 
-import sys, os, pprint, struct, json, zlib
+import sys, os, math, pprint, struct, json, zlib
 from collections import OrderedDict
 import numpy as np
 from pyqtgraph.Qt import QtGui, QtCore
@@ -8,6 +8,7 @@ from . import utils
 from . import states
 from . import devices
 from . import param
+from . import catalog
 from .utils import validate_integer
 
 ##
@@ -16,52 +17,52 @@ from .utils import validate_integer
 
 BASETYPE = np.dtype('float')
 
+DEFAULT_BUFFER_SECONDS  = 10 # how long the native writer can lag behind the acquisition
+DEFAULT_POLL_MSEC       = 200
+
 StorageManager = None
 
 def gen_config(nsamples, dtype="float64", byteorder='little'):
-    """utility function that generates a dict object that contains channels and data shape info."""
-    channels = OrderedDict()
-    size     = 0
-    for name, ch in devices.DeviceManager.current.channels.items():
-        if ch.inuse == True:
-            channels[name] = ch
-            size += 1
-    info = OrderedDict()
-    info['channels'] = []
-    for i, item in enumerate(channels.items()):
-        name, ch = item
-        chinfo = OrderedDict()
-        chinfo['id']     = i
-        chinfo['name']   = ch.label if len(ch.label) > 0 else ch.name
-        chinfo['unit']   = ch.unit
-        chinfo['range']  = ch.range
-        chinfo['source'] = ch.name
-        info['channels'].append(chinfo)
-    info['data'] = OrderedDict()
-    info['data']['datatype']  = dtype
-    info['data']['byteorder'] = byteorder
-    info['data']['shape']     = (nsamples, size)
-    return info
+    """utility function that generates a dict object that contains channels and data shape info
+    (of the plan of the current acquisition)."""
+    return devices.DeviceManager.plan.config(nsamples, dtype=dtype, byteorder=byteorder)
 
 class IODriverManager(models.BaseDriverManager):
+    # emitted with the path prefix of the recording ('' if not saved) and a dict, right before
+    # the storage is finalized. receivers (e.g. events.EventManager) may write their sidecar files
+    # and add their entries to the dict, which are then included in the .cfg file.
+    closing = QtCore.pyqtSignal(str, object)
+
     def prepare(self, save=True):
         if (save == True) and (self.current is not None):
+            if self.current.autoinc == True:
+                # skips the acquisitions of the earlier sessions (see catalog.next_acqno())
+                self.current.acqno = catalog.next_acqno(self.current.directory, self.current.basename, self.current.acqno)
             self.current.prepare()
         self.saved = save
-        with states.StateManager.doneStorage as evt:
-            evt.reset()
+        states.StateManager.doneStorage.clear()
 
     def finalize(self):
+        sidecars = OrderedDict()
+        prefix   = self.current.path_prefix() if self.saved == True else ""
+        self.closing.emit(prefix, sidecars)
         if self.saved == True:
+            self.current.sidecars = sidecars
             self.current.finalize()
+            catalog.register(prefix)
         del self.saved
-        with states.StateManager.doneStorage as evt:
-            evt.set()
+        states.StateManager.doneStorage.set()
 
 class BaseIODriver(models.DriverInterface):
     """Defines basic behaviors as an I/O driver."""
     acqno_changed = QtCore.pyqtSignal()
 
+    directory = param.Parameter('Directory', mode='dir')
+    basename  = param.Parameter('Basename', mode='str')
+    acqno     = param.Parameter('Acquisition number', mode='int', signal='acqno_changed',
+                    convert=lambda self, val: validate_integer(val, (-sys.maxsize, sys.maxsize), 'acquisition number'))
+    autoinc   = param.Parameter('Auto-increment', mode='bool')
+
     def __init__(self, name, parent=None):
         super().__init__(parent)
         self.name       = name
@@ -69,24 +70,9 @@ class BaseIODriver(models.DriverInterface):
         self._basename  = 'wave'
         self._acqno     = 1
         self._autoinc   = True
-        self._configs   = []
-        self._configs.append(param.ParameterController(label='Directory',
-                                                        mode='dir',
-                                                        getter=self.get_directory,
-                                                        setter=self.set_directory))
-        self._configs.append(param.ParameterController(label='Basename',
-                                                        mode='str',
-                                                        getter=self.get_basename,
-                                                        setter=self.set_basename))
-        self._configs.append(param.ParameterController(label='Acquisition number',
-                                                        mode='int',
-                                                        getter=self.get_acqno,
-                                                        setter=self.set_acqno,
-                                                        signal=self.acqno_changed))
-        self._configs.append(param.ParameterController(label='Auto-increment',
-                                                        mode='bool',
-                                                        getter=self.get_autoinc,
-                                                        setter=self.set_autoinc))
+        self.sidecars   = OrderedDict() # additional entries for the .cfg file
+        self._configs   = [] # the ParameterControllers other than the declared ones
+        self._controllers = None
 
     def prepare(self):
         """prepares for the next acquisition."""
@@ -103,66 +89,24 @@ class BaseIODriver(models.DriverInterface):
     def generate_configfile(self, info):
         """generates a JSON file containing information about channels and data shape.
         `info` as it can be generated by `gen_config()`."""
-        filename = os.path.join(self.directory, "{0}_{1:03d}.cfg".format(self.basename, self.acqno))
+        filename = self.path_prefix() + ".cfg"
+        info.update(self.sidecars)
         with open(filename, 'w') as output:
             json.dump(info, output, indent=4)
         print(f"[{self.name}] generated a config file: {filename}")
 
-    def __getattr__(self, name):
-        if name == 'directory':
-            return self.get_directory()
-        elif name == 'basename':
-            return self.get_basename()
-        elif name == 'acqno':
-            return self.get_acqno()
-        elif name == 'autoinc':
-            return self.get_autoinc()
-        else:
-            raise AttributeError(name)
-
-    def __setattr__(self, name, val):
-        if name == 'directory':
-            return self.set_directory(val)
-        elif name == 'basename':
-            return self.set_basename(val)
-        elif name == 'acqno':
-            return self.set_acqno(val)
-        elif name == 'autoinc':
-            return self.set_autoinc(val)
-        else:
-            super().__setattr__(name, val)
-
-    def get_directory(self):
-        return self._directory
-
-    def get_basename(self):
-        return self._basename
-
-    def get_acqno(self):
-        return self._acqno
-
-    def get_autoinc(self):
-        return self._autoinc
-
-    def set_directory(self, val):
-        self._directory = val
-
-    def set_basename(self, val):
-        self._basename = val
-
-    def set_acqno(self, val):
-        self._acqno = validate_integer(val, (-sys.maxsize, sys.maxsize), 'acquisition number')
-        self.acqno_changed.emit()
-
-    def set_autoinc(self, val):
-        self._autoinc = val
+    def path_prefix(self):
+        """the common part of the paths of the files for the current acquisition."""
+        return os.path.join(self.directory, "{0}_{1:03d}".format(self.basename, self.acqno))
 
     def configs(self):
-        return self._configs
+        if self._controllers is None:
+            self._controllers = param.controllers(self)
+        return self._controllers + self._configs
 
     def update_acqno(self):
         if self._autoinc == True:
-            self.acqno += 1
+            self.acqno = catalog.next_acqno(self.directory, self.basename, self.acqno + 1)
 
 class BareZLibDriver(BaseIODriver):
     """saves data in a bare array, through the Zlib-based compression."""
@@ -171,16 +115,12 @@ class BareZLibDriver(BaseIODriver):
         super().__init__("Bare-zlib(beta)", parent=parent)
 
     def prepare(self):
-        # FIXME: FROM HERE: in most cases the code is common with NumpyIODriver
         devices.DeviceManager.current.dataAvailable.connect(self.update)
         utils.ensure_directory(self.directory)
-        self._nchan = len([ch for ch in devices.DeviceManager.current.channels.values() if ch.inuse == True])
-        # self._info = dict(descr=BASETYPE.descr[0][1], fortran_order=False,
-        #     shape=(sys.maxsize, self._nchan))
-        self._size = 0
-        self._scales = tuple(ch.scale for ch in devices.DeviceManager.current.channels.values() if ch.inuse == True)
-        self._scales = np.array(self._scales).reshape((1,-1))
-        # FIXME: TO HERE: code overlap
+        plan = devices.DeviceManager.plan
+        self._nchan  = plan.nchan
+        self._size   = 0
+        self._scales = plan.scales
 
         self._zlib   = zlib.compressobj(level=1)
 
@@ -189,14 +129,12 @@ class BareZLibDriver(BaseIODriver):
             "{0}_{1:03d}.zdat".format(self.basename, self.acqno)), 'wb')
 
     def update(self, data):
-        # FIXME: the 2 lines below is exactly the same as in NumpyIODriver
         data = np.array(data, dtype=BASETYPE)*(self._scales)
         self._size += data.shape[0]
 
         self._target.write(self._zlib.compress( bytes(data.reshape((-1,), order='C') )))
 
     def finalize(self):
-        # FIXME: the 2 lines below is exactly the same as in NumpyIODriver
         self.generate_configfile(gen_config(self._size))
         devices.DeviceManager.current.dataAvailable.disconnect(self.update)
 
@@ -206,63 +144,171 @@ class BareZLibDriver(BaseIODriver):
         self.update_acqno()
 
 
-class NumpyIODriver(BaseIODriver):
-    """For saving the acquired data in the numpy NPY format.
+class NpyTarget:
+    """a .npy file whose number of rows is not known in advance: the header is written
+    with a placeholder shape, and write_shape() overwrites it with the actual shape.
 
     for specification, please refer to: https://docs.scipy.org/doc/numpy/neps/npy-format.html"""
 
     _magic      = b'\x93NUMPY'
     _version    = b'\x01\x00'
 
-    def __init__(self, parent=None):
-        super().__init__('NumPy Binary', parent=parent)
-
-    def prepare(self):
-        devices.DeviceManager.current.dataAvailable.connect(self.update)
-        utils.ensure_directory(self.directory)
-        self._nchan = len([ch for ch in devices.DeviceManager.current.channels.values() if ch.inuse == True])
-        self._info = dict(descr=BASETYPE.descr[0][1], fortran_order=False,
-            shape=(sys.maxsize, self._nchan))
-        self._size = 0
-        self._scales = tuple(ch.scale for ch in devices.DeviceManager.current.channels.values() if ch.inuse == True)
-        self._scales = np.array(self._scales).reshape((1,-1))
+    def __init__(self, path, dtype, ncols):
+        self.path  = path
+        self.dtype = np.dtype(dtype)
+        self.rows  = 0
+        self._info = dict(descr=self.dtype.descr[0][1], fortran_order=False,
+            shape=(sys.maxsize, ncols))
 
         self._headeroffset = len(self._magic) + len(self._version) + 2
-        self._header = pprint.pformat(self._info).encode('utf-8')
-        headerlen = len(self._header) + 1
+        headerlen = len(pprint.pformat(self._info).encode('utf-8')) + 1
         chunklen = self._headeroffset + headerlen
         r = chunklen % 16
         self._headerlen = headerlen if r == 0 else headerlen + (16 - r)
 
         # TODO: ask if we can overwrite file
-        self._target = open(os.path.join(self.directory,
-            "{0}_{1:03d}.npy".format(self.basename, self.acqno)), 'wb')
-        self._target.write(self._magic)
-        self._target.write(self._version)
-        self._target.write(struct.pack('<H', self._headerlen))
-        self._target.write(self._header)
-        for i in range(self._headerlen - len(self._header) - 1):
-            self._target.write(b' ')
-        self._target.write(b'\n')
+        self.file = open(path, 'wb')
+        self.file.write(self._magic)
+        self.file.write(self._version)
+        self.file.write(struct.pack('<H', self._headerlen))
+        self._write_header()
+
+    def _write_header(self):
+        header = pprint.pformat(self._info).encode('utf-8')
+        self.file.write(header)
+        for i in range(self._headerlen - len(header) - 1):
+            self.file.write(b' ')
+        self.file.write(b'\n')
+
+    def write(self, data):
+        """appends the rows of `data` (converted to the dtype of the file)."""
+        self.file.write(np.ascontiguousarray(data, dtype=self.dtype).data)
+        self.rows += data.shape[0]
+
+    def write_shape(self, rows=None):
+        """overwrites the placeholder shape in the header of the (open) file
+        with `rows` (the rows written by default)."""
+        if rows is not None:
+            self.rows = rows
+        self._info['shape'] = (self.rows, self._info['shape'][1])
+        self.file.seek(self._headeroffset)
+        self._write_header()
+
+    def close(self, rows=None):
+        """writes the actual shape, and closes the file."""
+        self.write_shape(rows)
+        self.file.close()
+
+class NumpyIODriver(BaseIODriver):
+    """For saving the acquired data in the numpy NPY format (see NpyTarget)."""
+
+    def __init__(self, parent=None):
+        super().__init__('NumPy Binary', parent=parent)
+
+    def prepare(self):
+        devices.DeviceManager.current.dataAvailable.connect(self.update)
+        self._open_target()
+
+    def _path(self):
+        return os.path.join(self.directory, "{0}_{1:03d}.npy".format(self.basename, self.acqno))
+
+    def _open_target(self):
+        """opens the target file, and writes a header with a placeholder shape."""
+        utils.ensure_directory(self.directory)
+        plan = devices.DeviceManager.plan
+        self._nchan = plan.nchan
+        self._scales = plan.scales
+        self._target = NpyTarget(self._path(), plan.dtype, self._nchan)
 
     def update(self, data):
-        data = np.array(data, dtype=BASETYPE)*(self._scales)
-        self._target.write(bytes(data.reshape((-1,), order='C')))
-        self._size += data.shape[0]
+        self._target.write(np.array(data, dtype=BASETYPE)*(self._scales))
 
     def finalize(self):
         devices.DeviceManager.current.dataAvailable.disconnect(self.update)
-        self._info['shape'] = (self._size, self._nchan)
-        self._header = pprint.pformat(self._info).encode('utf-8')
-        self._target.seek(self._headeroffset)
-        self._target.write(self._header)
-        for i in range(self._headerlen - len(self._header) - 1):
-            self._target.write(b' ')
-        self._target.write(b'\n')
+        self._size = self._target.rows
         self._target.close()
         self.generate_configfile(gen_config(self._size))
         self.update_acqno()
 
+class NativeNumpyIODriver(NumpyIODriver):
+    """saves the data in the same format as NumpyIODriver, but the chunks are scaled
+    and written from a native thread (mosca.lib.nativeio.NativeWriter).
+
+    if the device driver supports attach_writer(), the chunks are handed to the writer
+    directly from the acquisition thread, and this driver only configures the writer
+    and reports the progress. otherwise, the writer is fed through dataAvailable."""
+
+    progress = QtCore.pyqtSignal(int) # number of rows written so far
+
+    def __init__(self, bufferseconds=DEFAULT_BUFFER_SECONDS, pollmsec=DEFAULT_POLL_MSEC, parent=None):
+        super().__init__(parent=parent)
+        self.name           = 'NumPy Binary (native)'
+        self.bufferseconds  = bufferseconds
+        self._writer        = None
+        self._timer         = QtCore.QTimer(parent=self)
+        self._timer.setInterval(pollmsec)
+        self._timer.timeout.connect(self.report_progress)
+
+    def prepare(self):
+        from .lib.nativeio import NativeWriter
+        device = devices.DeviceManager.current
+        self._open_target()
+        self._target.file.close() # the header is completed upon finalize()
+
+        slotrows     = max(int(device.interval), 1)
+        nslots       = int(math.ceil(self.bufferseconds * device.rate / slotrows))
+        self._writer = NativeWriter(self._path(), self._scales.ravel(), slotrows=slotrows, nslots=nslots)
+        self._direct = device.attach_writer(self._writer)
+        if self._direct == False:
+            device.dataAvailable.connect(self.update)
+        print(f"[{self.name}] writing {self._nchan} channels "+
+              ("from the acquisition thread" if self._direct == True else "through dataAvailable"))
+        self._timer.start()
+
+    def update(self, data):
+        self._writer.write(data)
+
+    def report_progress(self):
+        if self._writer is not None:
+            self.progress.emit(self._writer.rows)
+
+    def finalize(self):
+        self._timer.stop()
+        device = devices.DeviceManager.current
+        if self._direct == True:
+            device.detach_writer()
+        else:
+            device.dataAvailable.disconnect(self.update)
+        writer, self._writer = self._writer, None
+        try:
+            writer.close()
+        finally:
+            self._size = writer.rows
+            if writer.stalls > 0:
+                print(f"***{self.name}: the acquisition waited for the disk {writer.stalls} times")
+            self._target.file = open(self._target.path, 'r+b')
+            self._target.close(self._size)
+            self._target = None
+            self.progress.emit(self._size)
+            self.generate_configfile(gen_config(self._size))
+            self.update_acqno()
+
+class SidecarOnlyDriver(BaseIODriver):
+    """does not save the samples: only the sidecar files (e.g. the sweep average
+    of averaging.AverageManager) and the .cfg file that refers to them are written."""
+
+    def __init__(self, parent=None):
+        super().__init__('Sidecars only (no samples)', parent=parent)
+
+    def prepare(self):
+        utils.ensure_directory(self.directory)
+
+    def finalize(self):
+        info = gen_config(0)
+        del info['data']
+        self.generate_configfile(info)
+        self.update_acqno()
+
 def setup(cfg):
     global StorageManager
     StorageManager = IODriverManager("I/O")
@@ -0,0 +1,166 @@
+
+import os, json, socket, tempfile
+from pyqtgraph.Qt import QtCore
+from . import devices
+from . import transport
+
+##
+## Live data tap for the other local processes
+##
+## TapPublisher copies every chunk (in the unit of each channel) into a SampleRing,
+## and notifies the subscribers through a Unix-domain socket at `path`.
+## the messages are JSON objects, one per line:
+##
+##   {"type": "stream", "ring": <name>, "nchan": .., "rate": .., "channels": [..], "units": [..], "written": ..}
+##      -- upon every start (and upon connection during an acquisition): attach to the new ring
+##   {"type": "data", "written": <total rows>}
+##      -- after every chunk (dropped for the subscribers that do not keep up)
+##   {"type": "end", "written": <total rows>}
+##      -- when the acquisition has finished
+##
+## the subscribers read the ring with their own cursors (see mosca.tapclient),
+## so that a slow subscriber can only lose samples by itself, and never blocks the acquisition.
+##
+
+DEFAULT_RING_SECONDS = 10
+DEFAULT_BACKLOG      = 64 * 1024 # the maximum unsent bytes per subscriber before notifications are dropped
+
+TapManager = None
+
+def default_path():
+    return os.path.join(tempfile.gettempdir(), "mosca-tap.sock")
+
+class Subscription:
+    """the server side of a subscriber connection (non-blocking)."""
+
+    def __init__(self, conn):
+        self.conn    = conn
+        self.pending = b''
+        self.dropped = 0
+        conn.setblocking(False)
+
+    def send(self, message, droppable=False):
+        """returns False if the subscriber has gone."""
+        if self.flush() == False:
+            return False
+        if (droppable == True) and (len(self.pending) > DEFAULT_BACKLOG):
+            self.dropped += 1
+            return True
+        self.pending += (json.dumps(message) + "\n").encode('utf-8')
+        return self.flush()
+
+    def flush(self):
+        try:
+            while len(self.pending) > 0:
+                sent = self.conn.send(self.pending)
+                self.pending = self.pending[sent:]
+        except BlockingIOError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        self.conn.close()
+
+class TapPublisher(QtCore.QObject):
+    """publishes the acquired chunks to the subscribers (in its own thread)."""
+
+    def __init__(self, enabled=False, path='', ringseconds=DEFAULT_RING_SECONDS, parent=None):
+        super().__init__(parent)
+        self.name        = "Tap"
+        self.enabled     = enabled and hasattr(socket, 'AF_UNIX')
+        self.path        = path if len(path) > 0 else default_path()
+        self.ringseconds = ringseconds
+        self.ring        = None
+        self._server     = None
+        self._notifier   = None
+        self._subscribers = []
+        if (enabled == True) and (self.enabled == False):
+            print(f"***{self.name}: Unix-domain sockets are not available on this platform")
+
+    def listen(self):
+        """starts accepting the subscribers (upon QThread.started of the thread of the publisher)."""
+        if (self.enabled == False) or (self._server is not None):
+            return
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._notifier = QtCore.QSocketNotifier(self._server.fileno(), QtCore.QSocketNotifier.Read, self)
+        self._notifier.activated.connect(self.accept)
+        print(f"[{self.name}] listening at: {self.path}")
+
+    def accept(self):
+        try:
+            conn, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        sub = Subscription(conn)
+        self._subscribers.append(sub)
+        if self.ring is not None:
+            self._send(sub, self._stream_message())
+
+    def _send(self, sub, message, droppable=False):
+        if sub.send(message, droppable=droppable) == False:
+            sub.close()
+            self._subscribers.remove(sub)
+
+    def _broadcast(self, message, droppable=False):
+        for sub in list(self._subscribers):
+            self._send(sub, message, droppable=droppable)
+
+    def _stream_message(self):
+        return dict(type='stream', ring=self.ring.name, nchan=self.ring.nchan, rate=self.rate,
+                    channels=self.names, units=self.units, written=self.ring.written)
+
+    def prepare(self, save=True):
+        if self._server is None:
+            return
+        driver      = devices.DeviceManager.current
+        plan        = devices.DeviceManager.plan
+        if plan.nchan == 0:
+            return
+        self.rate   = plan.rate
+        self.names  = list(plan.titles)
+        self.units  = list(plan.units)
+        self.scales = plan.scales
+        self.ring   = transport.SampleRing.create(self.ringseconds*self.rate, plan.nchan)
+        driver.dataAvailable.connect(self.update)
+        self._broadcast(self._stream_message())
+
+    def update(self, data):
+        self.ring.write(data*self.scales)
+        self._broadcast(dict(type='data', written=self.ring.written), droppable=True)
+
+    def finalize(self):
+        if self.ring is None:
+            return
+        devices.DeviceManager.current.dataAvailable.disconnect(self.update)
+        self.ring.mark_closed()
+        self._broadcast(dict(type='end', written=self.ring.written))
+        dropped = sum(sub.dropped for sub in self._subscribers)
+        if dropped > 0:
+            print(f"[{self.name}] dropped {dropped} notifications to slow subscribers")
+        for sub in self._subscribers:
+            sub.dropped = 0
+        # the subscribers keep their mappings of the ring after it is unlinked
+        self.ring.close()
+        self.ring = None
+
+    def shutdown(self):
+        """closes the connections (upon QThread.finished of the thread of the publisher)."""
+        for sub in self._subscribers:
+            sub.close()
+        self._subscribers = []
+        if self._server is not None:
+            self._notifier.setEnabled(False)
+            self._server.close()
+            self._server = None
+            os.unlink(self.path)
+
+def setup(cfg):
+    global TapManager
+    TapManager = TapPublisher(**cfg.get('tap', {}))
@@ -0,0 +1,103 @@
+
+import json, socket
+from . import transport
+from .tap import default_path
+
+##
+## Client of the live data tap (see mosca.tap)
+##
+## usage (from any local process):
+##
+##   from mosca.tapclient import TapSubscriber
+##   with TapSubscriber() as sub:
+##       while True:
+##           chunk = sub.read()       # a (rows x channels) view of the shared ring
+##           if chunk is None:        # the acquisition has finished
+##               continue             # (waits for the next one)
+##           process(chunk)
+##           if sub.intact() == False:  # the ring has been overwritten while processing
+##               ...
+##
+
+class TapSubscriber:
+    """reads the live samples published by mosca.tap.TapPublisher.
+
+    `channels`, `units` and `rate` describe the current stream, and `lost` counts
+    the samples that were overwritten before being read."""
+
+    def __init__(self, path=None, timeout=None):
+        self.path     = path if path is not None else default_path()
+        self._sock    = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+        self._sock.settimeout(timeout)
+        self._lines   = self._sock.makefile('rb')
+        self.ring     = None
+        self.reader   = None
+        self.channels = []
+        self.units    = []
+        self.rate     = None
+        self.ended    = True
+        self._lost    = 0 # lost on the previous rings
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        if name == 'lost':
+            return self._lost + (self.reader.lost if self.reader is not None else 0)
+        else:
+            raise AttributeError(name)
+
+    def _receive(self):
+        """handles the next message from the publisher. raises EOFError if the publisher has gone."""
+        line = self._lines.readline()
+        if len(line) == 0:
+            raise EOFError("the publisher has closed the connection")
+        message = json.loads(line)
+        if message['type'] == 'stream':
+            self._detach()
+            self.ring     = transport.SampleRing.attach(message['ring'], track=False)
+            self.reader   = self.ring.reader(latest=True)
+            self.channels = message['channels']
+            self.units    = message['units']
+            self.rate     = message['rate']
+            self.ended    = False
+        elif message['type'] == 'end':
+            self.ended    = True
+        return message
+
+    def read(self, maxrows=None):
+        """waits for new samples, and returns them as a (rows x channels) view of the ring.
+        returns None once (after the last samples) when the acquisition has finished."""
+        while True:
+            if self.reader is not None:
+                view = self.reader.view(maxrows)
+                if view is not None:
+                    return view
+                if self.ended == True:
+                    self._detach()
+                    return None
+            self._receive()
+
+    def intact(self):
+        """returns False if the rows of the last read() may have been overwritten since."""
+        return self.reader.intact()
+
+    def _detach(self):
+        if self.reader is not None:
+            self._lost += self.reader.lost
+        self.reader = None
+        if self.ring is not None:
+            try:
+                self.ring.close()
+            except BufferError:
+                pass # a view is still in use: the mapping is released with it
+            self.ring = None
+
+    def close(self):
+        self._detach()
+        self._lines.close()
+        self._sock.close()
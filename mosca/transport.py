@@ -0,0 +1,183 @@
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+##
+## Shared-memory sample transport
+##
+
+BASETYPE = np.dtype('float64')
+
+# layout of the int64 header in front of the sample region
+_CAPACITY   = 0
+_NCHAN      = 1
+_WRITTEN    = 2 # total number of rows ever written
+_CLOSED     = 3
+_HEADERSIZE = 8 # in int64's (leaves some room for future use)
+
+class SampleRing:
+    """a single-writer ring of multi-channel samples in shared memory.
+
+    the writer never blocks: it simply overwrites the oldest rows.
+    every reader (see RingReader) keeps its own cursor, and a reader that falls
+    behind by more than `capacity` rows skips to the oldest rows still available
+    (and counts the rows it has lost).
+
+    use SampleRing.create() in the owner process, and SampleRing.attach()
+    with the `name` of the ring from any other process.
+    """
+
+    def __init__(self, shm, owner=False):
+        self._shm    = shm
+        self._owner  = owner
+        self._header = np.ndarray((_HEADERSIZE,), dtype=np.int64, buffer=shm.buf)
+        self.capacity = int(self._header[_CAPACITY])
+        self.nchan    = int(self._header[_NCHAN])
+        self._data   = np.ndarray((self.capacity, self.nchan), dtype=BASETYPE,
+                                    buffer=shm.buf, offset=_HEADERSIZE*8)
+
+    @classmethod
+    def create(cls, capacity, nchan):
+        capacity = max(int(capacity), 1)
+        nchan    = max(int(nchan), 1)
+        size     = _HEADERSIZE*8 + capacity*nchan*BASETYPE.itemsize
+        shm      = shared_memory.SharedMemory(create=True, size=size)
+        header   = np.ndarray((_HEADERSIZE,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_CAPACITY] = capacity
+        header[_NCHAN]    = nchan
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, track=True):
+        """`track`=False keeps the ring from being unlinked when the (unrelated) attaching process exits."""
+        if track == True:
+            return cls(shared_memory.SharedMemory(name=name), owner=False)
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False) # python >= 3.13
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def __getattr__(self, name):
+        if name == 'name':
+            return self._shm.name
+        elif name == 'written':
+            return int(self._header[_WRITTEN])
+        elif name == 'closed':
+            return bool(self._header[_CLOSED])
+        else:
+            raise AttributeError(name)
+
+    def write(self, data):
+        """copies `data` (rows x nchan) into the ring. never blocks."""
+        data = np.asarray(data, dtype=BASETYPE)
+        rows = data.shape[0]
+        if rows == 0:
+            return
+        written = int(self._header[_WRITTEN])
+        if rows > self.capacity:
+            # only the latest rows can be kept anyway
+            written += rows - self.capacity
+            data     = data[-self.capacity:]
+            rows     = self.capacity
+        pos   = written % self.capacity
+        first = min(rows, self.capacity - pos)
+        self._data[pos:pos+first] = data[:first]
+        if first < rows:
+            self._data[:rows-first] = data[first:]
+        # publish the rows only after they have been copied
+        self._header[_WRITTEN] = written + rows
+
+    def mark_closed(self):
+        """notifies the readers that no more data will be written."""
+        self._header[_CLOSED] = 1
+
+    def reader(self, latest=True):
+        """returns a new RingReader that starts from the latest (or the oldest available) row."""
+        return RingReader(self, latest=latest)
+
+    def copy_rows(self, start, stop, out=None):
+        """copies the rows [start, stop) (in terms of the total row count) into `out`."""
+        rows  = stop - start
+        if out is None:
+            out = np.empty((rows, self.nchan), dtype=BASETYPE)
+        pos   = start % self.capacity
+        first = min(rows, self.capacity - pos)
+        out[:first] = self._data[pos:pos+first]
+        if first < rows:
+            out[first:rows] = self._data[:rows-first]
+        return out
+
+    def close(self):
+        self._header = None
+        self._data   = None
+        self._shm.close()
+        if self._owner == True:
+            self._shm.unlink()
+
+class RingReader:
+    """a cursor on a SampleRing. reading never affects the writer or other readers."""
+
+    def __init__(self, ring, latest=True):
+        self.ring   = ring
+        self.lost   = 0 # number of rows that were overwritten before being read
+        written     = ring.written
+        self.cursor = written if latest == True else max(written - ring.capacity, 0)
+        self._viewed = self.cursor # the first row of the last view()
+
+    def available(self):
+        return self.ring.written - self.cursor
+
+    def view(self, maxrows=None):
+        """returns the rows written since the last read as a view of the ring (without copying), or None.
+
+        the view stops at the end of the ring (the rest is returned by the next call),
+        and its rows stay valid only until the writer laps them: check with intact() after using them."""
+        ring    = self.ring
+        written = ring.written
+        start   = self.cursor
+        if written - start > ring.capacity:
+            self.lost += written - ring.capacity - start
+            start      = written - ring.capacity
+        pos  = start % ring.capacity
+        stop = min(written, start + ring.capacity - pos)
+        if maxrows is not None:
+            stop = min(stop, start + maxrows)
+        if stop == start:
+            return None
+        self._viewed = start
+        self.cursor  = stop
+        return ring._data[pos:pos + stop - start]
+
+    def intact(self):
+        """returns False if the rows of the last view() may have been overwritten."""
+        return self.ring.written - self.ring.capacity <= self._viewed
+
+    def read(self, maxrows=None):
+        """returns the rows written since the last read (as a new array), or None.
+
+        if the reader has fallen behind by more than the ring capacity,
+        the oldest rows are skipped and counted in `lost`."""
+        ring    = self.ring
+        written = ring.written
+        start   = self.cursor
+        if written - start > ring.capacity:
+            self.lost += written - ring.capacity - start
+            start      = written - ring.capacity
+        if (maxrows is not None) and (written - start > maxrows):
+            written = start + maxrows
+        if written == start:
+            return None
+        out = ring.copy_rows(start, written)
+
+        # the writer may have lapped the beginning of the range while copying
+        overwritten = ring.written - ring.capacity - start
+        if overwritten > 0:
+            overwritten = min(overwritten, written - start)
+            self.lost  += overwritten
+            out         = out[overwritten:]
+        self.cursor = written
+        return out if out.shape[0] > 0 else None
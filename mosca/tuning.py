@@ -0,0 +1,215 @@
+
+import time
+from collections import deque
+import numpy as np
+from pyqtgraph.Qt import QtCore
+
+##
+## Tuning of the update interval
+##
+## the chunks are followed through the consumer threads by LatencyProbes: a probe lives
+## in a consumer thread, stamps every chunk before the consumers receive it (upon
+## DeviceManager.preparing), and receives it after the consumers of that thread
+## (upon DeviceManager.starting; queued connections are delivered in order).
+## the latency of a chunk is the time that the thread needed for it, including its backlog.
+##
+## Tuner.calibrate() runs two short acquisitions (without saving) at two intervals,
+## fits the processing time of each thread as `overhead + cost*samples`, and picks
+## the smallest interval whose processing takes at most 1/`headroom` of the chunk period.
+##
+## with "tuning": {"adaptive": true}, the backlog is watched during every acquisition:
+## when a thread lags more than `backlog` chunks behind, the driver delivers batches of
+## twice as many chunks (see BaseDeviceDriver.set_delivery_batch()), up to `maxbatch`,
+## and returns to smaller batches once the backlogs have cleared for `CALM_CHUNKS` chunks.
+##
+
+DEFAULT_HEADROOM    = 2.0
+DEFAULT_BACKLOG     = 4   # in chunks
+DEFAULT_MAX_BATCH   = 16  # in chunks
+DEFAULT_SECONDS     = 2.0 # the duration of each calibration run
+CALM_CHUNKS         = 50
+SKIPPED_CHUNKS      = 2   # the chunks that are not used for calibration (warm-up)
+INTERVAL_STEP       = 10  # in samples
+
+Tuner = None
+
+class LatencyProbe(QtCore.QObject):
+    """measures the latency of the chunks through the thread that it lives in."""
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.reset()
+
+    def __getattr__(self, name):
+        if name == 'backlog':
+            return len(self._sent)
+        else:
+            raise AttributeError(name)
+
+    def reset(self):
+        self._sent   = deque()
+        self.records = [] # (rows, latency in sec, the backlog when it was emitted)
+
+    def stamp(self, data):
+        """called in the emitting thread."""
+        self._sent.append((time.perf_counter(), data.shape[0], len(self._sent)))
+
+    def receive(self, data):
+        """called in the thread of the probe, after the consumers of the chunk."""
+        if len(self._sent) == 0:
+            return
+        sent, rows, backlog = self._sent.popleft()
+        self.records.append((rows, time.perf_counter() - sent, backlog))
+
+    def idle_records(self):
+        """the (rows, latency) of the chunks that arrived at an idle thread."""
+        return [(rows, latency) for rows, latency, backlog in self.records[SKIPPED_CHUNKS:] if backlog == 0]
+
+class IntervalTuner(QtCore.QObject):
+    """calibrates the update interval, and adapts the delivery batch at runtime."""
+
+    def __init__(self, adaptive=False, headroom=DEFAULT_HEADROOM, backlog=DEFAULT_BACKLOG,
+                    maxbatch=DEFAULT_MAX_BATCH, seconds=DEFAULT_SECONDS, parent=None):
+        super().__init__(parent)
+        self.name     = "Tuning"
+        self.adaptive = adaptive
+        self.headroom = float(headroom)
+        self.backlog  = int(backlog)
+        self.maxbatch = int(maxbatch)
+        self.seconds  = float(seconds)
+        self.probes   = []
+        self.driver   = None
+        self._active  = False # attached only if adaptive, or calibrating
+
+    def set_threads(self, threads):
+        """creates a probe in each of `threads` ({name: QThread})."""
+        self.probes = []
+        for name, thread in threads.items():
+            probe = LatencyProbe(name)
+            probe.moveToThread(thread)
+            self.probes.append(probe)
+
+    def attach(self):
+        """stamps the chunks of the current driver (before the consumers are prepared)."""
+        if (self.adaptive == False) and (self._active == False):
+            return
+        from . import devices
+        self.driver = devices.DeviceManager.current
+        for probe in self.probes:
+            probe.reset()
+            self.driver.dataAvailable.connect(probe.stamp, QtCore.Qt.DirectConnection)
+        if self.adaptive == True:
+            self._base  = self.driver.get_delivery_batch()
+            self._batch = self._base
+            self._calm  = 0
+            self.driver.dataAvailable.connect(self._watch, QtCore.Qt.DirectConnection)
+
+    def follow(self, save=True):
+        """receives the chunks in the consumer threads (after the consumers have been prepared)."""
+        if self.driver is None:
+            return
+        for probe in self.probes:
+            self.driver.dataAvailable.connect(probe.receive)
+
+    def detach(self):
+        if self.driver is None:
+            return
+        for probe in self.probes:
+            self.driver.dataAvailable.disconnect(probe.stamp)
+            self.driver.dataAvailable.disconnect(probe.receive)
+        if self.adaptive == True:
+            self.driver.dataAvailable.disconnect(self._watch)
+            if self._batch != self._base:
+                print(f"[{self.name}] delivered batches of {self._batch} chunks at the end")
+        self.driver = None
+
+    def _watch(self, data):
+        """called in the emitting thread, i.e. between the chunks."""
+        lagging = max(self.probes, key=lambda probe: probe.backlog, default=None)
+        if lagging is None:
+            return
+        if (lagging.backlog > self.backlog) and (self._batch < self.maxbatch):
+            self._set_batch(min(self._batch*2, self.maxbatch), f"'{lagging.name}' lags {lagging.backlog} chunks behind")
+            self._calm = 0
+        elif lagging.backlog == 0:
+            self._calm += 1
+            if (self._calm >= CALM_CHUNKS) and (self._batch > self._base):
+                self._set_batch(max(self._batch//2, self._base), "the backlogs have cleared")
+                self._calm = 0
+
+    def _set_batch(self, batch, reason):
+        batch = self.driver.set_delivery_batch(batch)
+        if batch == self._batch:
+            return
+        self._batch = batch
+        print(f"[{self.name}] {reason}: delivering batches of {batch} chunks")
+
+    def calibrate(self, controller, run=None):
+        """measures the processing time at the current interval and at twice of it,
+        and sets the smallest safe interval to the current driver. returns the interval.
+        the processing time of each thread is fitted to the rows actually delivered.
+
+        `run(controller, seconds)` runs an acquisition without saving
+        (by default, while processing the events of this thread)."""
+        if run is None:
+            run = _run_for
+        driver    = controller.current
+        lo, hi    = driver.intervalrange
+        intervals = (driver.interval, min(driver.interval*2, hi))
+        if intervals[1] == intervals[0]:
+            intervals = (max(intervals[0]//2, lo), intervals[0])
+        measured  = dict((probe.name, []) for probe in self.probes)
+        self._active = True
+        try:
+            for interval in intervals:
+                driver.interval = interval
+                run(controller, self.seconds)
+                for probe in self.probes:
+                    measured[probe.name].extend(probe.idle_records())
+        finally:
+            self._active = False
+            driver.interval = intervals[0]
+
+        dt     = 1/driver.rate
+        safest = None
+        for probe in self.probes:
+            records = np.array(measured[probe.name], dtype=float).reshape((-1, 2))
+            if np.unique(records[:,0]).shape[0] < 2:
+                print(f"***{self.name}: too few chunks arrived at '{probe.name}' to be measured")
+                continue
+            # the median at each size, to be robust against the occasional preemption
+            sizes    = np.unique(records[:,0])
+            medians  = np.array([np.median(records[records[:,0] == size, 1]) for size in sizes])
+            cost, overhead = np.polyfit(sizes, medians, 1)
+            cost     = max(cost, 0.0) # per sample
+            overhead = max(overhead, 0.0)
+            if self.headroom*cost >= dt:
+                print(f"***{self.name}: '{probe.name}' cannot keep up at any interval "+
+                      f"({cost*1e6:.2f} us per sample)")
+                safest = hi
+                continue
+            needed = int(np.ceil(self.headroom*overhead/(dt - self.headroom*cost)))
+            print(f"[{self.name}] '{probe.name}': {overhead*1000:.3f} ms + {cost*1e6:.3f} us/sample "+
+                  f"-> >= {needed} samples")
+            safest = max(safest, needed) if safest is not None else needed
+        if safest is None:
+            print(f"***{self.name}: the update interval is left unchanged (try longer calibration runs)")
+            return driver.interval
+        interval = int(min(max(int(np.ceil(safest/INTERVAL_STEP))*INTERVAL_STEP, lo), hi))
+        driver.interval = interval
+        print(f"[{self.name}] update interval: {interval} samples (headroom x{self.headroom})")
+        return interval
+
+def _run_for(controller, seconds):
+    controller.start(save=False)
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        QtCore.QCoreApplication.processEvents()
+        time.sleep(0.005)
+    controller.stop()
+    QtCore.QCoreApplication.processEvents()
+
+def setup(cfg):
+    global Tuner
+    Tuner = IntervalTuner(**cfg.get('tuning', {}))
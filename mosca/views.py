@@ -0,0 +1,334 @@
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore
+
+##
+## Trace renderers for the oscillo window
+##
+## a renderer holds the plots for a set of channels, and redraws all the channels
+## at once from a (samples x channels) array of scaled values, of which the last
+## `size` rows have been added since the last call (size=None after a reset), after
+## `dropped` samples that were never delivered to the renderer (see PendingChunks).
+## mark() shows the event markers (a structured array of 'time', 'lane' and 'amplitude').
+## renderers are kept in a pool by ViewManager: attach() puts the plots (back) in
+## a pg.GraphicsLayoutWidget, and configure() reflects the channel settings that
+## do not require new plots (labels, gains, offsets), and set_decimation() divides
+## the number of vertices per channel while the display is degraded (see below).
+##
+
+STACK_SPACING   = 20.0  # the height of a lane in the stacked layout (the span of a ±10 V input)
+STACK_THRESHOLD = 8     # 'Auto' chooses the stacked layout for more channels than this
+MAX_POINTS      = 4000  # the maximum number of vertices per channel (a min/max pair per bin)
+MARKER_BRUSH    = 'r'
+MARKER_SIZE     = 8
+PERSISTENCE_TIME_BINS = 1000 # the number of time bins per sweep in the persistence layout
+PERSISTENCE_AMP_BINS  = 100  # the number of amplitude bins per lane in the persistence layout
+
+def channel_title(ch):
+    return ch.label if len(ch.label.strip()) > 0 else ch.name
+
+def peak_decimate(time, ydata, factor):
+    """reduces every `factor` samples of `ydata` (samples x channels) into a (min, max) pair.
+    the oldest samples that do not fill a bin are left out."""
+    nbins = ydata.shape[0] // factor
+    skip  = ydata.shape[0] - nbins*factor
+    bins  = ydata[skip:].reshape((nbins, factor, ydata.shape[1]))
+    x     = np.empty((2*nbins,), dtype=float)
+    y     = np.empty((2*nbins, ydata.shape[1]), dtype=float)
+    x[0::2] = time[skip::factor]
+    x[1::2] = time[skip+factor-1::factor]
+    np.min(bins, axis=1, out=y[0::2])
+    np.max(bins, axis=1, out=y[1::2])
+    return x, y
+
+class SeparateTraces:
+    """one plot (with its own axes and curve) per channel."""
+
+    def __init__(self, channels, samplesize):
+        self.plots   = []
+        self.curves  = []
+        self.markers = []
+        self.samplesize = samplesize
+        self.factor  = 1 # 1: the curves downsample by themselves
+        for ch in channels:
+            plot = pg.PlotItem()
+            plot.setLabel('bottom', units='s')
+            curve = plot.plot(pen=pg.mkPen('b'))
+            curve.setDownsampling(auto=True, method='peak')
+            marker = pg.ScatterPlotItem(pen=None, brush=MARKER_BRUSH, symbol='t', size=MARKER_SIZE)
+            plot.addItem(marker)
+            self.plots.append(plot)
+            self.curves.append(curve)
+            self.markers.append(marker)
+
+    def attach(self, widget):
+        for i, plot in enumerate(self.plots):
+            widget.addItem(plot, row=i, col=0)
+
+    def configure(self, channels):
+        for plot, ch in zip(self.plots, channels):
+            plot.setLabel('left', text=ch.label, units=ch.unit)
+
+    def set_decimation(self, step):
+        self.factor = 1 if step == 1 else max(int(np.ceil(2*self.samplesize*step/MAX_POINTS)), 1)
+
+    def set_data(self, time, ydata, size=None, dropped=0):
+        trng = (time[0], time[-1])
+        if self.factor > 1:
+            time, ydata = peak_decimate(time, ydata, self.factor)
+        for i, curve in enumerate(self.curves):
+            curve.setData(time, ydata[:,i])
+            self.plots[i].setXRange(*trng, padding=0)
+
+    def mark(self, marks):
+        for i, marker in enumerate(self.markers):
+            sel = marks[marks['lane'] == i]
+            marker.setData(sel['time'], sel['amplitude'])
+
+class StackedTraces:
+    """all the channels in one plot, as a single curve item.
+
+    the channels are stacked in lanes of STACK_SPACING from the top, and each
+    channel is displayed as (value x `gain` + `offset`) within its lane.
+    the channels are decimated into (min, max) pairs of at most MAX_POINTS vertices,
+    the vertices of all the channels are packed into one array, and the lanes
+    are separated by breaking the connection at the last vertex of each channel."""
+
+    def __init__(self, channels, samplesize):
+        nchan        = len(channels)
+        self.lanes   = -np.arange(nchan, dtype=float)*STACK_SPACING
+        self.samplesize = samplesize
+        self._allocate(MAX_POINTS)
+
+        self.plot   = pg.PlotItem()
+        self.plot.setLabel('bottom', units='s')
+        self.plot.setYRange(self.lanes[-1] - STACK_SPACING/2, STACK_SPACING/2, padding=0)
+        self.plot.disableAutoRange()
+        self.curve  = pg.PlotCurveItem(pen=pg.mkPen('b'))
+        self.plot.addItem(self.curve)
+        self.marker = pg.ScatterPlotItem(pen=None, brush=MARKER_BRUSH, symbol='t', size=MARKER_SIZE)
+        self.plot.addItem(self.marker)
+
+    def _allocate(self, maxpoints):
+        nchan        = self.lanes.shape[0]
+        self.factor  = max(int(np.ceil(2*self.samplesize/maxpoints)), 1)
+        self.nbins   = self.samplesize // self.factor
+        self.skip    = self.samplesize - self.nbins*self.factor # the oldest samples that are not displayed
+        npoints      = self.nbins if self.factor == 1 else 2*self.nbins
+        self._x      = np.empty((nchan, npoints), dtype=float)
+        self._y      = np.empty((nchan, npoints), dtype=float)
+        connect      = np.ones((nchan, npoints), dtype=bool)
+        connect[:,-1] = False
+        self._connect = connect.ravel()
+
+    def attach(self, widget):
+        widget.addItem(self.plot, row=0, col=0)
+
+    def set_decimation(self, step):
+        self._allocate(MAX_POINTS // step)
+
+    def configure(self, channels):
+        self.gains   = np.array([ch.gain for ch in channels], dtype=float).reshape((-1,1))
+        self.offsets = (self.lanes + np.array([ch.offset for ch in channels], dtype=float)).reshape((-1,1))
+        self.plot.getAxis('left').setTicks([[(lane, channel_title(ch)) for lane, ch in zip(self.lanes, channels)], []])
+
+    def set_data(self, time, ydata, size=None, dropped=0):
+        # a few vectorized operations for all the channels
+        ydata = ydata[self.skip:].T
+        time  = time[self.skip:]
+        if self.factor == 1:
+            self._x[:] = time
+            np.multiply(ydata, self.gains, out=self._y)
+        else:
+            bins = ydata.reshape((ydata.shape[0], self.nbins, self.factor))
+            self._x[:,0::2] = time[::self.factor]
+            self._x[:,1::2] = time[self.factor-1::self.factor]
+            np.min(bins, axis=2, out=self._y[:,0::2])
+            np.max(bins, axis=2, out=self._y[:,1::2])
+            self._y *= self.gains
+        self._y   += self.offsets
+        self.curve.setData(self._x.ravel(), self._y.ravel(), connect=self._connect)
+        self.plot.setXRange(time[0], time[-1], padding=0)
+
+    def mark(self, marks):
+        lanes = marks['lane']
+        self.marker.setData(marks['time'], marks['amplitude']*self.gains[lanes,0] + self.offsets[lanes,0])
+
+class PersistenceTraces:
+    """a digital-phosphor display of all the channels, as a single image item.
+
+    the display is a sweep of the plot width, and every sample is accumulated into
+    a (time-bin x amplitude-bin) histogram in the lane of its channel (with the same
+    gain/offset as StackedTraces). the histogram decays by half every sweep,
+    so that the intensity shows how often the signal passes through each point."""
+
+    def __init__(self, channels, samplesize):
+        nchan           = len(channels)
+        self.nchan      = nchan
+        self.samplesize = samplesize
+        self.lanes      = -np.arange(nchan, dtype=float)*STACK_SPACING
+        self.hist       = np.zeros((PERSISTENCE_TIME_BINS, nchan*PERSISTENCE_AMP_BINS), dtype=np.float32)
+        self._count     = 0 # the total number of samples of the sweep so far
+        # the lane of channel 0 comes at the top i.e. in the last rows of the image
+        self._laneorigin = ((nchan - 1 - np.arange(nchan))*PERSISTENCE_AMP_BINS).reshape((1,-1))
+
+        self.plot   = pg.PlotItem()
+        self.plot.setLabel('bottom', text='Sweep time', units='s')
+        self.plot.setYRange(self.lanes[-1] - STACK_SPACING/2, STACK_SPACING/2, padding=0)
+        self.plot.disableAutoRange()
+        self.image  = pg.ImageItem()
+        self.plot.addItem(self.image)
+
+    def attach(self, widget):
+        widget.addItem(self.plot, row=0, col=0)
+
+    def configure(self, channels):
+        self.gains   = np.array([ch.gain for ch in channels], dtype=float).reshape((1,-1))
+        self.offsets = np.array([ch.offset for ch in channels], dtype=float).reshape((1,-1))
+        self.plot.getAxis('left').setTicks([[(lane, channel_title(ch)) for lane, ch in zip(self.lanes, channels)], []])
+
+    def set_decimation(self, step):
+        pass # every sample is accumulated: only the frame rate is lowered
+
+    def set_data(self, time, ydata, size=None, dropped=0):
+        if size is None:
+            self.hist[:] = 0
+            self._count  = 0
+            width = time[-1] - time[0] + (time[1] - time[0])
+            self.image.setImage(self.hist, levels=(0, 1))
+            self.image.setRect(QtCore.QRectF(0, self.lanes[-1] - STACK_SPACING/2, width, self.nchan*STACK_SPACING))
+            self.plot.setXRange(0, width, padding=0)
+            return
+        # the samples that are not accumulated still advance the sweep,
+        # so that its phase keeps following the acquisition time
+        skipped = dropped + max(size - self.samplesize, 0)
+        self._count += skipped
+        size  = min(size, self.samplesize)
+        new   = ydata[-size:]*self.gains + self.offsets
+
+        # the bin indices of all the new samples at once
+        tbins = ((self._count + np.arange(size)) % self.samplesize)*PERSISTENCE_TIME_BINS // self.samplesize
+        abins = np.floor((new/STACK_SPACING + 0.5)*PERSISTENCE_AMP_BINS).astype(np.intp)
+        valid = (abins >= 0) & (abins < PERSISTENCE_AMP_BINS)
+        index = (tbins.reshape((-1,1))*self.hist.shape[1] + self._laneorigin + abins)[valid]
+
+        self.hist *= 0.5**((skipped + size)/self.samplesize)
+        if index.size > 0:
+            # the new samples only cover a few time bins (except when the sweep wraps)
+            base   = index.min()
+            counts = np.bincount(index - base)
+            self.hist.reshape((-1,))[base:base + counts.size] += counts
+        self._count += size
+        self.image.setImage(self.hist, autoLevels=False, levels=(0, max(float(self.hist.max()), 1)))
+
+    def mark(self, marks):
+        pass # the sweep time does not tell when the events were
+
+LAYOUTS = OrderedDict((('Auto', None), ('Separate', SeparateTraces), ('Stacked', StackedTraces),
+                        ('Persistence', PersistenceTraces)))
+
+def renderer_for(layout, nchan):
+    """returns the renderer class for the layout name."""
+    if LAYOUTS.get(layout, None) is None:
+        return StackedTraces if nchan > STACK_THRESHOLD else SeparateTraces
+    return LAYOUTS[layout]
+
+##
+## Load shedding
+##
+## the chunks for the display are collected by PendingChunks in the acquisition thread,
+## and drawn at most once per frame: whatever has arrived since the last frame is coalesced
+## into one update, and no more than a plot width of samples is kept (the older samples
+## would scroll out of the view anyway), so that a slow display cannot pile up chunks.
+## DisplayGovernor measures the time that the GUI thread spends on each frame
+## (drawing, and the delay of the frame itself): after DEGRADE_FRAMES frames in a row above
+## DEGRADE_LOAD of the frame period, it steps up to the next of DISPLAY_LEVELS (fewer frames
+## and vertices), and steps back after RECOVER_FRAMES frames in a row below RECOVER_LOAD.
+## the storage is not affected.
+##
+
+DISPLAY_LEVELS = ((30, 1), (15, 2), (8, 4), (4, 8)) # (frames per second, decimation)
+DEGRADE_LOAD   = 0.5
+DEGRADE_FRAMES = 3
+RECOVER_LOAD   = 0.15
+RECOVER_FRAMES = 30
+
+class PendingChunks:
+    """the chunks that have arrived since the last frame (push() may be called from any thread)."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity # in samples
+        self._lock    = threading.Lock()
+        self._chunks  = []
+        self._rows    = 0
+        self._dropped = 0
+
+    def push(self, data):
+        with self._lock:
+            self._chunks.append(data)
+            self._rows += data.shape[0]
+            while self._rows - self._chunks[0].shape[0] >= self.capacity:
+                oldest = self._chunks.pop(0)
+                self._rows    -= oldest.shape[0]
+                self._dropped += oldest.shape[0]
+
+    def take(self):
+        """returns the pending samples as one array (or None), and the number of samples
+        that have been dropped before them."""
+        with self._lock:
+            chunks, dropped = self._chunks, self._dropped
+            self._chunks  = []
+            self._rows    = 0
+            self._dropped = 0
+        if len(chunks) == 0:
+            return None, dropped
+        return (chunks[0] if len(chunks) == 1 else np.concatenate(chunks, axis=0)), dropped
+
+class DisplayGovernor:
+    def __init__(self):
+        self.reset()
+
+    def __getattr__(self, name):
+        if name == 'fps':
+            return DISPLAY_LEVELS[self.level][0]
+        elif name == 'decimation':
+            return DISPLAY_LEVELS[self.level][1]
+        elif name == 'interval':
+            return int(round(1000/self.fps)) # in msec
+        else:
+            raise AttributeError(name)
+
+    def reset(self):
+        self.level    = 0
+        self.highest  = 0 # the highest level during the acquisition
+        self.degraded = 0 # the number of frames drawn at a degraded level
+        self._heavy   = 0
+        self._light   = 0
+
+    def account(self, busy):
+        """records the time (in sec) that a frame took. returns True if the level has changed."""
+        load = busy*self.fps
+        if self.level > 0:
+            self.degraded += 1
+        if load > DEGRADE_LOAD:
+            self._heavy += 1
+            self._light  = 0
+            if (self._heavy >= DEGRADE_FRAMES) and (self.level < len(DISPLAY_LEVELS) - 1):
+                self.level   += 1
+                self.highest  = max(self.highest, self.level)
+                self._heavy   = 0
+                return True
+            return False
+        self._heavy = 0
+        if load < RECOVER_LOAD:
+            self._light += 1
+            if (self._light >= RECOVER_FRAMES) and (self.level > 0):
+                self.level  -= 1
+                self._light  = 0
+                return True
+        else:
+            self._light = 0
+        return False
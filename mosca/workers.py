@@ -0,0 +1,250 @@
+
+import traceback, pickle, queue
+import multiprocessing as mp
+from pyqtgraph.Qt import QtCore
+from . import transport
+from . import events, averaging, hooks
+
+##
+## Process isolation of the acquisition
+##
+## DeviceManager and StorageManager run in a worker process. The samples are
+## transported to the GUI process through a SampleRing, so that the GUI can
+## only lose display frames (and never recorded samples) when it lags behind.
+##
+## the consumers that need every sample (events, averaging, digital ports, the hook)
+## also run in the worker process. the detected events and the averages are sent back
+## through a queue of notices, and re-emitted from the (idle) managers of the GUI process.
+##
+
+DEFAULT_RING_SECONDS    = 10
+DEFAULT_POLL_MSEC       = 20
+DEFAULT_REPLY_TIMEOUT   = 30 # in sec
+
+Isolation = None # the AcquisitionProcess, if the acquisition is isolated
+
+def snapshot_configs(model):
+    """returns {label: value} for the writable parameters of a driver/channel."""
+    return dict((c.label, c.get_value()) for c in model.configs() if c.readonly == False)
+
+def apply_configs(model, values):
+    for c in model.configs():
+        if (c.readonly == False) and (c.label in values.keys()):
+            c.set_value(values[c.label])
+
+def snapshot_hook(hook):
+    """returns the registered hook if it can be sent to the worker process, or None."""
+    if hook is None:
+        return None
+    try:
+        pickle.dumps(hook)
+    except Exception as e:
+        print(f"***Isolation: the hook '{hook.name}' cannot be sent to the acquisition process ({e}); it is not called")
+        return None
+    return hook
+
+def snapshot(devicemanager, storagemanager):
+    """collects the GUI-side settings that the worker process needs to reproduce."""
+    device  = devicemanager.current
+    storage = storagemanager.current
+    chinfo  = []
+    for name, ch in device.channels.items():
+        chinfo.append((name, ch.inuse, ch.label, snapshot_configs(ch)))
+    portinfo = [(name, port.inuse) for name, port in device.ports.items()]
+    return dict(device=device.name, deviceconfigs=snapshot_configs(device), channels=chinfo, ports=portinfo,
+                storage=storage.name, storageconfigs=snapshot_configs(storage),
+                events=events.EventManager.enabled, averaging=averaging.AverageManager.enabled,
+                hook=snapshot_hook(hooks.Current))
+
+def apply_snapshot(snap, devicemanager, storagemanager):
+    devicemanager.set_driver(snap['device'])
+    storagemanager.set_driver(snap['storage'])
+    device = devicemanager.current
+    apply_configs(device, snap['deviceconfigs'])
+    apply_configs(storagemanager.current, snap['storageconfigs'])
+    events.EventManager.enabled = snap['events']
+    averaging.AverageManager.enabled = snap['averaging']
+    hooks.register(snap['hook'])
+    for name, inuse, label, configs in snap['channels']:
+        ch = device.channels[name]
+        ch.inuse = inuse
+        ch.label = label
+        apply_configs(ch, configs)
+    for name, inuse in snap['ports']:
+        device.ports[name].inuse = inuse
+
+class Notifier:
+    """puts the results of the consumers in the worker process on the queue of notices,
+    as (kind, args) tuples (called from the threads of the consumers)."""
+
+    def __init__(self, notices, kind):
+        self.notices = notices
+        self.kind    = kind
+
+    def __call__(self, *args):
+        self.notices.put((self.kind, args))
+
+def notified_signals():
+    """{kind: signal} of the results that are sent back to the GUI process."""
+    return dict(events=events.EventManager.detected, average=averaging.AverageManager.updated)
+
+def serve(conn, notices):
+    """the main loop of the worker process.
+
+    commands are (name, args) tuples received through `conn`,
+    and every command is replied with ('ok', value) or ('error', message).
+    the results of the consumers are put on `notices` (see Notifier)."""
+    import mosca
+    from . import states
+    app = QtCore.QCoreApplication([])
+    mosca.setup()
+    mosca.start_threads()
+    # the main thread of the worker process does not process events while it waits for commands
+    mosca.start_tuning(mosca.DeviceManager, withview=False)
+
+    # there is no view in the worker process
+    states.StateManager.donePlotting.set()
+    for kind, signal in notified_signals().items():
+        signal.connect(Notifier(notices, kind), QtCore.Qt.DirectConnection)
+
+    ring    = None
+    running = True
+    while running == True:
+        cmd, args = conn.recv()
+        try:
+            if cmd == 'start':
+                snap, save, ringname = args
+                apply_snapshot(snap, mosca.DeviceManager, mosca.StorageManager)
+                ring = transport.SampleRing.attach(ringname)
+                mosca.DeviceManager.current.dataAvailable.connect(ring.write, QtCore.Qt.DirectConnection)
+                mosca.DeviceManager.start(save=save)
+                conn.send(('ok', None))
+            elif cmd == 'stop':
+                mosca.DeviceManager.stop()
+                if ring is not None:
+                    mosca.DeviceManager.current.dataAvailable.disconnect(ring.write)
+                    ring.mark_closed()
+                    ring.close()
+                    ring = None
+                conn.send(('ok', mosca.StorageManager.current.acqno))
+            elif cmd == 'quit':
+                running = False
+                conn.send(('ok', None))
+            else:
+                raise ValueError(f"unknown command: '{cmd}'")
+        except:
+            conn.send(('error', traceback.format_exc()))
+    mosca.DeviceManager.release()
+    mosca.stop_threads()
+
+class AcquisitionProcess(QtCore.QObject):
+    """the GUI-side controller of the worker process.
+
+    it has the same start(save)/stop() interface as DeviceManager,
+    and re-emits the samples from the worker through the (local) dataAvailable
+    signal of the current device driver, so that ViewManager does not need to
+    know where the samples come from. the events and the averages from the worker
+    are re-emitted through the signals of the local managers likewise."""
+
+    starting    = QtCore.pyqtSignal(bool)
+    finishing   = QtCore.pyqtSignal()
+
+    def __init__(self, devicemanager, storagemanager,
+                    ringseconds=DEFAULT_RING_SECONDS, pollmsec=DEFAULT_POLL_MSEC, parent=None):
+        super().__init__(parent)
+        self.devicemanager  = devicemanager
+        self.storagemanager = storagemanager
+        self.ringseconds    = ringseconds
+        self._ring          = None
+        self._reader        = None
+        self.running        = False
+        self._timer         = QtCore.QTimer(parent=self)
+        self._timer.setInterval(pollmsec)
+        self._timer.timeout.connect(self.poll)
+
+        context = mp.get_context('spawn')
+        self._conn, child = context.Pipe()
+        self._notices = context.Queue()
+        self._process = context.Process(target=serve, args=(child, self._notices), name="mosca-acquisition", daemon=True)
+        self._process.start()
+        print(f"[Isolation] started the acquisition process (pid: {self._process.pid})")
+
+    def request(self, cmd, *args):
+        self._conn.send((cmd, args))
+        if not self._conn.poll(DEFAULT_REPLY_TIMEOUT):
+            raise RuntimeError(f"acquisition process did not respond to '{cmd}'")
+        status, value = self._conn.recv()
+        if status == 'error':
+            raise RuntimeError(f"acquisition process failed to '{cmd}':\n{value}")
+        return value
+
+    def start(self, save=True):
+        # the consumers of this process (e.g. the view) follow the same plan as the worker
+        plan   = self.devicemanager.build_plan()
+        self._ring   = transport.SampleRing.create(self.ringseconds*plan.rate, plan.nchan)
+        self._reader = self._ring.reader()
+        try:
+            self.request('start', snapshot(self.devicemanager, self.storagemanager), save, self._ring.name)
+        except:
+            self._close_ring()
+            raise
+        self.running = True
+        self.starting.emit(save)
+        self._timer.start()
+
+    def stop(self):
+        self.running = False
+        try:
+            acqno = self.request('stop')
+            self.storagemanager.current.acqno = acqno
+        finally:
+            self._timer.stop()
+            self.poll()
+            if self._reader.lost > 0:
+                print(f"[Isolation] the display skipped {self._reader.lost} samples")
+            self.finishing.emit()
+            self._close_ring()
+
+    def poll(self):
+        """forwards the samples in the ring to the local device driver,
+        and the notices from the worker to the local managers."""
+        if self._reader is None:
+            return
+        data = self._reader.read()
+        if data is not None:
+            self.devicemanager.current.dataAvailable.emit(data)
+        signals = notified_signals()
+        while True:
+            try:
+                kind, args = self._notices.get_nowait()
+            except queue.Empty:
+                break
+            signals[kind].emit(*args)
+
+    def _close_ring(self):
+        self._reader = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def shutdown(self):
+        if self._process.is_alive():
+            try:
+                self.request('quit')
+            except:
+                traceback.print_exc()
+            self._process.join(DEFAULT_REPLY_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+
+def setup(cfg, devicemanager, storagemanager):
+    global Isolation
+    opts = cfg.get('isolation', {})
+    if bool(opts.get('process', False)) == True:
+        Isolation = AcquisitionProcess(devicemanager, storagemanager,
+                                        ringseconds=opts.get('ringseconds', DEFAULT_RING_SECONDS),
+                                        pollmsec=opts.get('pollmsec', DEFAULT_POLL_MSEC))
+
+def shutdown():
+    if Isolation is not None:
+        Isolation.shutdown()
@@ -17,11 +17,34 @@ corelib = Extension('mosca.lib.corelib',
                         sources      = [corelib_c, corelib_pyx],
                         include_dirs = [".", moscalibdir],
                         libraries    = corelib_link )
-extensions = [ corelib ]
+nativeio_c      = os.path.join(moscalibdir, "_nativeio.c")
+nativeio = Extension('mosca.lib.nativeio',
+                        sources      = [corelib_c, nativeio_c, os.path.join(moscalibdir, "nativeio.pyx")],
+                        include_dirs = [".", moscalibdir],
+                        libraries    = corelib_link )
+extensions = [ corelib, nativeio ]
 
 HAS_NI = False
 
-if os.name == 'nt':
+# build mosca.lib.NI against the local imitation of the DAQmx API (mosca/lib/stub)
+# so that the driver can be exercised without NI hardware.
+NI_STUB = os.environ.get("MOSCA_NI_STUB", "0") not in ("", "0")
+
+if NI_STUB == True:
+    ni_stubdir = os.path.join(moscalibdir, "stub")
+    nidriver = Extension("mosca.lib.NI",
+                        sources     =[corelib_c, nativeio_c,
+                                      os.path.join(ni_stubdir, "nidaqmx_stub.c"),
+                                      os.path.join(moscalibdir, "NI.pyx")],
+                        include_dirs=[
+                            numpy.get_include(),
+                            ni_stubdir,
+                            moscalibdir
+                        ],
+                        libraries   = corelib_link + ['m'])
+    extensions += [ nidriver ]
+    HAS_NI = True
+elif os.name == 'nt':
     ni_dir = os.path.join("C:","\Program Files (x86)", # TODO: depends on the environment
                             "National Instruments",
                             "Shared",
@@ -37,10 +60,11 @@ if os.name == 'nt':
         ni_pyx = os.path.join(moscalibdir, "NI.pyx")
 
         nidriver = Extension("mosca.lib.NI",
-                            sources     =[corelib_c, ni_pyx],
+                            sources     =[corelib_c, nativeio_c, ni_pyx],
                             include_dirs=[
                                 numpy.get_include(),
-                                ni_include
+                                ni_include,
+                                moscalibdir
                             ],
                             library_dirs = [
                                 ni_libdir
@@ -55,7 +79,9 @@ if os.name == 'nt':
 else:
     pass
 
-if HAS_NI == True:
+if NI_STUB == True:
+    print(">>> turning on the option: NI-DAQmx (stub).")
+elif HAS_NI == True:
     print(">>> turning on the option: NI-DAQmx.")
 else:
     print(">>> turning off the option: NI-DAQmx.")
@@ -0,0 +1,59 @@
+import os, json, time
+from collections import OrderedDict
+import numpy as np
+import pytest
+
+##
+## the tests run without a display; the NI tests need mosca.lib.NI built against
+## the stub library (MOSCA_NI_STUB=1 python setup.py build_ext --inplace).
+##
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+@pytest.fixture(scope='session')
+def qapp():
+    from pyqtgraph.Qt import QtCore
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        app = QtCore.QCoreApplication([])
+    return app
+
+def split_points(rows, count, seed=0):
+    """`count` random boundaries that cut `rows` rows into chunks (of at least one row)."""
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(np.arange(1, rows), size=count, replace=False))
+
+@pytest.fixture
+def write_recording(tmp_path):
+    """writes `data` as a .npy recording with its .cfg file, and returns its path prefix."""
+    def _write(data, names=None, rate=1000, basename='wave_001'):
+        prefix = str(tmp_path / basename)
+        names  = names if names is not None else ["AI{0}".format(i) for i in range(data.shape[1])]
+        np.save(prefix + ".npy", data)
+        info = OrderedDict()
+        info['channels'] = [OrderedDict(id=i, name=name, unit='V', range='±10 V', source=name)
+                            for i, name in enumerate(names)]
+        info['data'] = OrderedDict(datatype=data.dtype.name, byteorder='little', shape=data.shape, rate=rate)
+        with open(prefix + ".cfg", 'w') as f:
+            json.dump(info, f)
+        return prefix
+    return _write
+
+def run_driver(qapp, driver, seconds):
+    """runs `driver` (with its channels in use) for `seconds`, and returns the chunks it has delivered."""
+    from pyqtgraph.Qt import QtCore
+    from mosca import plans
+    chunks = []
+    receive = lambda data: chunks.append(data.copy())
+    driver.plan = plans.AcquisitionPlan(driver)
+    driver.dataAvailable.connect(receive, QtCore.Qt.DirectConnection)
+    driver.prepare()
+    driver.start()
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        qapp.processEvents()
+        time.sleep(0.002)
+    driver.stop()
+    qapp.processEvents()
+    driver.dataAvailable.disconnect(receive)
+    return chunks
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from conftest import run_driver
+from mosca import composite, devices, plans
+
+def make_composite(members):
+    driver = composite.CompositeDeviceDriver(members)
+    driver.rate, driver.interval = 10000, 200
+    return driver
+
+def select(driver, names):
+    for name, ch in driver.channels.items():
+        ch.inuse = (name in names)
+
+def acquire(qapp, driver, seconds):
+    chunks = run_driver(qapp, driver, seconds)
+    return np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, driver.plan.nchan))
+
+@pytest.mark.parametrize('names', [('B0.AI0',), ('B1.AI0', 'B1.AI2'), ('B0.AI1', 'B1.AI1')])
+def test_members_without_channels_are_not_used(qapp, names):
+    driver = make_composite([devices.DummyDeviceDriver(), devices.DummyDeviceDriver()])
+    select(driver, names)
+    data = acquire(qapp, driver, 0.3)
+    assert data.shape[0] > 0
+    assert data.shape[1] == len(names)
+
+def test_boards_without_channels_are_not_used(qapp):
+    NI = pytest.importorskip("mosca.lib.NI", reason="mosca.lib.NI is not built (MOSCA_NI_STUB=1)")
+    driver = make_composite([NI.Board('Dev1', boardtype='NI6321'), NI.Board('Dev2', boardtype='NI6321')])
+    for names in (('B0.AI0',), ('B1.AI0',), ('B0.AI0', 'B1.AI0')):
+        select(driver, names)
+        data = acquire(qapp, driver, 0.3)
+        assert data.shape[0] > 0
+        assert data.shape[1] == len(names)
+    assert np.array_equal(data[:, 0], data[:, 1]) # the follower takes the clock of the leader
+
+def test_channels_of_the_members_are_told_apart():
+    driver = make_composite([devices.DummyDeviceDriver(), devices.DummyDeviceDriver()])
+    select(driver, ('B0.AI0', 'B1.AI0'))
+    plan = plans.AcquisitionPlan(driver)
+    assert plan.titles == ('B0.AI0', 'B1.AI0')
+    assert [chinfo['name'] for chinfo in plan.metadata] == ['B0.AI0', 'B1.AI0']
+    assert len(set(plan.sources)) == 2
+
+def test_boards_keep_their_physical_channels(qapp):
+    NI = pytest.importorskip("mosca.lib.NI", reason="mosca.lib.NI is not built (MOSCA_NI_STUB=1)")
+    driver = make_composite([NI.Board('Dev1', boardtype='NI6321'), NI.Board('Dev2', boardtype='NI6321')])
+    select(driver, ('B0.AI1', 'B1.AI1'))
+    data = acquire(qapp, driver, 0.3)
+    assert driver.plan.sources == ('B0.Dev1/ai1', 'B1.Dev2/ai1')
+    assert data.shape[1] == 2
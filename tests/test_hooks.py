@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from conftest import run_driver
+from mosca import hooks, devices, composite
+
+def noop(data):
+    pass
+
+def run_with_hook(qapp, driver, seconds=0.5):
+    hook = hooks.ClosedLoopHook(noop, budget=1000)
+    assert driver.attach_hook(hook) == True
+    try:
+        run_driver(qapp, driver, seconds)
+    finally:
+        driver.detach_hook()
+    assert hook.histogram.total > 0
+    return hook
+
+def make_dummy(nchan=2, rate=10000, interval=200):
+    driver = devices.DummyDeviceDriver()
+    for i, ch in enumerate(driver.channels.values()):
+        ch.inuse = (i < nchan)
+    driver.rate, driver.interval = rate, interval
+    return driver
+
+def test_dummy_times_the_oldest_chunk_of_a_batch(qapp):
+    driver = make_dummy()
+    driver.set_delivery_batch(3) # until the next stop()
+    hook = run_with_hook(qapp, driver)
+    assert hook.untimed == 0
+    # the oldest of 3 chunks of 20 ms has waited for (about) the 2 others
+    assert hook.histogram.percentile(50) > 20000
+
+def test_composite_times_the_merged_chunks(qapp):
+    driver = composite.CompositeDeviceDriver([make_dummy(), make_dummy()])
+    driver.rate, driver.interval = 10000, 200
+    for name, ch in driver.channels.items():
+        ch.inuse = name.endswith('AI0')
+    hook = run_with_hook(qapp, driver)
+    assert hook.untimed == 0
+
+def test_board_times_the_oldest_chunk_of_a_batch(qapp):
+    NI = pytest.importorskip("mosca.lib.NI", reason="mosca.lib.NI is not built (MOSCA_NI_STUB=1)")
+    board = NI.Board('Dev1', boardtype='NI6321')
+    next(iter(board.channels.values())).inuse = True
+    board.rate, board.interval, board.batch = 20000, 200, 4
+    hook = run_with_hook(qapp, board)
+    # the oldest of 4 chunks of 10 ms has waited for (about) the 3 others
+    assert hook.histogram.percentile(50) > 20000
+
+def test_untimed_invocations_are_reported_as_run_time(capsys):
+    hook = hooks.ClosedLoopHook(noop)
+    hook.invoke(np.zeros((10, 1)))
+    hook.report()
+    assert "run time" in capsys.readouterr().out
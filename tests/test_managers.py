@@ -0,0 +1,44 @@
+import json
+from collections import OrderedDict
+import numpy as np
+import pytest
+from mosca import devices, plans, events
+
+DUMMY = {'module': 'mosca.devices', 'class': 'DummyDeviceDriver', 'args': '', 'default': True}
+
+@pytest.fixture
+def device(qapp):
+    devices.setup({'devices': [DUMMY]})
+    driver = devices.DeviceManager.current
+    for i, ch in enumerate(driver.channels.values()):
+        ch.inuse = (i < 2)
+    devices.DeviceManager.build_plan()
+    yield driver
+    devices.DeviceManager = None
+
+def test_events_without_any_chunk(device, tmp_path):
+    manager  = events.EventDetectorManager(enabled=True)
+    manager.prepare()
+    sidecars = OrderedDict()
+    manager.finalize(str(tmp_path / "wave_001"), sidecars)
+    assert sidecars['events']['count'] == 0
+    assert sidecars['events']['noise'] == [None, None]
+    json.dumps(sidecars, allow_nan=False)
+    assert manager.detector is None
+
+def test_release_disarms_in_the_device_thread(device, qapp):
+    from pyqtgraph.Qt import QtCore
+    manager = devices.DeviceManager
+    manager._bind()
+    seen    = []
+    device.disarm = lambda: seen.append(QtCore.QThread.currentThread())
+    thread  = QtCore.QThread()
+    manager.moveToThread(thread)
+    thread.start()
+    try:
+        manager.release()
+    finally:
+        thread.quit()
+        thread.wait()
+    assert seen == [thread]
+    assert manager._bound is None
@@ -0,0 +1,62 @@
+import time
+import numpy as np
+import pytest
+from mosca import plans
+
+NI = pytest.importorskip("mosca.lib.NI", reason="mosca.lib.NI is not built (MOSCA_NI_STUB=1)")
+
+STUB_SIGNAL_FREQ   = 10.0 # see mosca/lib/stub/nidaqmx_stub.c
+STUB_DIGITAL_SHIFT = 4
+
+def expected(rows, nchan, rate):
+    t = np.arange(rows).reshape((-1,1))/rate
+    return np.sin(2*np.pi*(STUB_SIGNAL_FREQ*t + np.arange(nchan).reshape((1,-1))/nchan))
+
+def acquire(board, seconds, consumer=None):
+    from pyqtgraph.Qt import QtCore
+    chunks, words = [], []
+    def receive(data):
+        chunks.append(data.copy())
+        if consumer is not None:
+            consumer(data)
+    board.plan = plans.AcquisitionPlan(board)
+    board.dataAvailable.connect(receive, QtCore.Qt.DirectConnection)
+    board.digitalAvailable.connect(lambda data: words.append(data.copy()), QtCore.Qt.DirectConnection)
+    board.prepare()
+    board.start()
+    time.sleep(seconds)
+    board.stop()
+    return chunks, words
+
+def make_board(nchan=2, rate=20000, interval=200, batch=1):
+    board = NI.Board('Dev1', boardtype='NI6321')
+    for i, ch in enumerate(board.channels.values()):
+        ch.inuse = (i < nchan)
+    board.rate, board.interval, board.batch = rate, interval, batch
+    return board
+
+@pytest.mark.parametrize('batch', [1, 5])
+def test_batched_delivery_is_contiguous(qapp, batch):
+    board  = make_board(batch=batch)
+    chunks, words = acquire(board, 0.5)
+    assert len(chunks) > 0
+    assert all(chunk.shape[0] % board.interval == 0 for chunk in chunks)
+    data = np.concatenate(chunks)
+    assert np.allclose(data, expected(data.shape[0], 2, board.rate))
+
+def test_slow_consumer_does_not_lose_chunks(qapp):
+    board  = make_board(interval=100)
+    chunks, words = acquire(board, 0.6, consumer=lambda data: time.sleep(0.05))
+    data = np.concatenate(chunks)
+    assert data.shape[0] >= 10*board.interval
+    assert np.allclose(data, expected(data.shape[0], 2, board.rate))
+
+def test_digital_words_follow_the_samples(qapp):
+    board = make_board()
+    port  = next(iter(board.ports.values()))
+    port.inuse = True
+    chunks, words = acquire(board, 0.3)
+    words = np.concatenate(words)
+    rows  = sum(chunk.shape[0] for chunk in chunks)
+    assert words.shape == (rows, 1)
+    assert np.array_equal(words[:, 0], (np.arange(rows) >> STUB_DIGITAL_SHIFT).astype(np.uint8))
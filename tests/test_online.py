@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from conftest import split_points
+from mosca import events, averaging, digital
+
+##
+## the online processing must not depend on how the samples are cut into chunks
+##
+
+def feed(process, data, bounds):
+    return [process(chunk) for chunk in np.split(data, bounds)]
+
+def spikes(rows=20000, nchan=3, seed=1):
+    rng  = np.random.default_rng(seed)
+    data = rng.normal(size=(rows, nchan))
+    for ch in range(nchan):
+        for t in rng.choice(np.arange(100, rows - 100), size=30, replace=False):
+            data[t:t+3, ch] -= 40.0
+    return data
+
+@pytest.mark.parametrize('count', [1, 7, 150])
+def test_threshold_detector_chunking(count):
+    data  = spikes()
+    whole = events.ThresholdDetector(3, 10000, threshold=8).process(data)
+    split = np.concatenate(feed(events.ThresholdDetector(3, 10000, threshold=8).process, data,
+                                split_points(data.shape[0], count)))
+    assert whole.shape[0] > 0
+    assert np.array_equal(np.sort(whole['sample']), np.sort(split['sample']))
+    order = np.lexsort((split['channel'], split['sample']))
+    worder = np.lexsort((whole['channel'], whole['sample']))
+    assert np.array_equal(whole['snippet'][worder], split['snippet'][order])
+
+def test_threshold_detector_refractory():
+    data = np.zeros((1000, 1))
+    data[::2] = 1.0 # a MAD of 0.5
+    data[500:520] = -100.0 # one long crossing, then a second one within the refractory period
+    data[505] = 0.0
+    found = events.ThresholdDetector(1, 1000, threshold=5, refractory=10).process(data)
+    assert list(found['sample']) == [500]
+
+@pytest.mark.parametrize('mode', ['trigger', 'period'])
+@pytest.mark.parametrize('count', [1, 9, 200])
+def test_sweep_averager_chunking(mode, count):
+    rng  = np.random.default_rng(2)
+    data = rng.normal(size=(30000, 2))
+    data[np.arange(500, 30000, 1700), 0] = 5.0
+    whole = averaging.SweepAverager(2, 1000, mode=mode, sweep=100, pre=10, period=333)
+    split = averaging.SweepAverager(2, 1000, mode=mode, sweep=100, pre=10, period=333)
+    whole.process(data)
+    feed(split.process, data, split_points(data.shape[0], count))
+    assert whole.count > 0
+    assert whole.count == split.count
+    assert np.allclose(whole.mean, split.mean)
+    assert np.allclose(whole.var, split.var)
+
+@pytest.mark.parametrize('count', [1, 13, 500])
+def test_extract_edges_chunking(count):
+    rng   = np.random.default_rng(3)
+    words = (rng.random((5000, 2)) < 0.05).astype(np.uint8)*rng.integers(0, 256, size=(5000, 2), dtype=np.uint8)
+    words = np.cumsum(words, axis=0, dtype=np.uint8) # sparse transitions
+    whole = digital.extract_edges(words)
+    parts, previous, offset = [], None, 0
+    for chunk in np.split(words, split_points(words.shape[0], count)):
+        parts.append(digital.extract_edges(chunk, previous, offset))
+        previous, offset = chunk[-1], offset + chunk.shape[0]
+    assert np.array_equal(whole, np.concatenate(parts))
+
+def test_extract_edges_values():
+    words = np.array([[0], [1], [3], [3], [2]], dtype=np.uint8)
+    edges = digital.extract_edges(words)
+    assert [tuple(e) for e in edges.tolist()] == [(1, 0, 0, True), (2, 0, 1, True), (4, 0, 0, False)]
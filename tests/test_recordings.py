@@ -0,0 +1,123 @@
+import os, time, types
+import numpy as np
+import pytest
+from mosca import recordings, mapreduce, convert, plans
+from conftest import run_driver
+
+def signal(rows=5000, nchan=3):
+    return np.sin(np.arange(rows*nchan, dtype=float).reshape((rows, nchan))/37)
+
+def crossings(chunk):
+    x    = chunk.data[:, 0]
+    rows = np.flatnonzero((x[:-1] < 0.5) & (x[1:] >= 0.5)) + 1 + chunk.offset
+    return rows[(rows >= chunk.start) & (rows < chunk.stop)]
+
+def total(chunk):
+    return chunk.core.sum(axis=0)
+
+def convert_opts(**kwargs):
+    opts = dict(format='npy', dtype='float64', full_scale=None, level=1, channels=None,
+                lowpass=None, highpass=None, taps=convert.DEFAULT_TAPS, decimate=1)
+    opts.update(kwargs)
+    return types.SimpleNamespace(**opts)
+
+def run_conversion(prefix, outdir, **kwargs):
+    os.makedirs(outdir, exist_ok=True)
+    conversion = convert.Conversion(prefix, str(outdir), convert_opts(**kwargs))
+    assert convert.run([conversion], 2, segmentrows=1000, chunkrows=300) == 0
+    return recordings.Recording(conversion.target.prefix)
+
+def test_npy_reader(write_recording):
+    data   = signal()
+    reader = recordings.Recording(write_recording(data)).reader()
+    assert reader.rows == data.shape[0]
+    assert np.array_equal(reader.read(1000), data[:1000])
+    assert np.array_equal(reader.view(10, 20, [2, 0]), data[10:20][:, [2, 0]])
+    reader.close()
+
+def test_columns_reader_views_a_single_column(write_recording, tmp_path):
+    data   = signal()
+    target = run_conversion(write_recording(data), tmp_path / "out", format='columns')
+    reader = target.reader()
+    try:
+        single = reader.view(10, 20, [1])
+        assert np.shares_memory(single, reader.columns[1].data)
+        assert np.array_equal(single, data[10:20, [1]])
+        merged = reader.view(10, 20, [2, 0])
+        assert not any(np.shares_memory(merged, column.data) for column in reader.columns)
+        assert np.array_equal(merged, data[10:20][:, [2, 0]])
+    finally:
+        reader.close()
+
+@pytest.mark.parametrize('chunkrows', [97, 1000, 10000])
+def test_map_chunks_does_not_depend_on_the_chunks(write_recording, chunkrows):
+    data   = signal()
+    prefix = write_recording(data)
+    expect = crossings(mapreduce.Chunk(data, 0, 0, 0, data.shape[0], 1000))
+    found  = mapreduce.map_chunks(prefix + ".cfg", crossings, chunkrows=chunkrows, halo=1, jobs=0)
+    assert np.array_equal(found, expect)
+    summed = mapreduce.map_chunks(prefix + ".cfg", total, reduce='sum', chunkrows=chunkrows, jobs=0)
+    assert np.allclose(summed, data.sum(axis=0))
+
+def test_map_chunks_selects_the_channels(write_recording):
+    data   = signal()
+    prefix = write_recording(data, names=['a', 'b', 'c'])
+    found  = mapreduce.map_chunks(prefix, total, reduce='sum', chunkrows=700, channels=['c', 'a'], jobs=0)
+    assert np.allclose(found, data[:, [2, 0]].sum(axis=0))
+
+@pytest.mark.parametrize('fmt', ['npy', 'zdat', 'columns'])
+def test_convert_round_trip(write_recording, tmp_path, fmt):
+    data   = signal()
+    target = run_conversion(write_recording(data), tmp_path / "out", format=fmt)
+    reader = target.reader()
+    try:
+        assert np.array_equal(reader.read(data.shape[0]), data)
+    finally:
+        reader.close()
+    # the streaming and the random-access chunks agree
+    found = mapreduce.map_chunks(target.prefix, crossings, chunkrows=333, halo=1, jobs=0)
+    assert np.array_equal(found, crossings(mapreduce.Chunk(data, 0, 0, 0, data.shape[0], 1000)))
+
+def test_convert_int16(write_recording, tmp_path):
+    data   = signal()
+    target = run_conversion(write_recording(data), tmp_path / "out", dtype='int16')
+    reader = target.reader()
+    try:
+        restored = reader.read(data.shape[0])*target.quantization
+    finally:
+        reader.close()
+    assert np.abs(restored - data).max() <= target.quantization.max()
+
+def test_playback_keeps_the_repeated_names_apart(qapp, write_recording):
+    data   = signal(rows=2000)
+    driver = recordings.PlaybackDeviceDriver(write_recording(data, names=['a', 'a', 'b']), speed=0)
+    driver.interval = 500
+    assert list(driver.channels.keys()) == ['a', 'a#1', 'b']
+    assert plans.AcquisitionPlan(driver).titles == ('a', 'a#1', 'b')
+    chunks = run_driver(qapp, driver, 0.3)
+    assert np.array_equal(np.concatenate(chunks), data)
+
+def test_playback_waits_for_the_consumers(qapp, write_recording):
+    from pyqtgraph.Qt import QtCore
+    class Consumer(QtCore.QObject):
+        consumed = 0
+        def update(self, data):
+            time.sleep(0.01)
+            Consumer.consumed += 1
+    driver   = recordings.PlaybackDeviceDriver(write_recording(signal(rows=100000)), speed=0, maxinflight=4)
+    driver.interval = 100
+    thread   = QtCore.QThread()
+    consumer = Consumer()
+    consumer.moveToThread(thread)
+    thread.start()
+    ahead = []
+    driver.dataAvailable.connect(consumer.update, QtCore.Qt.QueuedConnection)
+    driver.dataAvailable.connect(lambda data: ahead.append(driver._sent//100 - Consumer.consumed),
+                                 QtCore.Qt.DirectConnection)
+    try:
+        run_driver(qapp, driver, 0.5)
+    finally:
+        thread.quit()
+        thread.wait()
+    assert Consumer.consumed > 0
+    assert max(ahead) <= 4 + 1 # (a chunk may be released right before it is counted)
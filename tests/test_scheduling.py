@@ -0,0 +1,42 @@
+import os, threading
+import pytest
+from mosca import scheduling
+
+def run_stage(stage):
+    """applies `stage` in a new thread, and returns its (policy, priority, CPUs)."""
+    found = {}
+    def worker():
+        scheduling.apply(stage)
+        found['current'] = scheduling._current()
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    return found['current']
+
+@pytest.fixture
+def stages():
+    if scheduling._current() is None:
+        pytest.skip("the scheduling settings are not available on this platform")
+    def _setup(settings):
+        scheduling.setup({'scheduling': settings})
+        return scheduling._defaults
+    yield _setup
+    scheduling.restore_defaults('test')
+    scheduling.setup({})
+
+def test_unconfigured_stages_do_not_inherit_the_policy(stages):
+    if 'batch' not in scheduling.POLICIES.keys():
+        pytest.skip("SCHED_BATCH is not available")
+    defaults = stages({'gui': {'policy': 'batch'}})
+    scheduling.apply('gui')
+    assert os.sched_getscheduler(0) == scheduling.POLICIES['batch']
+    assert run_stage('events')[:2] == defaults[:2]
+
+def test_unconfigured_stages_do_not_inherit_the_cpus(stages):
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < 2:
+        pytest.skip("needs at least 2 CPUs")
+    defaults = stages({'gui': {'cpus': cpus[:1]}})
+    scheduling.apply('gui')
+    assert os.sched_getaffinity(0) == set(cpus[:1])
+    assert run_stage('events')[2] == defaults[2]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from mosca import transport
+
+@pytest.fixture
+def ring():
+    ring = transport.SampleRing.create(100, 2)
+    yield ring
+    ring.close()
+
+def rows(start, stop):
+    return np.stack([np.arange(start, stop), -np.arange(start, stop)], axis=1).astype(float)
+
+def test_read_wraps_around(ring):
+    reader = ring.reader(latest=False)
+    ring.write(rows(0, 70))
+    assert np.array_equal(reader.read(), rows(0, 70))
+    ring.write(rows(70, 150))
+    assert np.array_equal(reader.read(), rows(70, 150))
+    assert reader.lost == 0
+
+def test_view_stops_at_the_end_of_the_ring(ring):
+    reader = ring.reader(latest=False)
+    ring.write(rows(0, 70))
+    reader.read()
+    ring.write(rows(70, 150))
+    first = reader.view()
+    assert np.array_equal(first, rows(70, 100))
+    assert reader.intact()
+    assert np.array_equal(reader.view(), rows(100, 150))
+    assert reader.view() is None
+
+def test_slow_reader_counts_the_lost_rows(ring):
+    reader = ring.reader(latest=False)
+    ring.write(rows(0, 60))
+    view = reader.view(maxrows=10)
+    ring.write(rows(60, 260))
+    assert not reader.intact()
+    assert np.array_equal(reader.read(), rows(160, 260))
+    assert reader.lost == 150
+    assert np.array_equal(view[:0], rows(0, 0)) # the stale view is only checked through intact()
+
+def test_readers_are_independent(ring):
+    early, late = ring.reader(latest=False), None
+    ring.write(rows(0, 30))
+    late = ring.reader(latest=True)
+    ring.write(rows(30, 40))
+    assert np.array_equal(early.read(), rows(0, 40))
+    assert np.array_equal(late.read(), rows(30, 40))
+
+def test_attached_ring_sees_the_writes(ring):
+    other  = transport.SampleRing.attach(ring.name)
+    try:
+        reader = other.reader(latest=False)
+        ring.write(rows(0, 5))
+        ring.mark_closed()
+        assert np.array_equal(reader.read(), rows(0, 5))
+        assert other.closed
+    finally:
+        other.close()